@@ -1,11 +1,11 @@
-from flask import Flask, request, send_file, jsonify, send_from_directory, Response
+from flask import Flask, request, send_file, jsonify, send_from_directory, Response, g
 from flask_cors import CORS
-import cv2
+import io
 import os
-import tempfile
 import json
-import importlib
 import sys
+import time
+import uuid
 
 print("📦 Imports réussis")
 
@@ -15,21 +15,37 @@ sys.path.insert(0, current_dir)
 
 print(f"📁 Répertoire courant: {current_dir}")
 
-import necklace2D
+from logging_setup import setup_logging
 
-print("🧠 Module necklace2D importé")
+setup_logging()
 
-# Forcer le rechargement du module
-importlib.reload(necklace2D)
+import necklace2D
+import necklace_cache
+import compositing
+import pipeline
+import result_cache
+import jobs
+import metrics
+import landmarks as landmarks_detection
+import live
+import prerender
+from warmup import warmup
 
-print("🔄 Module necklace2D rechargé")
+# Le modèle n'est pas chargé à l'import : voir warmup (préchauffage en arrière-plan)
+print("🧠 Module necklace2D importé")
 
 # Configuration des chemins
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(os.path.dirname(CURRENT_DIR))
-NECKLACE_PATH = os.path.join(PROJECT_ROOT, "data", "usefull_necklace", "necklace2k.png")
+NECKLACE_DIR = necklace_cache.NECKLACE_DIR
+NECKLACE_PATH = os.path.join(NECKLACE_DIR, "necklace2k.png")
+# Recalage des points de placement sur les bords du cou (désactivé par défaut)
+REFINE_HORIZONTAL = os.environ.get("NECK_HORIZONTAL_REFINE", "0") == "1"
 FRONTEND_DIST = os.path.join(PROJECT_ROOT, "frontend", "dist")
 
+# Préchargement des colliers (NECKLACE_PRELOAD) et du modèle : thread de préchauffage
+warmup.configure(NECKLACE_DIR)
+
 # Vérifier si le dossier dist existe
 DIST_EXISTS = os.path.exists(FRONTEND_DIST)
 print(f"📁 Dossier dist existe: {DIST_EXISTS}")
@@ -54,13 +70,13 @@ def serve_frontend():
         try:
             return send_from_directory(FRONTEND_DIST, 'index.html')
         except Exception as e:
-            print(f"❌ Erreur lors du service du frontend: {e}")
+            app.logger.error(f"❌ Erreur lors du service du frontend: {e}")
             return jsonify({"error": "Frontend non disponible", "message": str(e)}), 500
     else:
         return jsonify({
             "message": "Backend Flask opérationnel",
             "status": "Frontend non buildé",
-            "endpoints": ["/health", "/apply-necklace"]
+            "endpoints": ["/health", "/ready", "/metrics", "/apply-necklace", "/apply-necklaces", "/jobs/apply-necklace", "/live"]
         })
 
 # Route pour servir les assets du frontend (seulement si dist existe)
@@ -70,11 +86,24 @@ def serve_frontend_assets(filename):
         try:
             return send_from_directory(FRONTEND_DIST, filename)
         except Exception as e:
-            print(f"❌ Erreur lors du service de l'asset {filename}: {e}")
+            app.logger.warning(f"❌ Erreur lors du service de l'asset {filename}: {e}")
             return jsonify({"error": f"Asset {filename} non trouvé"}), 404
     else:
         return jsonify({"error": "Frontend non disponible"}), 404
 
+# Préchauffage lancé au plus tard à la première requête (gunicorn le lance dès le fork)
+@app.before_request
+def ensure_warmup_started():
+    g.request_start = time.perf_counter()
+    warmup.start()
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Prêt quand le modèle est chargé et a fait sa première inférence (503 sinon)."""
+    status = warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+# Ne touche pas au modèle : répond pendant le préchauffage
 @app.route("/health", methods=["GET"])
 def health():
     necklace_exists = os.path.exists(NECKLACE_PATH)
@@ -84,66 +113,394 @@ def health():
         "necklace_path": NECKLACE_PATH
     })
 
+@metrics.registry.register_collector
+def collect_runtime_metrics():
+    """Caches (succès / échecs / ratio) et profondeur des files, lus au moment du scrape."""
+    caches = {
+        "results": result_cache.result_cache.stats(),
+        "masks": result_cache.mask_cache.stats(),
+    }
+    hits, misses, ratios = [], [], []
+    for name, stats in caches.items():
+        for tier, count in stats["hits"].items():
+            hits.append(({"cache": name, "tier": tier}, count))
+        misses.append(({"cache": name}, stats["misses"]))
+        total_hits = sum(stats["hits"].values())
+        lookups = total_hits + stats["misses"]
+        ratios.append(({"cache": name}, total_hits / lookups if lookups else 0.0))
+    necklaces = necklace2D.necklace_cache.stats()
+    hits.append(({"cache": "necklaces", "tier": "memory"}, necklaces["hits"]))
+    misses.append(({"cache": "necklaces"}, necklaces["misses"]))
+    lookups = necklaces["hits"] + necklaces["misses"]
+    ratios.append(({"cache": "necklaces"}, necklaces["hits"] / lookups if lookups else 0.0))
+
+    queues = [
+        ({"queue": "jobs"}, jobs.queue_depth()),
+        ({"queue": "inference"}, necklace2D.inference_queue_depth()),
+        ({"queue": "pipeline"}, pipeline.queue_depth()),
+    ]
+    return [
+        ("tryon_cache_hits_total", "counter", "Succès de cache par cache et niveau.", hits),
+        ("tryon_cache_misses_total", "counter", "Échecs de cache.", misses),
+        ("tryon_cache_hit_ratio", "gauge", "Part des lectures servies par le cache.", ratios),
+        ("tryon_queue_depth", "gauge", "Éléments en attente par file (jobs, inference, pipeline).", queues),
+        ("tryon_warmup_ready", "gauge", "1 quand le préchauffage est terminé.", [({}, int(warmup.is_ready()))]),
+        ("tryon_live_sessions", "gauge", "Flux en direct ouverts (/live).", [({}, live.active_sessions())]),
+    ]
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "Métriques désactivées"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def send_jpeg(data, cache_status=None):
+    response = send_file(
+        io.BytesIO(data),
+        mimetype='image/jpeg',
+        as_attachment=True,
+        download_name='processed.jpg'
+    )
+    if cache_status:
+        response.headers['X-Cache'] = cache_status
+    return response
+
+def resolve_necklace_path(necklace_name):
+    """Chemin d'un collier du catalogue, ou None (nom inconnu ou hors du dossier)."""
+    if not necklace_name or os.path.basename(necklace_name) != necklace_name:
+        return None
+    necklace_path = os.path.join(NECKLACE_DIR, necklace_name)
+    return necklace_path if os.path.exists(necklace_path) else None
+
+def parse_tryon_request():
+    """Valide le formulaire d'essayage ; retourne (paramètres, None) ou (None, réponse d'erreur)."""
+    if 'image' not in request.files:
+        app.logger.error("Aucune image reçue dans la requête.")
+        return None, (jsonify({"error": "Aucune image reçue"}), 400)
+
+    # Vérification des autres paramètres
+    necklace_name = request.form.get('necklace', 'necklace2k.png')
+    landmarks_json = request.form.get("landmarks")
+
+    # Sans landmarks, détection côté serveur si mediapipe est disponible
+    if not landmarks_json and not landmarks_detection.available():
+        app.logger.error("Aucun landmark reçu dans la requête.")
+        return None, (jsonify({"error": "Aucun landmark reçu"}), 400)
+
+    # Log des données reçues (échantillonné ; les landmarks eux-mêmes ne sont pas journalisés)
+    app.logger.info("Requête reçue", extra={
+        "event": "request", "necklace": necklace_name, "has_landmarks": bool(landmarks_json),
+    })
+
+    # Définir le chemin du collier
+    necklace_path = resolve_necklace_path(necklace_name)
+    if necklace_path is None:
+        app.logger.error(f"Collier introuvable: {necklace_name}")
+        return None, (jsonify({"error": f"Collier introuvable: {necklace_name}"}), 400)
+
+    return {
+        "image_bytes": request.files['image'].read(),
+        "necklace_path": necklace_path,
+        # Charger les landmarks (None : détectés par le serveur)
+        "landmarks": json.loads(landmarks_json) if landmarks_json else None,
+        "is_example": request.form.get('is_example', 'false').lower() == 'true',
+    }, None
+
+def render_tryon(image_bytes, necklace_path, landmarks, is_example=False):
+    """
+    Rendu d'un essayage en JPEG : retourne (octets, statut du cache, durées par
+    étape), ou (None, None, durées) si l'image est illisible.
+    """
+    # Cache adressé par contenu : même photo + même collier + mêmes landmarks
+    image_hash = result_cache.hash_bytes(image_bytes)
+    cache_key = None
+    if result_cache.RESULT_CACHE_ENABLED:
+        cache_key = result_cache.result_key(
+            image_hash, necklace_path, landmarks, refine_horizontal=REFINE_HORIZONTAL
+        )
+        cached = result_cache.result_cache.get(cache_key)
+        if cached is not None:
+            metrics.RENDERS.inc(necklace=os.path.basename(necklace_path), result="cache_hit")
+            return cached, "HIT", {}
+
+    # Décodage unique en mémoire, puis landmarks et masque en parallèle (voir pipeline)
+    try:
+        results, timings = pipeline.run_tryon(
+            image_bytes,
+            [necklace_path],
+            landmarks,
+            refine_horizontal=REFINE_HORIZONTAL,
+            image_hash=image_hash if result_cache.RESULT_CACHE_ENABLED else None
+        )
+    except pipeline.UnreadableImage:
+        return None, None, {}
+    _, result_bytes = results[0]
+    if isinstance(result_bytes, Exception):
+        raise result_bytes
+
+    if cache_key is not None:
+        result_cache.result_cache.put(cache_key, result_bytes)
+    return result_bytes, "MISS" if cache_key else None, timings
+
+def server_timing(response, timings):
+    """En-tête Server-Timing (visible dans les outils de développement du navigateur)."""
+    target = response[0] if isinstance(response, tuple) else response
+    if timings:
+        target.headers['Server-Timing'] = ", ".join(
+            f"{name};dur={duration:.1f}" for name, duration in timings.items()
+        )
+    return response
+
+def prerendered_example():
+    """Photo d'exemple déjà rendue au build (voir prerender.py) : réponse directe, ou None."""
+    if not prerender.PRERENDER_ENABLED or request.form.get('is_example', 'false').lower() != 'true':
+        return None
+    necklace_name = request.form.get('necklace', 'necklace2k.png')
+    if resolve_necklace_path(necklace_name) is None:
+        return None
+    path = prerender.prerendered.lookup(request.form.get('example'), necklace_name)
+    if path is None:
+        return None
+    metrics.RENDERS.inc(necklace=necklace_name, result="prerendered")
+    with open(path, "rb") as f:
+        return send_jpeg(f.read(), cache_status="PRERENDERED")
+
 @app.route("/apply-necklace", methods=["POST"])
 def apply_necklace_endpoint():
+    try:
+        response = prerendered_example()
+        if response is not None:
+            return response
+        parse_start = time.perf_counter()
+        with metrics.timer("upload_parse"):
+            params, error = parse_tryon_request()
+        if error:
+            return error
+        parse_ms = (time.perf_counter() - parse_start) * 1000
+
+        result_bytes, cache_status, timings = render_tryon(**params)
+        if result_bytes is None:
+            app.logger.error("Image reçue illisible.")
+            return jsonify({"error": "Image illisible"}), 400
+        return server_timing(send_jpeg(result_bytes, cache_status=cache_status), {"upload_parse": parse_ms, **timings})
+
+    except Exception as e:
+        app.logger.error(f"Erreur lors du traitement de la requête: {str(e)}")
+        return jsonify({"error": "Erreur interne du serveur", "message": str(e)}), 500
+
+def render_tryon_job(**params):
+    """Variante pour la file asynchrone : une image illisible fait échouer le travail."""
+    result_bytes, cache_status, _ = render_tryon(**params)
+    if result_bytes is None:
+        raise ValueError("Image illisible")
+    return result_bytes, cache_status
+
+def job_status(job):
+    status = {key: job[key] for key in ("id", "status", "created", "started", "finished", "error")}
+    status["status_url"] = f"/jobs/{job['id']}"
+    status["result_url"] = f"/jobs/{job['id']}/result"
+    return status
+
+@app.route("/jobs/apply-necklace", methods=["POST"])
+def submit_apply_necklace_job():
+    """Mode asynchrone : le rendu part dans la file, la réponse (202) porte l'id du travail."""
+    if not jobs.JOBS_ENABLED:
+        return jsonify({"error": "Mode asynchrone désactivé"}), 404
+    try:
+        with metrics.timer("upload_parse"):
+            params, error = parse_tryon_request()
+        if error:
+            return error
+
+        job_queue = jobs.get_job_queue()
+        try:
+            job_id = job_queue.submit(render_tryon_job, **params)
+        except jobs.QueueFull as e:
+            app.logger.warning(f"File de rendus pleine: {e}")
+            response = jsonify({"error": "Trop de rendus en attente, réessayez plus tard"})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+
+        response = jsonify(job_status(job_queue.get(job_id)))
+        response.headers['Location'] = f"/jobs/{job_id}"
+        return response, 202
+
+    except Exception as e:
+        app.logger.error(f"Erreur lors de la soumission du rendu: {str(e)}")
+        return jsonify({"error": "Erreur interne du serveur", "message": str(e)}), 500
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get_job_queue().get(job_id) if jobs.JOBS_ENABLED else None
+    if job is None:
+        return jsonify({"error": "Travail inconnu ou expiré"}), 404
+    return jsonify(job_status(job))
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    job = jobs.get_job_queue().get(job_id, with_result=True) if jobs.JOBS_ENABLED else None
+    if job is None:
+        return jsonify({"error": "Travail inconnu ou expiré"}), 404
+    if job["status"] == jobs.DONE:
+        return send_jpeg(job["result"], cache_status=job["cache"])
+    if job["status"] == jobs.FAILED:
+        return jsonify({"error": "Erreur interne du serveur", "message": job["error"]}), 500
+    # Pas encore prêt : même corps que /jobs/<id>, à réinterroger plus tard
+    response = jsonify(job_status(job))
+    response.headers['Retry-After'] = '1'
+    return response, 202
+
+# Nombre maximal de colliers par essayage groupé
+MAX_NECKLACES_PER_REQUEST = int(os.environ.get("MAX_NECKLACES_PER_REQUEST", "12"))
+
+def parse_necklace_list(form):
+    """Liste de colliers : champ `necklaces` répété, liste JSON ou noms séparés par des virgules."""
+    values = form.getlist('necklaces')
+    if len(values) == 1:
+        value = values[0].strip()
+        if value.startswith('['):
+            values = json.loads(value)
+        else:
+            values = value.split(',')
+    return [name.strip() for name in values if name and name.strip()]
+
+def multipart_response(parts):
+    """Réponse multipart/mixed : une partie par collier (image JPEG ou erreur JSON)."""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, payload, cache_status in parts:
+        body.write(f"--{boundary}\r\n".encode())
+        if isinstance(payload, bytes):
+            stem = os.path.splitext(name)[0]
+            body.write(b"Content-Type: image/jpeg\r\n")
+            body.write(f'Content-Disposition: attachment; name="{name}"; filename="{stem}.jpg"\r\n'.encode())
+            if cache_status:
+                body.write(f"X-Cache: {cache_status}\r\n".encode())
+            body.write(f"Content-Length: {len(payload)}\r\n\r\n".encode())
+            body.write(payload)
+        else:
+            error = json.dumps({"necklace": name, "error": payload}).encode()
+            body.write(b"Content-Type: application/json\r\n")
+            body.write(f'Content-Disposition: inline; name="{name}"\r\n\r\n'.encode())
+            body.write(error)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return Response(body.getvalue(), mimetype=f"multipart/mixed; boundary={boundary}")
+
+def sprite_response(parts, tile_width=None):
+    """Planche JPEG horizontale ; la position de chaque collier est dans X-Sprite-Layout."""
+    names, images, layout = [], [], []
+    for name, payload, _ in parts:
+        if isinstance(payload, bytes):
+            names.append(name)
+            images.append(necklace2D.decode_image(payload))
+        else:
+            layout.append({"necklace": name, "error": payload})
+    if not images:
+        return jsonify({"error": "Aucun collier n'a pu être appliqué", "details": layout}), 422
+    sprite, positions = compositing.build_sprite(images, tile_width)
+    for name, (x, y, width, height) in zip(names, positions):
+        layout.append({"necklace": name, "x": x, "y": y, "width": width, "height": height})
+    response = send_jpeg(necklace2D.encode_image(sprite))
+    response.headers['X-Sprite-Layout'] = json.dumps(layout)
+    return response
+
+@app.route("/apply-necklaces", methods=["POST"])
+def apply_necklaces_endpoint():
+    """Essayage de plusieurs colliers sur une photo : un seul masque, un seul placement."""
     try:
         if 'image' not in request.files:
             app.logger.error("Aucune image reçue dans la requête.")
             return jsonify({"error": "Aucune image reçue"}), 400
 
-        # Vérification des autres paramètres
-        necklace_name = request.form.get('necklace', 'necklace2k.png')
         landmarks_json = request.form.get("landmarks")
-
-        if not landmarks_json:
+        if not landmarks_json and not landmarks_detection.available():
             app.logger.error("Aucun landmark reçu dans la requête.")
             return jsonify({"error": "Aucun landmark reçu"}), 400
 
-        # Log des données reçues
-        app.logger.info(f"Requête reçue avec necklace: {necklace_name} et landmarks: {landmarks_json}")
-
-        # Définir le chemin du collier
-        necklace_path = os.path.join(PROJECT_ROOT, "data", "usefull_necklace", necklace_name)
-        if not os.path.exists(necklace_path):
-            app.logger.error(f"Collier introuvable: {necklace_name}")
-            return jsonify({"error": f"Collier introuvable: {necklace_name}"}), 400
-
-        # Charger les landmarks
-        landmarks = json.loads(landmarks_json)
-
-        uploaded_file = request.files['image']
-        is_example = request.form.get('is_example', 'false').lower() == 'true'
-
-        with tempfile.NamedTemporaryFile(suffix='.jpg') as temp_file:
-            uploaded_file.save(temp_file.name)
-
-            result_image = necklace2D.apply_necklace(
-                temp_file.name,
-                necklace_path=necklace_path,
-                landmarks=landmarks,  # <-- Passage des landmarks
-                color_match=False,
-                add_shadow=False,
-                is_example=is_example
-            )
-
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_output_path = os.path.join(temp_dir, "output.jpg")
-                cv2.imwrite(temp_output_path, result_image)
-
-                return send_file(
-                    temp_output_path,
-                    mimetype='image/jpeg',
-                    as_attachment=True,
-                    download_name='processed.jpg'
+        necklace_names = parse_necklace_list(request.form)
+        if not necklace_names:
+            return jsonify({"error": "Aucun collier demandé"}), 400
+        if len(necklace_names) > MAX_NECKLACES_PER_REQUEST:
+            return jsonify({"error": f"Maximum {MAX_NECKLACES_PER_REQUEST} colliers par requête"}), 400
+
+        necklace_paths = {name: resolve_necklace_path(name) for name in necklace_names}
+        unknown = [name for name, path in necklace_paths.items() if path is None]
+        if unknown:
+            app.logger.error(f"Colliers introuvables: {unknown}")
+            return jsonify({"error": f"Colliers introuvables: {', '.join(unknown)}"}), 400
+
+        output_format = request.form.get('format', 'multipart').lower()
+        if output_format not in ('multipart', 'sprite'):
+            return jsonify({"error": f"Format inconnu: {output_format}"}), 400
+        tile_width = request.form.get('tile_width', type=int)
+
+        with metrics.timer("upload_parse"):
+            landmarks = json.loads(landmarks_json) if landmarks_json else None
+            image_bytes = request.files['image'].read()
+        image_hash = result_cache.hash_bytes(image_bytes)
+
+        # Les rendus déjà en cache sont servis tels quels ; le reste partage un seul placement
+        rendered, cache_keys = {}, {}
+        for name in necklace_names:
+            if result_cache.RESULT_CACHE_ENABLED:
+                cache_keys[name] = result_cache.result_key(
+                    image_hash, necklace_paths[name], landmarks, refine_horizontal=REFINE_HORIZONTAL
+                )
+                cached = result_cache.result_cache.get(cache_keys[name])
+                if cached is not None:
+                    metrics.RENDERS.inc(necklace=name, result="cache_hit")
+                    rendered[name] = (cached, "HIT")
+
+        missing = [name for name in necklace_names if name not in rendered]
+        timings = {}
+        if missing:
+            try:
+                results, timings = pipeline.run_tryon(
+                    image_bytes,
+                    [necklace_paths[name] for name in missing],
+                    landmarks,
+                    refine_horizontal=REFINE_HORIZONTAL,
+                    image_hash=image_hash if result_cache.RESULT_CACHE_ENABLED else None
                 )
+            except pipeline.UnreadableImage:
+                app.logger.error("Image reçue illisible.")
+                return jsonify({"error": "Image illisible"}), 400
+
+            for name, (_, result_bytes) in zip(missing, results):
+                if isinstance(result_bytes, Exception):
+                    rendered[name] = (str(result_bytes), None)
+                    continue
+                if name in cache_keys:
+                    result_cache.result_cache.put(cache_keys[name], result_bytes)
+                rendered[name] = (result_bytes, "MISS" if name in cache_keys else None)
+
+        parts = [(name, *rendered[name]) for name in necklace_names]
+        if output_format == 'sprite':
+            return server_timing(sprite_response(parts, tile_width), timings)
+        return server_timing(multipart_response(parts), timings)
 
     except Exception as e:
         app.logger.error(f"Erreur lors du traitement de la requête: {str(e)}")
         return jsonify({"error": "Erreur interne du serveur", "message": str(e)}), 500
 
+# Essayage en direct sur WebSocket (flask-sock optionnel)
+live.register(app, resolve_necklace_path, refine_horizontal=REFINE_HORIZONTAL)
+
 @app.after_request
 def log_response_details(response):
-    app.logger.info(f"Réponse envoyée : Status {response.status_code}, Content-Length {response.headers.get('Content-Length')}")
+    start = g.get("request_start")
+    duration = time.perf_counter() - start if start is not None else None
+    if duration is not None and metrics.METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_DURATION.observe(duration, route=route, method=request.method, status=response.status_code)
+    # Échantillonné et filtré par route (assets et sondes : WARNING seulement), voir logging_setup
+    app.logger.info("Réponse envoyée", extra={
+        "event": "response",
+        "status": response.status_code,
+        "content_length": response.headers.get("Content-Length"),
+        "duration_ms": round(duration * 1000, 1) if duration is not None else None,
+    })
     return response
 
 if __name__ == "__main__":
@@ -161,6 +518,10 @@ if __name__ == "__main__":
         
         print(f"🌐 Démarrage sur le port: {port}")
         print(f"🔧 Mode debug: {debug}")
+
+        # Avec le rechargeur de Flask, seul le processus qui sert les requêtes préchauffe
+        if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            warmup.start()
         
         app.run(host='0.0.0.0', port=port, debug=debug)
     except Exception as e:
@@ -0,0 +1,185 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+
+import cv2
+import numpy as np
+
+from compositing import BLUR_KSIZE, BLUR_SIGMA
+
+# === Colliers compilés : rognés, projetables en mémoire ===
+# Un PNG du catalogue devient data/usefull_necklace/compiled/<nom>.nkl :
+#   - pleine résolution, rognée à la boîte englobante de l'alpha, plus une
+#     marge transparente où le halo du flou prend la couleur des pixels
+#     transparents, comme avec le PNG ;
+#   - données brutes, non compressées, alignées sur une page : le fichier est
+#     ouvert par np.memmap, sans décodage, et partagé entre les workers par le
+#     cache de pages du système.
+# La texture d'une largeur de sortie est tirée de cette image puis adoucie à
+# cette échelle (feather_premultiplied) ; necklace_cache la garde en cache pour
+# les requêtes suivantes à la même largeur.
+# Le fichier garde le hash du PNG source : un PNG modifié rend le compilé périmé.
+MAGIC = b"NKLA"
+FORMAT_VERSION = 3
+ALIGN = 4096
+COMPILED_DIRNAME = "compiled"
+COMPILED_EXTENSION = ".nkl"
+# Plus forte réduction (largeur de sortie / largeur du PNG) dont le halo garde
+# la couleur des pixels transparents du PNG ; en deçà, ces pixels sont noirs
+MIN_TEXTURE_SCALE = 0.1
+_PREFIX = struct.Struct("<4sII")  # magic, version, longueur de l'en-tête JSON
+
+
+def compiled_path(png_path):
+    """Emplacement du collier compilé correspondant à un PNG du catalogue."""
+    folder, name = os.path.split(os.path.abspath(png_path))
+    return os.path.join(folder, COMPILED_DIRNAME, os.path.splitext(name)[0] + COMPILED_EXTENSION)
+
+
+def source_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def trim_margin(ksize=BLUR_KSIZE, min_scale=MIN_TEXTURE_SCALE):
+    """Marge gardée autour de l'alpha : le flou déborde de ksize // 2 pixels de sortie."""
+    return int(np.ceil((ksize // 2) / min_scale))
+
+
+def trim(collar, margin=None):
+    """Collier BGRA -> (données rognées à l'alpha + marge, origine (x, y) dans le canevas)."""
+    margin = trim_margin() if margin is None else margin
+    height, width = collar.shape[:2]
+    ys, xs = np.nonzero(collar[:, :, 3])
+    if len(xs) == 0:
+        raise ValueError("Collier entièrement transparent")
+    x0, y0 = max(xs.min() - margin, 0), max(ys.min() - margin, 0)
+    x1, y1 = min(xs.max() + 1 + margin, width), min(ys.max() + 1 + margin, height)
+    return collar[y0:y1, x0:x1], (int(x0), int(y0))
+
+
+def feather_premultiplied(texture, ksize=BLUR_KSIZE, sigma=BLUR_SIGMA):
+    """
+    Texture BGRA à l'échelle de sortie -> BGRA dont l'alpha est adouci (même
+    flou que le chemin PNG) et la couleur prémultipliée par cet alpha.
+    """
+    alpha = cv2.GaussianBlur(texture[:, :, 3].astype(np.float32) / 255.0, (ksize, ksize), sigma)
+    feathered = np.empty(texture.shape, dtype=np.uint8)
+    feathered[:, :, :3] = np.rint(texture[:, :, :3] * alpha[:, :, np.newaxis])
+    feathered[:, :, 3] = np.rint(alpha * 255.0)
+    return feathered
+
+
+def compile_necklace(png_path, output_path=None):
+    """Compile un PNG RGBA ; écriture atomique (les workers gardent l'ancien fichier projeté)."""
+    output_path = output_path or compiled_path(png_path)
+    collar = cv2.imread(png_path, cv2.IMREAD_UNCHANGED)
+    if collar is None or collar.ndim != 3 or collar.shape[2] != 4:
+        raise ValueError(f"PNG RGBA illisible: {png_path}")
+    margin = trim_margin()
+    data, origin = trim(collar, margin)
+
+    header = json.dumps({
+        "source": os.path.basename(png_path),
+        "source_sha256": source_hash(png_path),
+        "source_bytes": os.path.getsize(png_path),
+        "canvas": [collar.shape[1], collar.shape[0]],
+        "origin": list(origin),
+        "shape": list(data.shape),
+        "margin": margin,
+    }).encode()
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.seek(_align(_PREFIX.size + len(header)))
+        f.write(np.ascontiguousarray(data).tobytes())
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class CompiledNecklace:
+    """Collier compilé projeté en mémoire."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"Format de collier compilé inconnu: {path}")
+            self.header = json.loads(f.read(header_len))
+        start = _align(_PREFIX.size + header_len)
+        shape = tuple(self.header["shape"])
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="r")
+        self.data = self._mmap[start:start + int(np.prod(shape))].reshape(shape)  # BGRA, lecture seule
+        self.origin = tuple(self.header["origin"])   # coin haut-gauche des données dans le canevas
+        self.canvas = tuple(self.header["canvas"])   # (largeur, hauteur) du PNG complet
+
+    def is_current(self, png_path, png_hash=None):
+        """Compilé à partir de ce PNG, avec la marge du flou actuel ?"""
+        if self.header["margin"] != trim_margin():
+            return False
+        if self.header["source_bytes"] != os.path.getsize(png_path):
+            return False
+        return self.header["source_sha256"] == (png_hash or source_hash(png_path))
+
+
+def load_compiled(png_path):
+    """Collier compilé à jour pour ce PNG, ou None (absent, illisible ou périmé)."""
+    path = compiled_path(png_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        compiled = CompiledNecklace(path)
+        return compiled if compiled.is_current(png_path) else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def compile_directory(directory, force=False):
+    """Compile les PNG d'un dossier dont le compilé manque ou est périmé."""
+    results = []
+    for name in sorted(os.listdir(directory)):
+        png_path = os.path.join(directory, name)
+        if not name.lower().endswith(".png") or not os.path.isfile(png_path):
+            continue
+        if not force and load_compiled(png_path) is not None:
+            results.append((name, "up_to_date", None))
+            continue
+        try:
+            results.append((name, "compiled", compile_necklace(png_path)))
+        except ValueError as e:
+            results.append((name, "error", str(e)))
+    return results
+
+
+def main():
+    from necklace_cache import NECKLACE_DIR
+
+    parser = argparse.ArgumentParser(description="Compilation des colliers (rognés, bruts, mmap)")
+    parser.add_argument("directory", nargs="?", default=NECKLACE_DIR)
+    parser.add_argument("--force", action="store_true", help="Tout recompiler")
+    args = parser.parse_args()
+
+    for name, status, detail in compile_directory(args.directory, args.force):
+        if status == "error":
+            print(f"⚠️ {name}: {detail}")
+            continue
+        compiled = CompiledNecklace(compiled_path(os.path.join(args.directory, name)))
+        kept = compiled.data.shape[0] * compiled.data.shape[1] / (compiled.canvas[0] * compiled.canvas[1])
+        icon = "✅" if status == "compiled" else "💤"
+        print(
+            f"{icon} {name}: {compiled.canvas[0]}x{compiled.canvas[1]} -> {compiled.data.shape[1]}x{compiled.data.shape[0]} "
+            f"({kept:.0%} de la surface)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import landmarks as landmarks_detection
+from necklace_cache import NECKLACE_DIR
+from render_workers import available_cores
+
+# === Essayage par lots (photos catalogue x colliers) ===
+# Remplace process_folder / process_folder_multiple_collars de newdir/ : un
+# processus par cœur, une seule détection (FaceMesh + YOLO) par photo pour tous
+# les colliers, colliers gardés en mémoire par chaque processus, parcours du
+# dossier au fil de l'eau (os.scandir) et journal de reprise : une photo déjà
+# traitée (même taille, même date, mêmes colliers) n'est pas refaite.
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+CHECKPOINT_NAME = "batch_manifest.jsonl"
+PROGRESS_EVERY = 5.0  # secondes
+
+
+def iter_images(root, recursive=False, exclude=None):
+    """(chemin, chemin relatif, stat) des photos, dans l'ordre du parcours, sans lister tout l'arbre d'avance."""
+    pending = [root]
+    while pending:
+        folder = pending.pop()
+        with os.scandir(folder) as entries:
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and os.path.abspath(entry.path) != exclude:
+                        subdirs.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield entry.path, os.path.relpath(entry.path, root), entry.stat()
+            pending.extend(sorted(subdirs, reverse=True))
+
+
+def output_name(rel_path, necklace):
+    """Même nommage que newdir/test2.py : <photo>__<collier>.jpg, sous-dossiers conservés."""
+    stem = os.path.splitext(rel_path)[0]
+    return f"{stem}__{os.path.splitext(necklace)[0]}.jpg"
+
+
+# === Journal de reprise ===
+def load_checkpoint(path):
+    """Dernier enregistrement de chaque photo ; une ligne tronquée (arrêt brutal) est ignorée."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record["image"]] = record
+    return done
+
+
+def pending_necklaces(record, stat, necklaces, retry_failed=False):
+    """Colliers encore à rendre pour une photo, d'après son dernier enregistrement."""
+    if record is None or record["size"] != stat.st_size or record["mtime_ns"] != stat.st_mtime_ns:
+        return list(necklaces)
+    outputs = record["necklaces"]
+    return [
+        name for name in necklaces
+        if name not in outputs or (retry_failed and "error" in outputs[name])
+    ]
+
+
+# === Processus de rendu ===
+def _init_worker():
+    """Un cœur par processus : OpenCV mono-thread, modèle chargé une fois avant la première photo."""
+    import cv2
+
+    cv2.setNumThreads(1)
+    import necklace2D
+
+    necklace2D.get_model()
+
+
+def _render_image(image_path, rel_path, necklace_paths, output_dir, sidecar_landmarks=True):
+    """Une photo, tous ses colliers : rendus écrits sur disque, enregistrement du journal retourné."""
+    import pipeline
+
+    start = time.perf_counter()
+    outputs = {}
+    timings = {}
+    try:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        landmarks = landmarks_detection.read_sidecar(image_path) if sidecar_landmarks else None
+        # Sans fichier voisin, FaceMesh doit être là : le dire plutôt qu'un faux « Aucun visage détecté »
+        if landmarks is None and not landmarks_detection.available():
+            raise RuntimeError(landmarks_detection.SIDECAR_MISSING_ERROR)
+        results, timings = pipeline.run_tryon(image_bytes, necklace_paths, landmarks)
+    except Exception as e:
+        results = [(path, e) for path in necklace_paths]
+    for path, result in results:
+        name = os.path.basename(path)
+        if isinstance(result, Exception):
+            outputs[name] = {"error": str(result)}
+            continue
+        target = os.path.join(output_dir, output_name(rel_path, name))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(result)
+        outputs[name] = {"output": os.path.relpath(target, output_dir)}
+    return {
+        "image": rel_path,
+        "necklaces": outputs,
+        "ms": (time.perf_counter() - start) * 1000,
+        "timings": {name: round(value, 1) for name, value in timings.items()},
+    }
+
+
+def run(image_dir, output_dir, necklace_dir=NECKLACE_DIR, necklaces=None, jobs=None,
+        recursive=False, retry_failed=False, limit=None, sidecar_landmarks=True):
+    jobs = jobs or available_cores()
+    names = necklaces or sorted(n for n in os.listdir(necklace_dir) if n.lower().endswith(".png"))
+    missing = [n for n in names if not os.path.exists(os.path.join(necklace_dir, n))]
+    if missing:
+        raise SystemExit(f"❌ Colliers introuvables: {', '.join(missing)}")
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_NAME)
+    done = load_checkpoint(checkpoint_path)
+    print(f"🧵 {jobs} processus, {len(names)} colliers, {len(done)} photos déjà dans le journal")
+
+    # Pas de sur-souscription : un processus par cœur, chacun mono-thread côté BLAS/torch
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    os.environ.setdefault("METRICS", "0")
+
+    stats = {"images": 0, "skipped": 0, "renders": 0, "failed_renders": 0, "failed_images": 0}
+    image_ms, stage_totals = [], {}
+    start = last_progress = time.perf_counter()
+
+    def record(result, stat):
+        rendered = result["necklaces"]
+        failures = sum("error" in output for output in rendered.values())
+        stats["images"] += 1
+        stats["renders"] += len(rendered) - failures
+        stats["failed_renders"] += failures
+        stats["failed_images"] += failures == len(rendered)
+
+        # Reprise partielle (colliers ajoutés) : l'enregistrement garde les rendus précédents
+        result.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        previous = done.get(result["image"])
+        if previous is not None and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+            result["necklaces"] = {**previous["necklaces"], **rendered}
+        done[result["image"]] = result
+        checkpoint.write(json.dumps(result) + "\n")
+        checkpoint.flush()
+        image_ms.append(result["ms"])
+        for name, value in result["timings"].items():
+            stage_totals[name] = stage_totals.get(name, 0.0) + value
+
+    def progress():
+        elapsed = time.perf_counter() - start
+        print(
+            f"⏳ {stats['images']} photos ({stats['images'] / elapsed:.2f}/s), {stats['renders']} rendus "
+            f"({stats['renders'] / elapsed:.1f}/s), {stats['failed_renders']} échecs, {stats['skipped']} déjà faites"
+        )
+
+    exclude = os.path.abspath(output_dir)
+    with open(checkpoint_path, "a") as checkpoint, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+        in_flight = {}
+        submitted = 0
+        for image_path, rel_path, stat in iter_images(image_dir, recursive, exclude):
+            if limit is not None and submitted >= limit:
+                break
+            todo = pending_necklaces(done.get(rel_path), stat, names, retry_failed)
+            if not todo:
+                stats["skipped"] += 1
+                continue
+            # File bornée : le parcours avance au rythme du rendu
+            while len(in_flight) >= 2 * jobs:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future.result(), in_flight.pop(future))
+            future = pool.submit(
+                _render_image, image_path, rel_path,
+                [os.path.join(necklace_dir, n) for n in todo], output_dir, sidecar_landmarks
+            )
+            in_flight[future] = stat
+            submitted += 1
+            if time.perf_counter() - last_progress >= PROGRESS_EVERY:
+                progress()
+                last_progress = time.perf_counter()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record(future.result(), in_flight.pop(future))
+            if time.perf_counter() - last_progress >= PROGRESS_EVERY:
+                progress()
+                last_progress = time.perf_counter()
+
+    elapsed = time.perf_counter() - start
+    image_ms.sort()
+
+    def pct(q):
+        return image_ms[min(len(image_ms) - 1, int(q * len(image_ms)))] if image_ms else None
+
+    return {
+        **stats,
+        "jobs": jobs,
+        "necklaces": len(names),
+        "seconds": elapsed,
+        "images_per_s": stats["images"] / elapsed if elapsed else 0.0,
+        "renders_per_s": stats["renders"] / elapsed if elapsed else 0.0,
+        "image_p50_ms": pct(0.50),
+        "image_p95_ms": pct(0.95),
+        "stages_mean_ms": {name: total / stats["images"] for name, total in sorted(stage_totals.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Essayage par lots : chaque photo d'un dossier avec chaque collier")
+    parser.add_argument("images", help="Dossier des photos")
+    parser.add_argument("output", help="Dossier des rendus (journal de reprise inclus)")
+    parser.add_argument("--necklace-dir", default=NECKLACE_DIR)
+    parser.add_argument("--necklace", action="append", default=None, help="Collier à rendre (répétable ; défaut : tous)")
+    parser.add_argument("--jobs", type=int, default=None, help="Processus (défaut : cœurs disponibles)")
+    parser.add_argument("--recursive", action="store_true", help="Parcourir les sous-dossiers")
+    parser.add_argument("--retry-failed", action="store_true", help="Refaire les rendus en échec")
+    parser.add_argument("--no-sidecar-landmarks", action="store_true", help="Ignorer les <photo>.landmarks.json")
+    parser.add_argument("--limit", type=int, default=None, help="Nombre maximal de photos à rendre")
+    parser.add_argument("--report", default=None, help="Rapport JSON")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.images):
+        raise SystemExit(f"❌ Dossier introuvable: {args.images}")
+    result = run(
+        args.images, args.output, args.necklace_dir, args.necklace, args.jobs,
+        args.recursive, args.retry_failed, args.limit, not args.no_sidecar_landmarks,
+    )
+    print(
+        f"✅ {result['images']} photos, {result['renders']} rendus en {result['seconds']:.1f} s "
+        f"({result['images_per_s']:.2f} photos/s, {result['renders_per_s']:.1f} rendus/s), "
+        f"{result['failed_renders']} échecs, {result['skipped']} déjà faites"
+    )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Rapport écrit: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
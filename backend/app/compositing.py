@@ -0,0 +1,98 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# === Noyau de fusion alpha (float32, tampons réutilisés) ===
+# Au-delà de cette taille (par thread), les tampons ne sont pas conservés entre deux appels
+BUFFER_MAX_BYTES = int(os.environ.get("BLEND_BUFFER_MAX_MB", "32")) * 1024 * 1024
+
+# Adoucissement des bords du collier (flou gaussien de l'alpha)
+BLUR_KSIZE = 15
+BLUR_SIGMA = 5
+
+_INV_255 = np.float32(1.0 / 255.0)
+_local = threading.local()
+
+
+def _buffer(name, shape, dtype=np.float32):
+    """Tampon de travail propre au thread, agrandi au besoin puis réutilisé."""
+    count = int(np.prod(shape))
+    nbytes = count * np.dtype(dtype).itemsize
+    if nbytes > BUFFER_MAX_BYTES:
+        return np.empty(shape, dtype=dtype)
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    buf = buffers.get(name)
+    if buf is None or buf.size < count:
+        buf = buffers[name] = np.empty(count, dtype=dtype)
+    return buf[:count].reshape(shape)
+
+
+def feather_alpha(alpha, ksize, sigma):
+    """Alpha uint8 -> alpha float32 dans [0, 1], adouci par un flou gaussien."""
+    normalized = _buffer("alpha", alpha.shape)
+    np.multiply(alpha, _INV_255, out=normalized)
+    blurred = _buffer("blurred_alpha", alpha.shape)
+    cv2.GaussianBlur(normalized, (ksize, ksize), sigma, dst=blurred)
+    return blurred
+
+
+def blend_into(background, foreground, alpha):
+    """
+    Fusionne `foreground` (BGR ou BGRA uint8) dans `background` (BGR uint8, modifié
+    en place) : out = bg + (fg - bg) * alpha, sur les trois canaux d'un coup.
+    La conversion finale tronque comme l'ancien `.astype(np.uint8)`.
+    """
+    shape = background.shape[:2] + (3,)
+    fg = _buffer("foreground", shape)
+    bg = _buffer("background", shape)
+    np.copyto(fg, foreground[:, :, :3])
+    np.copyto(bg, background)
+    np.subtract(fg, bg, out=fg)
+    np.multiply(fg, alpha[:, :, np.newaxis], out=fg)
+    np.add(fg, bg, out=fg)
+    np.copyto(background, fg, casting="unsafe")
+    return background
+
+
+def blend_premultiplied_into(background, foreground):
+    """
+    Fusionne `foreground` (BGRA uint8, couleur déjà multipliée par l'alpha
+    adouci, voir asset_compiler) dans `background` (BGR uint8, modifié en
+    place) : out = bg * (255 - alpha) / 255 + fg. Sans division par l'alpha,
+    tout reste en uint8 (opérations saturées d'OpenCV, à 1 près du calcul flottant).
+    """
+    inverse_alpha = cv2.cvtColor(cv2.bitwise_not(cv2.extractChannel(foreground, 3)), cv2.COLOR_GRAY2BGR)
+    cv2.multiply(background, inverse_alpha, dst=background, scale=1 / 255)
+    cv2.add(background, cv2.cvtColor(foreground, cv2.COLOR_BGRA2BGR), dst=background)
+    return background
+
+
+# === Planche (sprite) de plusieurs rendus ===
+def build_sprite(images, tile_width=None):
+    """
+    Aligne les images horizontalement (redimensionnées à `tile_width` si fourni,
+    sinon à la largeur de la première). Retourne (planche, positions) où chaque
+    position est (x, y, largeur, hauteur).
+    """
+    if not images:
+        raise ValueError("Aucune image pour la planche")
+    tile_width = int(tile_width or images[0].shape[1])
+    tiles = []
+    for image in images:
+        h, w = image.shape[:2]
+        if w != tile_width:
+            tile_height = max(1, int(round(h * tile_width / w)))
+            image = cv2.resize(image, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+        tiles.append(image)
+    height = max(tile.shape[0] for tile in tiles)
+    sprite = np.zeros((height, tile_width * len(tiles), 3), dtype=np.uint8)
+    layout = []
+    for i, tile in enumerate(tiles):
+        x = i * tile_width
+        sprite[:tile.shape[0], x:x + tile_width] = tile
+        layout.append((x, 0, tile_width, tile.shape[0]))
+    return sprite, layout
@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class SchedulerClosed(RuntimeError):
+    pass
+
+
+class InferenceScheduler:
+    """
+    Regroupe les demandes d'inférence concurrentes en micro-lots.
+
+    Chaque requête dépose son entrée et reçoit un Future. Un thread unique
+    attend au plus `max_wait_ms` après la première entrée pour compléter un lot
+    de `max_batch_size` éléments, appelle `predict_batch(liste)` une seule fois
+    et renvoie à chaque Future le résultat de même rang. Les appels au modèle
+    sont ainsi sérialisés sur un seul thread.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=4, max_wait_ms=5.0, name="neck-inference"):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_started(self):
+        # Appelé sous self._lock
+        if self._closed:
+            raise SchedulerClosed("Planificateur d'inférence arrêté")
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        # Même verrou que close() : aucune entrée ne peut passer derrière le
+        # signal d'arrêt, où son Future ne serait jamais résolu
+        with self._lock:
+            self._ensure_started()
+            self._queue.put((item, future))
+        return future
+
+    def predict(self, item, timeout=None):
+        return self.submit(item).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Les entrées déjà déposées sont traitées ; submit() lève ensuite SchedulerClosed."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.predict_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError("Le modèle n'a pas renvoyé un résultat par image")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,209 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from result_cache import CACHE_DIR
+
+# === File de rendus asynchrones (soumission -> id, puis consultation) ===
+# Désactivée par défaut : activée par le déploiement qui la sert (render.yaml)
+JOBS_ENABLED = os.environ.get("ASYNC_JOBS", "0") == "1"
+# Rendus exécutés en parallèle ; au-delà, les travaux attendent dans la file
+JOB_WORKERS = max(1, int(os.environ.get("JOB_WORKERS", "1")))
+# Travaux en attente ou en cours au maximum ; au-delà, la soumission est refusée
+JOB_MAX_PENDING = max(1, int(os.environ.get("JOB_MAX_PENDING", "16")))
+# Durée de conservation d'un travail terminé (secondes)
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "600"))
+# "memory" (un seul worker gunicorn) ou "sqlite" (résultats partagés entre workers)
+JOB_STORE = os.environ.get("JOB_STORE", "memory")
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class MemoryJobStore:
+    """États et résultats des travaux en mémoire ; les travaux terminés expirent après `ttl`."""
+
+    def __init__(self, ttl=JOB_RESULT_TTL):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id):
+        with self._lock:
+            self._jobs[job_id] = {"id": job_id, "status": QUEUED, "created": time.time(),
+                                  "started": None, "finished": None, "error": None,
+                                  "cache": None, "result": None}
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def get(self, job_id, with_result=False):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or self._expired(job, time.time()):
+                return None
+            job = dict(job)
+        if not with_result:
+            job.pop("result")
+        return job
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [k for k, job in self._jobs.items() if self._expired(job, now)]:
+                del self._jobs[job_id]
+
+    def _expired(self, job, now):
+        return job["finished"] is not None and now - job["finished"] > self.ttl
+
+
+class SqliteJobStore:
+    """Même interface, dans une base SQLite : un autre worker gunicorn peut servir le résultat."""
+
+    COLUMNS = ("id", "status", "created", "started", "finished", "error", "cache", "result")
+
+    def __init__(self, path=JOB_DB_PATH, ttl=JOB_RESULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, created REAL, "
+                "started REAL, finished REAL, error TEXT, cache TEXT, result BLOB)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def create(self, job_id):
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, status, created) VALUES (?, ?, ?)",
+                       (job_id, QUEUED, time.time()))
+
+    def update(self, job_id, **fields):
+        names = [name for name in fields if name in self.COLUMNS[1:]]
+        if not names:
+            return
+        with self._connect() as db:
+            db.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in names)} WHERE id = ?",
+                [fields[name] for name in names] + [job_id],
+            )
+
+    def get(self, job_id, with_result=False):
+        columns = self.COLUMNS if with_result else self.COLUMNS[:-1]
+        with self._connect() as db:
+            row = db.execute(
+                f"SELECT {', '.join(columns)} FROM jobs WHERE id = ? AND (finished IS NULL OR finished >= ?)",
+                (job_id, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(columns, row))
+        if with_result and job["result"] is not None:
+            job["result"] = bytes(job["result"])
+        return job
+
+    def purge(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                       (time.time() - self.ttl,))
+
+
+class JobQueue:
+    """
+    Pool borné de threads de rendu. `submit` rend la main tout de suite avec un
+    id ; la fonction soumise retourne (octets JPEG, statut du cache) et son
+    résultat — ou son erreur — est consigné dans le store.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tryon-job")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} rendus déjà en attente")
+            self._pending += 1
+        try:
+            self.store.purge()
+            job_id = uuid.uuid4().hex
+            self.store.create(job_id)
+            self._executor.submit(self._run, job_id, fn, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        return job_id
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, job_id, fn, args, kwargs):
+        self.store.update(job_id, status=RUNNING, started=time.time())
+        try:
+            result, cache_status = fn(*args, **kwargs)
+            self.store.update(job_id, status=DONE, finished=time.time(), result=result, cache=cache_status)
+            self.completed += 1
+        except Exception as e:
+            logger.error(f"❌ Rendu asynchrone en échec: {e}", extra={"event": "job_failed", "job_id": job_id})
+            self.store.update(job_id, status=FAILED, finished=time.time(), error=str(e))
+            self.failed += 1
+        finally:
+            self._release()
+
+    def get(self, job_id, with_result=False):
+        return self.store.get(job_id, with_result=with_result)
+
+    def queue_depth(self):
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.queue_depth(),
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """File partagée, créée au premier travail soumis (aucun thread si le mode n'est pas utilisé)."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            store = SqliteJobStore() if JOB_STORE == "sqlite" else MemoryJobStore()
+            _job_queue = JobQueue(store)
+        return _job_queue
+
+
+def queue_depth():
+    """Travaux en attente ou en cours (0 si la file n'a jamais servi)."""
+    return _job_queue.queue_depth() if _job_queue is not None else 0
@@ -0,0 +1,110 @@
+import json
+import os
+import queue
+import threading
+
+import cv2
+
+# === Détection des landmarks côté serveur (repli si le client n'en envoie pas) ===
+# Mêmes points MediaPipe FaceMesh que le frontend (PhotoTestView) et les scripts de newdir/
+SERVER_LANDMARKS = os.environ.get("SERVER_LANDMARKS", "1") == "1"
+# Instances FaceMesh réutilisables (une instance ne traite qu'une image à la fois)
+FACE_MESH_POOL_SIZE = max(1, int(os.environ.get("FACE_MESH_POOL_SIZE", "2")))
+LANDMARK_INDICES = {"left_ear": 234, "right_ear": 454, "chin": 152}
+
+_mediapipe = None
+_mediapipe_checked = False
+_import_lock = threading.Lock()
+
+
+def _face_mesh_module():
+    """Module mp.solutions.face_mesh, importé à la première utilisation ; None si mediapipe manque."""
+    global _mediapipe, _mediapipe_checked
+    with _import_lock:
+        if not _mediapipe_checked:
+            try:
+                import mediapipe as mp
+
+                _mediapipe = mp.solutions.face_mesh
+            except ImportError:
+                print("⚠️ mediapipe non installé : landmarks serveur indisponibles")
+            _mediapipe_checked = True
+    return _mediapipe
+
+
+def available():
+    return SERVER_LANDMARKS and _face_mesh_module() is not None
+
+
+class FaceMeshPool:
+    """
+    Pool d'instances FaceMesh partagé par les threads. Les instances sont créées
+    à la demande jusqu'à `size`, puis réutilisées ; au-delà, les appels attendent
+    qu'une instance se libère.
+    """
+
+    def __init__(self, size=FACE_MESH_POOL_SIZE):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if not create:
+            return self._idle.get()
+        try:
+            return _face_mesh_module().FaceMesh(
+                static_image_mode=True,
+                max_num_faces=1,
+                refine_landmarks=True,
+                min_detection_confidence=0.5,
+            )
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def detect(self, image):
+        """{left_ear, right_ear, chin} en pixels de `image` (BGR), ou None sans visage."""
+        if _face_mesh_module() is None:
+            return None
+        h, w = image.shape[:2]
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        face_mesh = self._acquire()
+        try:
+            result = face_mesh.process(rgb)
+        finally:
+            self._idle.put(face_mesh)
+        if not result.multi_face_landmarks:
+            return None
+        points = result.multi_face_landmarks[0].landmark
+        return {
+            name: [points[index].x * w, points[index].y * h]
+            for name, index in LANDMARK_INDICES.items()
+        }
+
+
+face_mesh_pool = FaceMeshPool()
+
+
+# Rendu hors requête (prérendu, lots) sans fichier voisin ni mediapipe
+SIDECAR_MISSING_ERROR = "❌ Landmarks absents (pas de .landmarks.json) et détection serveur indisponible (mediapipe)."
+
+
+def read_sidecar(image_path):
+    """Landmarks enregistrés à côté d'une photo (<photo>.landmarks.json), sinon None (FaceMesh)."""
+    sidecar = os.path.splitext(image_path)[0] + ".landmarks.json"
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            return json.load(f)
+    return None
@@ -0,0 +1,361 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+import necklace2D
+from landmarks import face_mesh_pool
+from pipeline import Pipeline, Stage
+from temporal_mask import TemporalNeckTracker
+
+# === Essayage en direct : flux de frames JPEG sur WebSocket (/live) ===
+# flask-sock est optionnel : sans lui, la route n'est pas enregistrée.
+# Protocole (client -> serveur) :
+#   texte  {"type": "config", "necklace": "collier1.png"}      changer de collier
+#   texte  {"type": "frame", "id": 12, "landmarks": {...}}     métadonnées de la frame suivante
+#   binaire  JPEG de la frame
+# Serveur -> client : {"type": "frame", "id", "latency_ms", "timings"} puis le
+# JPEG composité, {"type": "skipped", "id", "reason"} si la frame n'a pas pu
+# être rendue, et {"type": "stats", ...} chaque seconde.
+# Seule la frame la plus récente est traitée : celles arrivées pendant un rendu
+# sont remplacées (le client voit la latence d'une frame, pas celle d'une file).
+LIVE_MAX_SESSIONS = max(1, int(os.environ.get("LIVE_MAX_SESSIONS", "2")))
+LIVE_JPEG_QUALITY = int(os.environ.get("LIVE_JPEG_QUALITY", "80"))
+# Poids de la nouvelle mesure dans la moyenne exponentielle des landmarks (1 : pas de lissage)
+LIVE_SMOOTHING = float(os.environ.get("LIVE_SMOOTHING", "0.5"))
+# Saut (en fraction de l'écart entre les oreilles) au-delà duquel le lissage repart de zéro
+LIVE_RESET_JUMP = float(os.environ.get("LIVE_RESET_JUMP", "0.5"))
+# Frames sans visage pendant lesquelles les derniers landmarks sont réutilisés
+LIVE_HOLD_FRAMES = int(os.environ.get("LIVE_HOLD_FRAMES", "5"))
+LIVE_STATS_INTERVAL = float(os.environ.get("LIVE_STATS_INTERVAL", "1.0"))
+# YOLO (et FaceMesh côté serveur) sur les images clés seulement, flot optique entre deux (temporal_mask)
+LIVE_TEMPORAL_MASK = os.environ.get("LIVE_TEMPORAL_MASK", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+class NoFace(Exception):
+    pass
+
+
+class LandmarkSmoother:
+    """
+    Moyenne exponentielle des landmarks d'une frame à l'autre : le collier ne
+    tremble plus avec le bruit de FaceMesh. Un grand saut (autre personne,
+    mouvement brusque) repart de la nouvelle mesure ; sans visage, les derniers
+    points servent encore `hold_frames` frames.
+    """
+
+    def __init__(self, alpha=LIVE_SMOOTHING, reset_jump=LIVE_RESET_JUMP, hold_frames=LIVE_HOLD_FRAMES):
+        self.alpha = alpha
+        self.reset_jump = reset_jump
+        self.hold_frames = hold_frames
+        self.state = None
+        self.last = None   # dernière mesure brute (non lissée)
+        self.missed = 0
+
+    def _jumped(self, landmarks):
+        left, right = self.state["left_ear"], self.state["right_ear"]
+        span = max(((left[0] - right[0]) ** 2 + (left[1] - right[1]) ** 2) ** 0.5, 1.0)
+        return any(
+            ((landmarks[name][0] - point[0]) ** 2 + (landmarks[name][1] - point[1]) ** 2) ** 0.5 > self.reset_jump * span
+            for name, point in self.state.items()
+        )
+
+    def update(self, landmarks):
+        if landmarks is None:
+            if self.state is None or self.missed >= self.hold_frames:
+                self.state = None
+                return None
+            self.missed += 1
+            return self.state
+        self.missed = 0
+        landmarks = {name: [float(v) for v in landmarks[name][:2]] for name in ("left_ear", "right_ear", "chin")}
+        self.last = landmarks
+        if self.state is None or self._jumped(landmarks):
+            self.state = landmarks
+        else:
+            a = self.alpha
+            self.state = {
+                name: [a * new + (1 - a) * old for new, old in zip(landmarks[name], self.state[name])]
+                for name in self.state
+            }
+        return self.state
+
+
+class FpsMeter:
+    """Cadence sur une fenêtre glissante de `window` secondes."""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._ticks = deque()
+        self._lock = threading.Lock()
+
+    def tick(self, now=None):
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            self._ticks.append(now)
+            while now - self._ticks[0] > self.window:
+                self._ticks.popleft()
+
+    def fps(self):
+        with self._lock:
+            if len(self._ticks) < 2:
+                return 0.0
+            elapsed = self._ticks[-1] - self._ticks[0]
+            return (len(self._ticks) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+class LatestFrame:
+    """Case d'une seule frame : `put` remplace la frame pas encore prise (comptée comme perdue)."""
+
+    def __init__(self):
+        self._item = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+                metrics.LIVE_FRAMES.inc(result="dropped")
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Frame la plus récente, ou None si la case est fermée (ou après `timeout`)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._item is not None or self._closed, timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+# === Étapes d'une frame (suivi, puis landmarks lissés || masque du cou, puis placement) ===
+def _decode(frame_bytes):
+    image = necklace2D.decode_image(frame_bytes)
+    if image is None:
+        raise ValueError("Frame illisible")
+    return image
+
+
+def _track(image, tracker):
+    return tracker.track(image) if tracker is not None else None
+
+
+def _landmarks(image, client_landmarks, smoother, track):
+    if client_landmarks is not None:
+        landmarks = client_landmarks
+    elif track is None or track.keyframe or smoother.last is None:
+        landmarks = face_mesh_pool.detect(image)
+    else:
+        # Entre deux images clés, la dernière détection suit le mouvement estimé
+        landmarks = track.transform_points(smoother.last)
+    smoothed = smoother.update(landmarks)
+    if smoothed is None:
+        raise NoFace("Aucun visage détecté")
+    return smoothed
+
+
+def _neck_mask(image, tracker, track):
+    if tracker is None:
+        return necklace2D.get_neck_mask(image)
+    return tracker.neck_mask(track, lambda: necklace2D.get_neck_mask(image))
+
+
+def _composite(image, necklace_path, placement):
+    return necklace2D.render_necklace(image, necklace_path, placement)
+
+
+def _encode(image):
+    return necklace2D.encode_image(image, quality=LIVE_JPEG_QUALITY)
+
+
+LIVE_PIPELINE = Pipeline([
+    Stage("decode", _decode, ["frame_bytes"]),
+    Stage("track", _track, ["decode", "tracker"]),
+    Stage("landmarks", _landmarks, ["decode", "client_landmarks", "smoother", "track"]),
+    Stage("mask", _neck_mask, ["decode", "tracker", "track"]),
+    Stage("placement", necklace2D.place_on_neck, ["mask", "landmarks", "refine_horizontal"]),
+    Stage("composite", _composite, ["decode", "necklace_path", "placement"]),
+    Stage("encode", _encode, ["composite"]),
+])
+
+
+class LiveSession:
+    """État d'un flux : collier courant, lissage des landmarks, cadences."""
+
+    def __init__(self, necklace_path, refine_horizontal=False):
+        self.necklace_path = necklace_path
+        self.refine_horizontal = refine_horizontal
+        self.smoother = LandmarkSmoother()
+        self.tracker = TemporalNeckTracker() if LIVE_TEMPORAL_MASK else None
+        self.received = FpsMeter()
+        self.rendered = FpsMeter()
+        self.frames = 0
+        self.skipped = 0
+
+    def process(self, frame_bytes, client_landmarks=None):
+        """JPEG composité et durées par étape ; lève NoFace ou l'erreur de l'étape en cause."""
+        try:
+            values, timings = LIVE_PIPELINE.run(
+                frame_bytes=frame_bytes,
+                client_landmarks=client_landmarks,
+                smoother=self.smoother,
+                tracker=self.tracker,
+                necklace_path=self.necklace_path,
+                refine_horizontal=self.refine_horizontal,
+            )
+        except NoFace:
+            self.skipped += 1
+            metrics.LIVE_FRAMES.inc(result="no_face")
+            raise
+        except Exception:
+            self.skipped += 1
+            metrics.LIVE_FRAMES.inc(result="error")
+            raise
+        self.frames += 1
+        self.rendered.tick()
+        metrics.LIVE_FRAMES.inc(result="rendered")
+        metrics.observe_stage("live_frame", timings["total"] / 1000)
+        return values["encode"], timings
+
+    def stats(self, dropped=0):
+        stats = {
+            "type": "stats",
+            "fps": round(self.rendered.fps(), 1),
+            "input_fps": round(self.received.fps(), 1),
+            "rendered": self.frames,
+            "skipped": self.skipped,
+            "dropped": dropped,
+        }
+        if self.tracker is not None:
+            stats["keyframes"] = self.tracker.keyframes
+        return stats
+
+
+# --- Sessions actives (bornées : chaque flux occupe un thread gunicorn) ---
+_active_sessions = 0
+_sessions_lock = threading.Lock()
+
+
+def _acquire_session():
+    global _active_sessions
+    with _sessions_lock:
+        if _active_sessions >= LIVE_MAX_SESSIONS:
+            return False
+        _active_sessions += 1
+        return True
+
+
+def _release_session():
+    global _active_sessions
+    with _sessions_lock:
+        _active_sessions -= 1
+
+
+def active_sessions():
+    return _active_sessions
+
+
+def _read_frames(ws, session, slot, resolve_necklace):
+    """Thread de lecture : garde la dernière frame (avec ses métadonnées) dans `slot`."""
+    pending = {}
+    try:
+        while True:
+            message = ws.receive()
+            if message is None:
+                continue
+            if isinstance(message, str):
+                try:
+                    data = json.loads(message)
+                except ValueError:
+                    continue
+                if data.get("type") == "config" and data.get("necklace"):
+                    necklace_path = resolve_necklace(data["necklace"])
+                    if necklace_path is not None:
+                        session.necklace_path = necklace_path
+                elif data.get("type") == "frame":
+                    pending = data
+                continue
+            session.received.tick()
+            slot.put((bytes(message), pending.get("id"), pending.get("landmarks"), time.perf_counter()))
+            pending = {}
+    except Exception:
+        # ConnectionClosed (flask-sock) ou socket coupée : fin du flux
+        pass
+    finally:
+        slot.close()
+
+
+def serve(ws, necklace_path, resolve_necklace, refine_horizontal=False):
+    """Boucle de rendu d'une connexion : toujours la frame la plus récente."""
+    session = LiveSession(necklace_path, refine_horizontal)
+    slot = LatestFrame()
+    reader = threading.Thread(
+        target=_read_frames, args=(ws, session, slot, resolve_necklace), name="live-reader", daemon=True
+    )
+    reader.start()
+    last_stats = time.perf_counter()
+    while True:
+        item = slot.get(timeout=LIVE_STATS_INTERVAL)
+        if item is None and not reader.is_alive():
+            break
+        if item is not None:
+            frame_bytes, frame_id, client_landmarks, received_at = item
+            try:
+                jpeg, timings = session.process(frame_bytes, client_landmarks)
+            except Exception as e:
+                ws.send(json.dumps({"type": "skipped", "id": frame_id, "reason": str(e)}))
+            else:
+                ws.send(json.dumps({
+                    "type": "frame",
+                    "id": frame_id,
+                    "latency_ms": round((time.perf_counter() - received_at) * 1000, 1),
+                    "timings": {name: round(duration, 1) for name, duration in timings.items()},
+                }))
+                ws.send(jpeg)
+        now = time.perf_counter()
+        if now - last_stats >= LIVE_STATS_INTERVAL:
+            ws.send(json.dumps(session.stats(slot.dropped)))
+            last_stats = now
+    logger.info("Flux en direct terminé", extra={"event": "live_session", **session.stats(slot.dropped)})
+
+
+def register(app, resolve_necklace, default_necklace="necklace2k.png", refine_horizontal=False):
+    """Ajoute la route WebSocket /live si flask-sock est installé ; retourne True si c'est le cas."""
+    try:
+        from flask_sock import ConnectionClosed, Sock
+    except ImportError:
+        print("⚠️ flask-sock non installé : essayage en direct (/live) indisponible")
+        return False
+
+    from flask import request
+
+    sock = Sock(app)
+
+    @sock.route("/live")
+    def live_stream(ws):
+        necklace_path = resolve_necklace(request.args.get("necklace", default_necklace))
+        if necklace_path is None:
+            ws.close(reason=1008, message="Collier introuvable")
+            return
+        if not _acquire_session():
+            ws.close(reason=1013, message="Trop de flux en direct, réessayer plus tard")
+            return
+        try:
+            serve(ws, necklace_path, resolve_necklace, refine_horizontal)
+        except ConnectionClosed:
+            pass
+        finally:
+            _release_session()
+
+    return True
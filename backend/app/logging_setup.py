@@ -0,0 +1,163 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# === Journalisation structurée, échantillonnée et asynchrone ===
+# LOG_FORMAT   : json (défaut) ou text
+# LOG_LEVEL    : niveau global (INFO par défaut)
+# LOG_SAMPLE   : taux par événement, ex. "response=0.1,request=0.1" (les WARNING+ ne sont jamais échantillonnés)
+# LOG_ROUTE_LEVELS : niveau minimal par route Flask, ex. "/<path:filename>=WARNING,/health=WARNING"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+DEFAULT_SAMPLE_RATES = "request=0.1,response=0.1"
+DEFAULT_ROUTE_LEVELS = "/<path:filename>=WARNING,/health=WARNING,/ready=WARNING,/metrics=WARNING,/jobs/<job_id>=WARNING"
+
+# Attributs standard d'un LogRecord : tout le reste vient de `extra=` et part dans le JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _parse_mapping(value):
+    mapping = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            key, setting = item.rsplit("=", 1)
+            mapping[key.strip()] = setting.strip()
+    return mapping
+
+
+def sample_rates():
+    return {event: float(rate) for event, rate in _parse_mapping(os.environ.get("LOG_SAMPLE", DEFAULT_SAMPLE_RATES)).items()}
+
+
+def route_levels():
+    return {
+        route: logging.getLevelName(level.upper())
+        for route, level in _parse_mapping(os.environ.get("LOG_ROUTE_LEVELS", DEFAULT_ROUTE_LEVELS)).items()
+    }
+
+
+class RequestContextFilter(logging.Filter):
+    """Ajoute route / méthode de la requête Flask en cours (dans le thread qui journalise)."""
+
+    def filter(self, record):
+        if not hasattr(record, "route"):
+            try:
+                from flask import has_request_context, request
+
+                if has_request_context():
+                    record.route = request.url_rule.rule if request.url_rule else request.path
+                    record.method = request.method
+            except ImportError:
+                pass
+        return True
+
+
+class RouteLevelFilter(logging.Filter):
+    """Écarte les messages sous le niveau configuré pour leur route (assets statiques, sondes...)."""
+
+    def __init__(self, levels):
+        super().__init__()
+        self.levels = levels
+
+    def filter(self, record):
+        route = getattr(record, "route", None)
+        return route is None or record.levelno >= self.levels.get(route, logging.NOTSET)
+
+
+class SamplingFilter(logging.Filter):
+    """Garde une fraction `rate` des événements à fort volume (attribut `event` du message)."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+# --- Écriture asynchrone : les threads de requête ne font que déposer dans une file ---
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+
+def _stream_handler():
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    return handler
+
+
+def _start_listener():
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, _stream_handler(), respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # Le thread d'écriture ne survit pas au fork (workers gunicorn) : nouvelle file, nouveau thread
+    global _lock
+    _lock = threading.Lock()
+    if _queue_handler is not None:
+        _start_listener()
+
+
+def setup_logging():
+    """Installe le handler asynchrone sur le logger racine (idempotent)."""
+    global _queue_handler
+    with _lock:
+        if _queue_handler is not None:
+            return
+        _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        _queue_handler.addFilter(RequestContextFilter())
+        _queue_handler.addFilter(RouteLevelFilter(route_levels()))
+        _queue_handler.addFilter(SamplingFilter(sample_rates()))
+        root = logging.getLogger()
+        root.handlers = [_queue_handler]
+        root.setLevel(LOG_LEVEL)
+        _start_listener()
+        os.register_at_fork(after_in_child=_restart_after_fork)
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Vide la file (arrêt propre, scripts)."""
+    if _listener is not None:
+        _listener.stop()
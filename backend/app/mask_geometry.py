@@ -0,0 +1,170 @@
+import cv2
+import numpy as np
+
+# === Requêtes géométriques vectorisées sur le masque binaire du cou ===
+# Toutes les fonctions acceptent un masque 0/255 (uint8) ou booléen, indexé [y, x].
+
+
+def _as_bool(values):
+    return values if values.dtype == np.bool_ else values > 0
+
+
+def _first_true(values):
+    """Indice du premier True (argmax sur booléens), ou None s'il n'y en a pas."""
+    if values.size == 0:
+        return None
+    idx = int(np.argmax(values))
+    return idx if values[idx] else None
+
+
+def first_hit_below(mask_bin, x, y_start):
+    """Premier y >= y_start où la colonne x touche le masque."""
+    height, width = mask_bin.shape[:2]
+    if not 0 <= x < width:
+        return None
+    y_start = max(int(y_start), 0)
+    idx = _first_true(_as_bool(mask_bin[y_start:, x]))
+    return None if idx is None else y_start + idx
+
+
+def row_extents(mask_bin, y):
+    """Bords gauche et droit du masque sur la ligne y : (x_min, x_max), ou None."""
+    height, width = mask_bin.shape[:2]
+    if not 0 <= y < height:
+        return None
+    row = _as_bool(mask_bin[y])
+    left = _first_true(row)
+    if left is None:
+        return None
+    right = width - 1 - int(np.argmax(row[::-1]))
+    return left, right
+
+
+def find_vertical_intersection(mask_bin, point, height=None):
+    """Premier point du masque à la verticale de `point`, en descendant."""
+    x, y_start = int(point[0]), int(point[1])
+    if height is not None:
+        mask_bin = mask_bin[:height]
+    y = first_hit_below(mask_bin, x, y_start)
+    return None if y is None else (x, y)
+
+
+# === Affinage horizontal ===
+def _extents_at(mask, y):
+    return mask.row_extents(y) if isinstance(mask, NeckMask) else row_extents(mask, y)
+
+
+def snap_to_neck_edges(mask_bin, left_point, right_point):
+    """
+    Ramène les points de placement sur les bords du cou, ligne par ligne.
+    `mask_bin` peut être un masque image 0/255 ou un NeckMask.
+
+    Chaque point trouvé est déplacé sur le bord correspondant (gauche/droit) de
+    sa ligne ; si un seul point est connu, l'autre est déduit du bord opposé de
+    la même ligne. Les points hors masque sont laissés tels quels.
+    """
+    def snap(point, side):
+        if not point:
+            return None
+        extents = _extents_at(mask_bin, point[1])
+        return point if extents is None else (int(extents[side]), point[1])
+
+    left_snapped = snap(left_point, 0)
+    right_snapped = snap(right_point, 1)
+    if left_snapped and not right_snapped:
+        extents = _extents_at(mask_bin, left_snapped[1])
+        right_snapped = (int(extents[1]), left_snapped[1]) if extents else None
+    elif right_snapped and not left_snapped:
+        extents = _extents_at(mask_bin, right_snapped[1])
+        left_snapped = (int(extents[0]), right_snapped[1]) if extents else None
+    return left_snapped, right_snapped
+
+
+# === Masque à la résolution du modèle ===
+class NeckMask:
+    """
+    Masque du cou tel que produit par le modèle (entrée letterboxée), avec la
+    transformation vers l'espace image. Seuls les points interrogés, ou la
+    bande de lignes demandée, sont ramenés à la résolution de la photo.
+    """
+
+    def __init__(self, mask, image_shape, scale, pad):
+        self.mask = mask                      # uint8 0/255, résolution du modèle
+        self.image_shape = tuple(image_shape[:2])
+        self.scale = float(scale)             # taille modèle / taille image
+        self.pad = (float(pad[0]), float(pad[1]))
+
+    # Conversions au centre des pixels : p_modèle + 0.5 = (p_image + 0.5) * scale + pad
+    def to_model(self, x, y):
+        return ((x + 0.5) * self.scale + self.pad[0] - 0.5,
+                (y + 0.5) * self.scale + self.pad[1] - 0.5)
+
+    def to_image(self, x, y):
+        return ((x + 0.5 - self.pad[0]) / self.scale - 0.5,
+                (y + 0.5 - self.pad[1]) / self.scale - 0.5)
+
+    def find_vertical_intersection(self, point):
+        """Équivalent de find_vertical_intersection, calculé sur le masque du modèle."""
+        height, width = self.image_shape
+        x, y_start = int(point[0]), int(point[1])
+        if not (0 <= x < width) or y_start >= height:
+            return None
+        mx, my = self.to_model(x, max(y_start, 0))
+        y_model = first_hit_below(self.mask, int(round(mx)), int(np.ceil(my - 0.5)))
+        if y_model is None:
+            return None
+        y = int(np.ceil(self.to_image(0, y_model - 0.5)[1]))
+        y = min(max(y, y_start), height - 1)
+        return (x, y)
+
+    def row_extents(self, y):
+        """Bords gauche et droit du cou sur la ligne y de l'image, ou None."""
+        height, width = self.image_shape
+        if not 0 <= y < height:
+            return None
+        extents = row_extents(self.mask, int(round(self.to_model(0, y)[1])))
+        if extents is None:
+            return None
+        left = int(np.ceil(self.to_image(extents[0] - 0.5, 0)[0]))
+        right = int(np.floor(self.to_image(extents[1] + 0.5, 0)[0]))
+        left, right = max(left, 0), min(right, width - 1)
+        return (left, right) if left <= right else None
+
+    def band(self, y0, y1):
+        """Masque binaire 0/255 des lignes [y0, y1) de l'image, en pleine largeur."""
+        height, width = self.image_shape
+        y0, y1 = max(int(y0), 0), min(int(y1), height)
+        if y0 >= y1:
+            return np.zeros((0, width), dtype=np.uint8)
+        # Application inverse : pixel (x, y) de la bande -> point du masque modèle
+        to_model = np.float64([
+            [self.scale, 0, self.pad[0] + 0.5 * self.scale - 0.5],
+            [0, self.scale, self.pad[1] + (y0 + 0.5) * self.scale - 0.5],
+        ])
+        band = cv2.warpAffine(
+            self.mask, to_model, (width, y1 - y0),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_CONSTANT
+        )
+        return np.where(band > 127, 255, 0).astype(np.uint8)
+
+    def to_image_mask(self):
+        """Masque complet à la résolution de l'image (compatibilité)."""
+        return self.band(0, self.image_shape[0])
+
+    def transformed(self, affine):
+        """
+        Masque déplacé par `affine` (2x3, coordonnées image) : la transformation
+        est ramenée dans l'espace du modèle et appliquée au masque basse résolution.
+        """
+        to_model = np.float64([
+            [self.scale, 0, self.pad[0] + 0.5 * self.scale - 0.5],
+            [0, self.scale, self.pad[1] + 0.5 * self.scale - 0.5],
+            [0, 0, 1],
+        ])
+        affine = np.vstack([np.asarray(affine, dtype=np.float64), [0, 0, 1]])
+        model_affine = (to_model @ affine @ np.linalg.inv(to_model))[:2]
+        mask = cv2.warpAffine(
+            self.mask, model_affine, (self.mask.shape[1], self.mask.shape[0]),
+            flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT
+        )
+        return NeckMask(mask, self.image_shape, self.scale, self.pad)
@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# === Métriques au format texte Prometheus (/metrics) ===
+# Sans dépendance : histogrammes et compteurs en mémoire, propres à chaque
+# processus (avec plusieurs workers gunicorn, chaque scrape voit un worker).
+METRICS_ENABLED = os.environ.get("METRICS", "1") == "1"
+
+# Secondes ; les étapes vont de la milliseconde (blend) à plusieurs secondes (YOLO sur CPU)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Tranches de résolution d'entrée (mégapixels)
+RESOLUTION_BUCKETS = ((0.5, "0.5mp"), (1.0, "1mp"), (2.1, "2mp"), (5.0, "5mp"), (12.5, "12mp"))
+
+logger = logging.getLogger(__name__)
+
+
+def resolution_bucket(shape):
+    megapixels = shape[0] * shape[1] / 1e6
+    for limit, label in RESOLUTION_BUCKETS:
+        if megapixels <= limit:
+            return label
+    return "large"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, count, total) in snapshot:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """`collector()` retourne [(nom, type, aide, [(labels dict, valeur)])], appelé à chaque scrape."""
+        self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning(f"⚠️ Collecteur de métriques en échec: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_DURATION = registry.register(Histogram(
+    "tryon_stage_duration_seconds",
+    "Durée de chaque étape du rendu (upload_parse, decode, inference, mask_scan, collar_load, warp, blend, encode...).",
+    ["stage"],
+))
+RENDER_DURATION = registry.register(Histogram(
+    "tryon_render_duration_seconds",
+    "Durée totale d'un rendu (hors cache), par collier et tranche de résolution d'entrée.",
+    ["necklace", "resolution"],
+))
+RENDERS = registry.register(Counter(
+    "tryon_renders_total",
+    "Rendus par collier et résultat (ok, error, cache_hit, prerendered).",
+    ["necklace", "result"],
+))
+LIVE_FRAMES = registry.register(Counter(
+    "tryon_live_frames_total",
+    "Frames du flux en direct par résultat (rendered, dropped, no_face, error).",
+    ["result"],
+))
+HTTP_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "Durée des requêtes HTTP par route.",
+    ["route", "method", "status"],
+))
+
+
+def observe_stage(stage, seconds):
+    if METRICS_ENABLED:
+        STAGE_DURATION.observe(seconds, stage=stage)
+
+
+@contextmanager
+def timer(stage):
+    """Mesure le bloc et l'enregistre comme étape `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def render():
+    return registry.render()
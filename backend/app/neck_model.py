@@ -0,0 +1,412 @@
+import argparse
+import ast
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+# === Modèle de segmentation du cou : backends interchangeables ===
+# NECK_MODEL_BACKEND = ultralytics (PyTorch, défaut) | onnx (ONNX Runtime) | openvino
+#                      | stub (masque synthétique à latence fixe, pour les tests de charge)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTENT_DIR = os.path.join(BASE_DIR, "Content")
+WEIGHTS_PATH = os.path.join(CONTENT_DIR, "model_vf4.pt")
+ONNX_PATH = os.path.join(CONTENT_DIR, "model_vf4.onnx")
+OPENVINO_PATH = os.path.join(CONTENT_DIR, "model_vf4_openvino_model", "model_vf4.xml")
+INT8_PATH = os.path.join(CONTENT_DIR, "model_vf4.int8.onnx")
+
+DEFAULT_PATHS = {
+    "ultralytics": WEIGHTS_PATH,
+    "onnx": ONNX_PATH,
+    "openvino": OPENVINO_PATH,
+}
+
+# Taille d'entrée du modèle (côté le plus long) et pas de l'architecture
+MODEL_IMGSZ = int(os.environ.get("NECK_MODEL_IMGSZ", "640"))
+MODEL_STRIDE = 32
+CONF_THRESHOLD = 0.4
+NECK_LABEL = "neck"
+
+
+def letterbox(image, size=MODEL_IMGSZ, stride=MODEL_STRIDE, square=False):
+    """
+    Redimensionne l'image pour le modèle en gardant les proportions, puis complète
+    (gris 114, comme Ultralytics) jusqu'à un multiple de `stride` (ou un carré).
+    Retourne (image, scale, (pad_x, pad_y)).
+    """
+    h, w = image.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    if (new_w, new_h) != (w, h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    if square:
+        target_w = target_h = size
+    else:
+        target_w = -(-new_w // stride) * stride
+        target_h = -(-new_h // stride) * stride
+    pad_x, pad_y = (target_w - new_w) / 2, (target_h - new_h) / 2
+    left, top = int(round(pad_x - 0.1)), int(round(pad_y - 0.1))
+    right, bottom = target_w - new_w - left, target_h - new_h - top
+    if left or top or right or bottom:
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return image, new_w / w, (left, top)
+
+
+def _neck_class_id(names):
+    for cls_id, label in names.items():
+        if str(label).lower() == NECK_LABEL:
+            return int(cls_id)
+    return None
+
+
+# === Décodage des sorties brutes YOLOv8-seg (identique à Ultralytics) ===
+def decode_neck_mask(pred, protos, input_shape, neck_id, conf=CONF_THRESHOLD):
+    """
+    pred : (4 + nc + nm, N) boîtes cx, cy, w, h + scores + coefficients de masque.
+    protos : (nm, mh, mw). Retourne le masque 0/255 (taille d'entrée) de la
+    détection « neck » la plus confiante, comme le premier résultat Ultralytics.
+    """
+    if neck_id is None:
+        return None
+    nm = protos.shape[0]
+    pred = pred.T
+    scores = pred[:, 4:pred.shape[1] - nm]
+    classes = scores.argmax(axis=1)
+    confidences = scores.max(axis=1)
+    candidates = np.flatnonzero((classes == neck_id) & (confidences > conf))
+    if candidates.size == 0:
+        return None
+    # La détection la plus confiante n'est jamais supprimée par la NMS
+    best = pred[candidates[np.argmax(confidences[candidates])]]
+
+    cx, cy, w, h = best[:4]
+    x1, y1, x2, y2 = cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2
+    _, mh, mw = protos.shape
+    ih, iw = input_shape
+    logits = (best[-nm:] @ protos.reshape(nm, -1)).reshape(mh, mw)
+
+    # crop_mask à la résolution des prototypes
+    rx, ry = mw / iw, mh / ih
+    cols = np.arange(mw, dtype=np.float32)
+    rows = np.arange(mh, dtype=np.float32)[:, None]
+    inside = (cols >= x1 * rx) & (cols < x2 * rx) & (rows >= y1 * ry) & (rows < y2 * ry)
+    logits = np.where(inside, logits, 0).astype(np.float32)
+    logits = cv2.resize(logits, (iw, ih), interpolation=cv2.INTER_LINEAR)
+    return np.where(logits > 0, 255, 0).astype(np.uint8)
+
+
+def to_tensor(model_inputs):
+    """Images BGR uint8 de même forme -> tenseur NCHW float32 RGB dans [0, 1]."""
+    batch = np.stack(model_inputs)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def _group_by_shape(model_inputs):
+    groups = {}
+    for i, image in enumerate(model_inputs):
+        groups.setdefault(image.shape, []).append(i)
+    return groups.values()
+
+
+class _RawBackend:
+    """Base des backends sans PyTorch : prétraitement et décodage en NumPy."""
+
+    name = "raw"
+    # Les sessions ONNX Runtime / OpenVINO gardent des pools de threads qui ne
+    # survivent pas à un fork : chaque worker recharge sa propre copie.
+    fork_safe = False
+
+    def __init__(self, path, names):
+        self.path = path
+        self.names = names
+        self.neck_id = _neck_class_id(names)
+
+    def _run(self, tensor):
+        raise NotImplementedError
+
+    def predict_masks(self, model_inputs):
+        masks = [None] * len(model_inputs)
+        for indices in _group_by_shape(model_inputs):
+            tensor = to_tensor([model_inputs[i] for i in indices])
+            outputs = self._run(tensor)
+            protos = next(o for o in outputs if o.ndim == 4)
+            preds = next(o for o in outputs if o.ndim == 3)
+            for k, i in enumerate(indices):
+                masks[i] = decode_neck_mask(preds[k], protos[k], tensor.shape[2:], self.neck_id)
+        return masks
+
+
+class OnnxBackend(_RawBackend):
+    name = "onnx"
+
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = int(os.environ.get("NECK_MODEL_THREADS", "0"))
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        names = ast.literal_eval(metadata["names"]) if "names" in metadata else {0: NECK_LABEL}
+        self.input_name = self.session.get_inputs()[0].name
+        super().__init__(path, names)
+
+    def _run(self, tensor):
+        return self.session.run(None, {self.input_name: tensor})
+
+
+class OpenVinoBackend(_RawBackend):
+    name = "openvino"
+
+    def __init__(self, path):
+        import openvino as ov
+
+        core = ov.Core()
+        threads = int(os.environ.get("NECK_MODEL_THREADS", "0"))
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads > 0:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = core.compile_model(core.read_model(path), "CPU", config)
+        super().__init__(path, _read_openvino_names(os.path.dirname(path)))
+
+    def _run(self, tensor):
+        results = self.compiled(tensor)
+        return [results[output] for output in self.compiled.outputs]
+
+
+def _read_openvino_names(model_dir):
+    """Noms des classes depuis le metadata.yaml écrit par l'export Ultralytics."""
+    metadata_path = os.path.join(model_dir, "metadata.yaml")
+    if not os.path.exists(metadata_path):
+        return {0: NECK_LABEL}
+    try:
+        import yaml
+
+        with open(metadata_path) as f:
+            return {int(k): v for k, v in yaml.safe_load(f)["names"].items()}
+    except ImportError:
+        names, in_names = {}, False
+        with open(metadata_path) as f:
+            for line in f:
+                if line.startswith("names:"):
+                    in_names = True
+                elif in_names and line.startswith("  ") and ":" in line:
+                    key, value = line.strip().split(":", 1)
+                    names[int(key)] = value.strip().strip("'\"")
+                elif in_names:
+                    break
+        return names or {0: NECK_LABEL}
+
+
+class UltralyticsBackend:
+    name = "ultralytics"
+    # Poids PyTorch partagés en copie-sur-écriture après le fork des workers
+    fork_safe = True
+
+    def __init__(self, path):
+        from ultralytics import YOLO
+
+        self.path = path
+        self.yolo = YOLO(path)
+
+    def predict_masks(self, model_inputs):
+        results = self.yolo.predict(list(model_inputs), imgsz=MODEL_IMGSZ, conf=CONF_THRESHOLD, task="segment", verbose=False)
+        return [neck_mask_from_result(r) for r in results]
+
+    # Compatibilité avec les appels directs à l'API Ultralytics
+    def predict(self, *args, **kwargs):
+        return self.yolo.predict(*args, **kwargs)
+
+
+class StubBackend:
+    """
+    Remplaçant du modèle pour les tests de charge : attend NECK_STUB_LATENCY_MS
+    par passe (+ NECK_STUB_PER_IMAGE_MS par image du lot) sans occuper le CPU,
+    puis renvoie un cou synthétique (trapèze centré sous le milieu de l'image).
+    La latence est déterministe : file d'attente, parsing et compositing se
+    mesurent sans le bruit de l'inférence.
+    """
+
+    name = "stub"
+    fork_safe = True
+
+    def __init__(self, path=None, latency_ms=None, per_image_ms=None):
+        self.path = path
+        self.latency_ms = float(os.environ.get("NECK_STUB_LATENCY_MS", "150")) if latency_ms is None else latency_ms
+        self.per_image_ms = float(os.environ.get("NECK_STUB_PER_IMAGE_MS", "0")) if per_image_ms is None else per_image_ms
+
+    @staticmethod
+    def synthetic_mask(shape):
+        h, w = shape[:2]
+        mask = np.zeros((h, w), dtype=np.uint8)
+        top = int(h * 0.38)
+        points = np.array([[w * 0.40, top], [w * 0.60, top], [w * 0.90, h - 1], [w * 0.10, h - 1]], dtype=np.int32)
+        cv2.fillConvexPoly(mask, points, 255)
+        return mask
+
+    def predict_masks(self, model_inputs):
+        time.sleep((self.latency_ms + self.per_image_ms * len(model_inputs)) / 1000)
+        return [self.synthetic_mask(image.shape) for image in model_inputs]
+
+
+def neck_mask_from_result(results):
+    """Masque 0/255 de la classe « neck » d'un résultat Ultralytics, ou None."""
+    for i, box in enumerate(results.boxes):
+        cls_id = int(box.cls[0])
+        label = results.names[cls_id]
+        if label.lower() == NECK_LABEL:
+            mask_data = results.masks.data[i].cpu().numpy()
+            return (mask_data * 255).astype(np.uint8)
+    return None
+
+
+BACKENDS = {
+    "ultralytics": UltralyticsBackend,
+    "onnx": OnnxBackend,
+    "openvino": OpenVinoBackend,
+    "stub": StubBackend,
+}
+
+
+# === Variante INT8 (voir quantize_model.py) ===
+def report_path_for(model_path):
+    """Rapport de précision écrit à côté du modèle quantifié."""
+    return os.path.splitext(model_path)[0] + ".report.json"
+
+
+def quantized_model_accepted(model_path, min_iou=None, max_distance=None):
+    """
+    Vrai si le rapport d'évaluation du modèle INT8 respecte les seuils :
+    IoU moyen >= NECK_INT8_MIN_IOU et distance p95 des points de placement
+    <= NECK_INT8_MAX_PLACEMENT_PX (pixels de l'image).
+    """
+    min_iou = float(os.environ.get("NECK_INT8_MIN_IOU", "0.9")) if min_iou is None else min_iou
+    max_distance = float(os.environ.get("NECK_INT8_MAX_PLACEMENT_PX", "8")) if max_distance is None else max_distance
+    try:
+        with open(report_path_for(model_path)) as f:
+            summary = json.load(f)["summary"]
+    except (OSError, ValueError, KeyError):
+        print(f"⚠️ Pas de rapport de précision pour {model_path}")
+        return False
+    accepted = summary["mean_iou"] >= min_iou and summary["p95_placement_px"] <= max_distance
+    print(
+        f"📏 INT8: IoU moyen {summary['mean_iou']:.3f} (min {min_iou}), "
+        f"placement p95 {summary['p95_placement_px']:.1f} px (max {max_distance}) -> "
+        f"{'accepté' if accepted else 'refusé'}"
+    )
+    return accepted
+
+
+def load_quantized_model(path=None):
+    path = path or os.environ.get("NECK_INT8_PATH") or INT8_PATH
+    if not os.path.exists(path) or not quantized_model_accepted(path):
+        return None
+    model = OnnxBackend(path)
+    model.name = "onnx-int8"
+    print(f"🧠 Modèle INT8 chargé: {path}")
+    return model
+
+
+def load_model(backend=None, path=None):
+    """
+    Charge le modèle selon NECK_MODEL_BACKEND / NECK_MODEL_PATH. Si le fichier
+    exporté manque, on retombe sur les poids PyTorch ; None si rien n'est trouvé.
+    Avec NECK_MODEL_INT8=1, la variante quantifiée est préférée quand son
+    rapport de précision respecte les seuils.
+    """
+    if backend is None and path is None and os.environ.get("NECK_MODEL_INT8", "0") == "1":
+        quantized = load_quantized_model()
+        if quantized is not None:
+            return quantized
+        print("⚠️ Modèle INT8 indisponible ou hors seuils, chargement du modèle standard")
+
+    backend = (backend or os.environ.get("NECK_MODEL_BACKEND", "ultralytics")).lower()
+    if backend not in BACKENDS:
+        print(f"⚠️ Backend de modèle inconnu: {backend}, utilisation d'ultralytics")
+        backend = "ultralytics"
+    if backend == "stub":
+        model = StubBackend(path)
+        print(f"🧪 Modèle factice chargé (latence {model.latency_ms:.0f} ms)")
+        return model
+    path = path or os.environ.get("NECK_MODEL_PATH") or DEFAULT_PATHS[backend]
+
+    print(f"🔍 Recherche du modèle YOLO ({backend}) à: {path}")
+    if not os.path.exists(path):
+        if backend != "ultralytics" and os.path.exists(WEIGHTS_PATH):
+            print(f"⚠️ Modèle {backend} introuvable, repli sur les poids PyTorch")
+            return load_model("ultralytics", WEIGHTS_PATH)
+        print("⚠️ ATTENTION: Modèle YOLO non trouvé, utilisation du modèle par défaut")
+        return None
+
+    print("✅ Modèle YOLO trouvé, chargement...")
+    model = BACKENDS[backend](path)
+    print(f"🧠 Modèle YOLO chargé avec succès ({backend})")
+    return model
+
+
+# === Benchmark et export ===
+def benchmark(model, runs=5, imgsz=MODEL_IMGSZ):
+    """Latence moyenne (ms) d'une inférence sur une image neutre, après une passe de chauffe."""
+    dummy = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    model.predict_masks([dummy])
+    start = time.perf_counter()
+    for _ in range(runs):
+        model.predict_masks([dummy])
+    return (time.perf_counter() - start) * 1000 / runs
+
+
+def report_speedup(model, runs=5):
+    """Compare le backend chargé aux poids PyTorch et affiche l'accélération."""
+    elapsed = benchmark(model, runs)
+    print(f"⏱️ Inférence {model.name}: {elapsed:.1f} ms")
+    if model.name == "ultralytics" or not os.path.exists(WEIGHTS_PATH):
+        return {model.name: elapsed}
+    try:
+        reference = benchmark(UltralyticsBackend(WEIGHTS_PATH), runs)
+    except ImportError:
+        return {model.name: elapsed}
+    print(f"⏱️ Inférence ultralytics: {reference:.1f} ms -> accélération x{reference / elapsed:.2f}")
+    return {model.name: elapsed, "ultralytics": reference}
+
+
+def export_model(fmt, weights=WEIGHTS_PATH, imgsz=MODEL_IMGSZ):
+    """Exporte les poids PyTorch (entrées dynamiques : taille et lot variables)."""
+    from ultralytics import YOLO
+
+    options = {"format": fmt, "imgsz": imgsz, "dynamic": True}
+    if fmt == "onnx":
+        options["simplify"] = True
+    return YOLO(weights).export(**options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export et benchmark du modèle de segmentation du cou")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Exporter model_vf4.pt en ONNX ou OpenVINO")
+    export_parser.add_argument("--format", choices=["onnx", "openvino"], default="onnx")
+    export_parser.add_argument("--weights", default=WEIGHTS_PATH)
+    export_parser.add_argument("--imgsz", type=int, default=MODEL_IMGSZ)
+
+    bench_parser = subparsers.add_parser("benchmark", help="Mesurer la latence d'un backend")
+    bench_parser.add_argument("--backend", choices=sorted(BACKENDS), default=None)
+    bench_parser.add_argument("--path", default=None)
+    bench_parser.add_argument("--runs", type=int, default=10)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        output = export_model(args.format, args.weights, args.imgsz)
+        print(f"✅ Modèle exporté: {output}")
+    else:
+        model = load_model(args.backend, args.path)
+        if model is None:
+            raise SystemExit("❌ Aucun modèle à mesurer.")
+        report_speedup(model, args.runs)
+
+
+if __name__ == "__main__":
+    main()
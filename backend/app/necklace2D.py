@@ -1,49 +1,200 @@
+import logging
 import os
+import threading
+import time
 import cv2
 import numpy as np
-from ultralytics import YOLO
+
+import mask_geometry
+import metrics
+import neck_model
+from compositing import BLUR_KSIZE, BLUR_SIGMA, blend_into, blend_premultiplied_into, feather_alpha
+from inference_scheduler import InferenceScheduler, SchedulerClosed
+from necklace_cache import necklace_cache
+from result_cache import NO_NECK, mask_cache
+
+logger = logging.getLogger(__name__)
 
 # === Initialisation YOLO ===
+# Backend choisi par NECK_MODEL_BACKEND (ultralytics, onnx, openvino)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(BASE_DIR, "Content", "model_vf4.pt")
+MODEL_PATH = neck_model.WEIGHTS_PATH
+
+# Chargé à la demande (get_model) : l'import du module reste léger, le démarrage rapide
+model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Modèle global, chargé au premier appel (les appels concurrents attendent le même chargement)."""
+    global model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                model = neck_model.load_model()
+                if model is not None and os.environ.get("NECK_MODEL_BENCHMARK", "0") == "1":
+                    neck_model.report_speedup(model)
+                _model_loaded = True
+    return model
+
+
+# === Entrées / sorties en mémoire ===
+def decode_image(data):
+    """Décode les octets d'une image (upload) en tableau BGR, sans passer par le disque."""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def encode_image(image, ext=".jpg", quality=95):
+    """Encode le résultat en mémoire (JPEG par défaut) et retourne les octets."""
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext in (".jpg", ".jpeg") else []
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise Exception("❌ Impossible d'encoder l'image résultat.")
+    return buffer.tobytes()
+
+
+def load_image(source):
+    """Accepte un tableau déjà décodé, des octets ou un chemin de fichier."""
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(source)
+    return cv2.imread(source)
+
+
+# === Détection du cou ===
+# Taille d'entrée du modèle et préparation letterbox (voir neck_model)
+MODEL_IMGSZ = neck_model.MODEL_IMGSZ
+letterbox = neck_model.letterbox
 
-print(f"🔍 Recherche du modèle YOLO à: {MODEL_PATH}")
 
-if os.path.exists(MODEL_PATH):
-    print("✅ Modèle YOLO trouvé, chargement...")
-    model = YOLO(MODEL_PATH)
-    print("🧠 Modèle YOLO chargé avec succès")
-else:
-    print("⚠️ ATTENTION: Modèle YOLO non trouvé, utilisation du modèle par défaut")
-    model = None
+def predict_neck_masks(model, model_inputs):
+    """Une seule passe du modèle sur une liste d'entrées letterboxées -> masques (ou None)."""
+    if hasattr(model, "predict_masks"):
+        return model.predict_masks(list(model_inputs))
+    # Objet YOLO Ultralytics passé directement (scripts)
+    results = model.predict(list(model_inputs), imgsz=MODEL_IMGSZ, conf=0.4, task="segment", verbose=False)
+    return [neck_model.neck_mask_from_result(r) for r in results]
 
 
-def detect_neck_mask(image_path, model, width, height):
+# === Micro-lots d'inférence (désactivés si NECK_BATCH_SIZE <= 1) ===
+NECK_BATCH_SIZE = int(os.environ.get("NECK_BATCH_SIZE", "1"))
+NECK_BATCH_WAIT_MS = float(os.environ.get("NECK_BATCH_WAIT_MS", "5"))
+_scheduler = None
+_scheduler_model = None
+_scheduler_lock = threading.Lock()
+# Sans micro-lots, les appels directs au modèle sont sérialisés (threads gunicorn, file asynchrone)
+_predict_lock = threading.Lock()
+
+
+def get_inference_scheduler(model):
+    """Planificateur partagé pour `model`, ou None si le batching est désactivé."""
+    global _scheduler, _scheduler_model
+    if NECK_BATCH_SIZE <= 1 or model is None:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_model is not model:
+            if _scheduler is not None:
+                _scheduler.close()
+            _scheduler = InferenceScheduler(
+                lambda batch: predict_neck_masks(model, batch),
+                max_batch_size=NECK_BATCH_SIZE,
+                max_wait_ms=NECK_BATCH_WAIT_MS,
+            )
+            _scheduler_model = model
+        return _scheduler
+
+
+def inference_queue_depth():
+    """Images en attente d'un micro-lot (0 sans batching)."""
+    scheduler = _scheduler
+    return scheduler.queue_depth() if scheduler is not None else 0
+
+
+def detect_neck_mask_lowres(image, model):
+    """
+    Détection à la résolution du modèle : l'image est letterboxée ici (Ultralytics
+    n'a plus rien à redimensionner) et le masque est renvoyé tel quel, dans un
+    NeckMask qui ne ramène à l'échelle de la photo que ce qui est interrogé.
+    """
     if model is None:
-        print("⚠️ Modèle YOLO non disponible, retour de masque vide")
+        logger.warning("⚠️ Modèle YOLO non disponible, retour de masque vide")
         return None
-        
+
     try:
-        results = model.predict(image_path, conf=0.4, task="segment")[0]
-        for i, box in enumerate(results.boxes):
-            cls_id = int(box.cls[0])
-            label = results.names[cls_id]
-            if label.lower() == "neck":
-                mask_data = results.masks.data[i].cpu().numpy()
-                mask = (mask_data * 255).astype(np.uint8)
-                return cv2.resize(mask, (width, height))
+        return _run_neck_detection(load_image(image), model)
     except Exception as e:
-        print(f"⚠️ Erreur lors de la détection YOLO: {e}")
-    
+        logger.warning(f"⚠️ Erreur lors de la détection YOLO: {e}")
+
     return None
 
 
+def _run_neck_detection(img, model):
+    """Inférence (directe ou par micro-lots) ; lève une exception en cas d'erreur."""
+    scheduler = get_inference_scheduler(model)
+    if scheduler is not None:
+        # Entrées carrées : toutes les images d'un lot ont la même forme
+        model_input, scale, pad = letterbox(img, square=True)
+        with metrics.timer("inference"):
+            try:
+                mask = scheduler.predict(model_input)
+            except SchedulerClosed:
+                # Planificateur remplacé entre-temps (changement de modèle) : une seule
+                # nouvelle tentative sur le planificateur courant, seul à appeler le modèle
+                scheduler = get_inference_scheduler(get_model())
+                if scheduler is None:
+                    raise
+                mask = scheduler.predict(model_input)
+    else:
+        model_input, scale, pad = letterbox(img)
+        with _predict_lock, metrics.timer("inference"):
+            mask = predict_neck_masks(model, [model_input])[0]
+    if mask is None:
+        return None
+    return mask_geometry.NeckMask(mask, img.shape, scale, pad)
+
+
+def get_neck_mask(img, image_hash=None):
+    """
+    Masque du cou de `img` avec le modèle global. Avec `image_hash` (hash des
+    octets de l'upload), le masque — ou l'absence de cou — est mis en cache :
+    une image déjà vue ne repasse pas par YOLO, même avec un autre collier.
+    """
+    model = get_model()
+    if image_hash is None or model is None:
+        return detect_neck_mask_lowres(img, model)
+
+    key = f"{image_hash}-{getattr(model, 'name', 'yolo')}-{MODEL_IMGSZ}"
+    cached = mask_cache.get(key)
+    if cached is not None:
+        return None if cached is NO_NECK else cached
+    try:
+        neck = _run_neck_detection(img, model)
+    except Exception as e:
+        logger.warning(f"⚠️ Erreur lors de la détection YOLO: {e}")
+        return None
+    mask_cache.put(key, NO_NECK if neck is None else neck)
+    return neck
+
+
+def detect_neck_mask(image, model, width, height):
+    # `image` peut être un chemin ou un tableau BGR déjà décodé (pas de relecture disque)
+    neck = detect_neck_mask_lowres(image, model)
+    if neck is None:
+        return None
+    mask = neck.to_image_mask()
+    if mask.shape != (height, width):
+        mask = cv2.resize(mask, (width, height))
+    return mask
+
+
 def find_vertical_intersection(mask_bin, point, height):
-    x, y_start = int(point[0]), int(point[1])
-    for y in range(y_start, height):
-        if mask_bin[y, x] == 255:
-            return (x, y)
-    return None
+    # Recherche vectorisée (argmax sur la colonne) au lieu d'un parcours pixel par pixel
+    return mask_geometry.find_vertical_intersection(mask_bin, point, height)
 
 
 def compute_collar_width(p1, p2):
@@ -52,74 +203,109 @@ def compute_collar_width(p1, p2):
     return 0
 
 
-def overlay_collar(image, collar_path, p1, p2, chin):
-    collar = cv2.imread(collar_path, cv2.IMREAD_UNCHANGED)
-    if collar is None:
-        raise Exception("❌ Problème lors du chargement du collier.")
-    if collar.shape[2] != 4:
-        raise Exception("❌ Le collier doit être un PNG avec canal alpha (RGBA).")
+# Rayon du noyau + 2 px pour l'interpolation bilinéaire du warp : au-delà, l'alpha
+# est nul, donc le flou restreint à la zone donne le même résultat que sur l'image entière.
+ROI_MARGIN = BLUR_KSIZE // 2 + 2
+
+
+def compute_overlay_roi(dst_pts, image_shape, margin=ROI_MARGIN):
+    """Boîte (x0, y0, x1, y1) couvrant le quadrilatère du collier, bornée à l'image."""
+    img_h, img_w = image_shape[:2]
+    x0 = max(int(np.floor(dst_pts[:, 0].min())) - margin, 0)
+    y0 = max(int(np.floor(dst_pts[:, 1].min())) - margin, 0)
+    x1 = min(int(np.ceil(dst_pts[:, 0].max())) + margin + 1, img_w)
+    y1 = min(int(np.ceil(dst_pts[:, 1].max())) + margin + 1, img_h)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
 
+
+def overlay_collar(image, collar_path, p1, p2, chin):
+    load_start = time.perf_counter()
     width = compute_collar_width(p1, p2)
     if width <= 0:
         raise Exception("❌ Largeur du collier invalide.")
 
-    scale = width / collar.shape[1]
-    collar_height = int(collar.shape[0] * scale)
-    collar = cv2.resize(collar, (width, collar_height), interpolation=cv2.INTER_AREA)
-    h, w = collar.shape[:2]
+    # Collier compilé (asset_compiler) : texture rognée, alpha déjà adouci
+    compiled = necklace_cache.get_compiled_texture(collar_path, width)
+    if compiled is not None:
+        texture, origin, (canvas_w, canvas_h) = compiled
+        collar_w, collar_h = necklace_cache.canvas_size(collar_path)
+    else:
+        collar = necklace_cache.get(collar_path)
+        if collar is None:
+            raise Exception("❌ Problème lors du chargement du collier.")
+        if collar.shape[2] != 4:
+            raise Exception("❌ Le collier doit être un PNG avec canal alpha (RGBA).")
+        collar_h, collar_w = collar.shape[:2]
+        texture = necklace_cache.get_resized(collar_path, width)
+        origin, (canvas_h, canvas_w) = (0, 0), texture.shape[:2]
+
+    # Texture déjà à la largeur exacte : la perspective ne fait que l'incliner
+    scale = width / collar_w
+    h = int(collar_h * scale)
+    metrics.observe_stage("collar_load", time.perf_counter() - load_start)
 
-    # Perspective transform
-    src_pts = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
+    # Perspective transform (canevas complet -> quadrilatère), précédée du
+    # décalage de la texture rognée dans ce canevas
+    src_pts = np.float32([[0, 0], [canvas_w, 0], [0, canvas_h], [canvas_w, canvas_h]])
     dy = abs(p2[1] - p1[1])
     bottom_left = (p1[0], p1[1] + h + dy)
     bottom_right = (p2[0], p2[1] + h + dy)
     dst_pts = np.float32([p1, p2, bottom_left, bottom_right])
 
-    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-    warped = cv2.warpPerspective(collar, M, (image.shape[1], image.shape[0]), borderMode=cv2.BORDER_TRANSPARENT)
+    trim_offset = np.array([[1, 0, origin[0]], [0, 1, origin[1]], [0, 0, 1]], dtype=np.float64)
+    M = cv2.getPerspectiveTransform(src_pts, dst_pts) @ trim_offset
+
+    # Tout le travail est limité à la boîte englobante du quadrilatère (+ marge du flou).
+    # Texture compilée : son halo adouci dépasse du canevas, on borne donc ses
+    # propres coins projetés (+ interpolation bilinéaire).
+    if compiled is not None:
+        tex_h, tex_w = texture.shape[:2]
+        corners = np.float32([[[0, 0]], [[tex_w, 0]], [[0, tex_h]], [[tex_w, tex_h]]])
+        roi = compute_overlay_roi(cv2.perspectiveTransform(corners, M).reshape(-1, 2), image.shape, margin=2)
+    else:
+        roi = compute_overlay_roi(dst_pts, image.shape)
+    if roi is None:
+        return image
+    x0, y0, x1, y1 = roi
+    shift = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+    with metrics.timer("warp"):
+        warped = np.zeros((y1 - y0, x1 - x0, 4), dtype=np.uint8)
+        cv2.warpPerspective(texture, shift @ M, (x1 - x0, y1 - y0), dst=warped, borderMode=cv2.BORDER_TRANSPARENT)
 
     # Blend with alpha
-    alpha = warped[:, :, 3] / 255.0
-    blurred_alpha = cv2.GaussianBlur(alpha, (15, 15), sigmaX=5)
-    for c in range(3):
-        image[:, :, c] = (
-            warped[:, :, c] * blurred_alpha + image[:, :, c] * (1 - blurred_alpha)
-        ).astype(np.uint8)
+    with metrics.timer("blend"):
+        region = image[y0:y1, x0:x1]
+        if compiled is not None:
+            blend_premultiplied_into(region, warped)
+        else:
+            blurred_alpha = feather_alpha(warped[:, :, 3], BLUR_KSIZE, BLUR_SIGMA)
+            blend_into(region, warped, blurred_alpha)
 
     return image
 
 
-def apply_necklace(
-    image_path,
-    necklace_path,
-    landmarks,   # <--- Les landmarks sont passés depuis le frontend
-    color_match=False,
-    add_shadow=False,
-    is_example=False
-):
-    print(f"🟢 apply_necklace appelée avec landmarks: {landmarks}")
-    
-    img = cv2.imread(image_path)
-    if img is None:
-        raise Exception("❌ Image introuvable.")
-
-    h, w = img.shape[:2]
-
+def place_on_neck(neck, landmarks, refine_horizontal=False):
+    """Placement à partir d'un masque déjà calculé (ou None) et des landmarks."""
     # Récupération des points envoyés et conversion en entiers
     left_ear = (int(landmarks["left_ear"][0]), int(landmarks["left_ear"][1]))
     right_ear = (int(landmarks["right_ear"][0]), int(landmarks["right_ear"][1]))
     chin = (int(landmarks["chin"][0]), int(landmarks["chin"][1]))
     
-    print(f"📍 Coordonnées converties - left_ear: {left_ear}, right_ear: {right_ear}, chin: {chin}")
+    logger.debug("📍 Coordonnées converties", extra={
+        "event": "placement", "left_ear": left_ear, "right_ear": right_ear, "chin": chin,
+    })
 
-    # Détection du masque YOLO
-    mask = detect_neck_mask(image_path, model, w, h)
     left_inter = right_inter = None
 
-    if mask is not None:
-        mask_bin = (mask > 127).astype(np.uint8) * 255
-        left_inter = find_vertical_intersection(mask_bin, left_ear, h)
-        right_inter = find_vertical_intersection(mask_bin, right_ear, h)
+    if neck is not None:
+        with metrics.timer("mask_scan"):
+            left_inter = neck.find_vertical_intersection(left_ear)
+            right_inter = neck.find_vertical_intersection(right_ear)
+
+            if refine_horizontal:
+                left_inter, right_inter = mask_geometry.snap_to_neck_edges(neck, left_inter, right_inter)
 
         if left_inter and left_inter[1] < chin[1]:
             left_inter = (int(left_inter[0]), int(chin[1] + 10))
@@ -144,22 +330,29 @@ def apply_necklace(
     if bust_height < 8:
         raise Exception("❌ Buste trop court, impossible de placer le collier.")
 
+    return left_inter, right_inter, chin
+
+
+def render_necklace(img, necklace_path, placement):
+    """Vérifie que le collier tient dans l'image puis l'applique (img est modifiée)."""
+    left_inter, right_inter, chin = placement
+    min_base_y = min(left_inter[1], right_inter[1])
+
     # Vérifier que le collier rentre
     collar_width = compute_collar_width(left_inter, right_inter)
-    collar = cv2.imread(necklace_path, cv2.IMREAD_UNCHANGED)
-    if collar is None:
+    canvas = necklace_cache.canvas_size(necklace_path)
+    if canvas is None:
         raise Exception("❌ Impossible de charger le collier.")
 
-    scale = collar_width / collar.shape[1]
-    collar_height = int(collar.shape[0] * scale)
+    scale = collar_width / canvas[0]
+    collar_height = int(canvas[1] * scale)
     collar_bottom = min_base_y + collar_height
 
     if collar_bottom > img.shape[0]:
         raise Exception("❌ Le collier dépasserait de l'image.")
     else:
-        print("✅ Le collier tient dans l'image.")
+        logger.debug("✅ Le collier tient dans l'image.", extra={"event": "fit_check"})
 
     # Appliquer le collier
-    img = overlay_collar(img, necklace_path, left_inter, right_inter, chin)
+    return overlay_collar(img, necklace_path, left_inter, right_inter, chin)
 
-    return img
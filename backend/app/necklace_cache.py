@@ -0,0 +1,220 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import asset_compiler
+
+# Catalogue des colliers (PNG sources, et compiled/ pour asset_compiler)
+NECKLACE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "usefull_necklace"
+)
+
+# === Configuration du cache des colliers ===
+# Budget mémoire borné : la VM Fly ne dispose que de 1 Go (fly.toml)
+CACHE_MAX_BYTES = int(os.environ.get("NECKLACE_CACHE_MB", "64")) * 1024 * 1024
+# Colliers compilés (asset_compiler) utilisés quand ils sont à jour ; sinon le PNG
+COMPILED_ENABLED = os.environ.get("NECKLACE_COMPILED", "1") == "1"
+
+
+class NecklaceCache:
+    """
+    Cache LRU, partagé par tout le processus, des colliers décodés.
+
+    Les entrées sont indexées par (chemin, mtime) : un PNG modifié sur le disque
+    est donc rechargé automatiquement. On y garde l'image RGBA décodée et ses
+    variantes redimensionnées, une par largeur exacte (redimensionner une seule
+    fois depuis la source : pas de second rééchantillonnage au warp). Quand le
+    total dépasse `max_bytes`, les entrées les moins récemment utilisées sont évincées.
+
+    Quand un collier compilé à jour existe, il est préféré : il est
+    projeté en mémoire (hors budget, pages partagées entre workers) et seules
+    ses textures redimensionnées passent par le LRU.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._compiled = {}   # (chemin, mtime) -> CompiledNecklace ou None
+        self.hits = 0
+        self.misses = 0
+
+    # --- Gestion LRU ---
+    def _lookup(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _store(self, key, value):
+        nbytes = value.nbytes
+        if nbytes > self.max_bytes:
+            return value
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.nbytes
+            self._entries[key] = value
+            self._size += nbytes
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.nbytes
+        return value
+
+    @staticmethod
+    def _file_key(path):
+        path = os.path.abspath(path)
+        try:
+            return path, os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    # --- Accès aux colliers ---
+    def get(self, path):
+        """Image BGRA décodée (IMREAD_UNCHANGED), ou None si illisible."""
+        file_key = self._file_key(path)
+        if file_key is None:
+            return None
+        key = ("rgba",) + file_key
+        collar = self._lookup(key)
+        if collar is None:
+            collar = cv2.imread(file_key[0], cv2.IMREAD_UNCHANGED)
+            if collar is None:
+                return None
+            collar.setflags(write=False)
+            self._store(key, collar)
+        return collar
+
+    def get_compiled(self, path):
+        """Collier compilé à jour (projeté en mémoire), ou None : il faut passer par le PNG."""
+        if not COMPILED_ENABLED:
+            return None
+        file_key = self._file_key(path)
+        if file_key is None:
+            return None
+        with self._lock:
+            if file_key in self._compiled:
+                return self._compiled[file_key]
+        # Vérification (hash du PNG) faite une fois par version du fichier
+        compiled = asset_compiler.load_compiled(file_key[0])
+        with self._lock:
+            self._compiled[file_key] = compiled
+        return compiled
+
+    def canvas_size(self, path):
+        """(largeur, hauteur) du collier complet, sans décoder le PNG s'il est compilé."""
+        compiled = self.get_compiled(path)
+        if compiled is not None:
+            return compiled.canvas
+        collar = self.get(path)
+        return None if collar is None else (collar.shape[1], collar.shape[0])
+
+    def get_compiled_texture(self, path, width):
+        """
+        Texture compilée à la largeur `width` : (BGRA prémultiplié par l'alpha
+        adouci, origine (x, y) et taille (largeur, hauteur) du canevas complet,
+        à l'échelle de la texture), ou None. Le collier est mis à la taille de
+        get_resized puis adouci à cette échelle : même rendu que le chemin PNG.
+        """
+        compiled = self.get_compiled(path)
+        file_key = self._file_key(path)
+        if compiled is None or file_key is None:
+            return None
+        width = int(width)
+        full_w, full_h = compiled.canvas
+        tex_h = max(1, int(full_h * width / full_w))
+        fx, fy = width / full_w, tex_h / full_h
+        ox, oy = compiled.origin
+        pad = asset_compiler.BLUR_KSIZE // 2
+        # Premiers pixels de sortie touchés par les données (un de marge pour l'interpolation)
+        lead_x, lead_y = max(int(ox * fx) - 1, 0), max(int(oy * fy) - 1, 0)
+
+        key = ("compiled", width) + file_key
+        texture = self._lookup(key)
+        if texture is None:
+            # Redimensionné depuis le coin du canevas : même grille d'échantillonnage
+            # qu'INTER_AREA sur le PNG entier, donc mêmes détails fins de la chaîne
+            h, w = compiled.data.shape[:2]
+            anchored = np.zeros((oy + h, ox + w, 4), dtype=np.uint8)
+            anchored[oy:, ox:] = compiled.data
+            resized = cv2.resize(anchored, None, fx=fx, fy=fy, interpolation=cv2.INTER_AREA)
+            # Marge transparente où le flou déborde (hors du canevas : noir, comme le warp du PNG)
+            bordered = cv2.copyMakeBorder(
+                resized[lead_y:, lead_x:], pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=0
+            )
+            texture = asset_compiler.feather_premultiplied(bordered)
+            texture.setflags(write=False)
+            self._store(key, texture)
+        return texture, (lead_x - pad, lead_y - pad), (width, tex_h)
+
+    def get_resized(self, path, width):
+        """Collier redimensionné (INTER_AREA) à la largeur `width`, hauteur proportionnelle."""
+        file_key = self._file_key(path)
+        if file_key is None:
+            return None
+        width = int(width)
+        key = ("resized", width) + file_key
+        resized = self._lookup(key)
+        if resized is None:
+            collar = self.get(path)
+            if collar is None:
+                return None
+            height = max(1, int(collar.shape[0] * width / collar.shape[1]))
+            resized = cv2.resize(collar, (width, height), interpolation=cv2.INTER_AREA)
+            resized.setflags(write=False)
+            self._store(key, resized)
+        return resized
+
+    def preload(self, directory, extensions=(".png",)):
+        """Décode à l'avance les colliers d'un dossier (dans la limite du budget) ; les compilés sont seulement projetés."""
+        loaded, last_nbytes = 0, 0
+        if not os.path.isdir(directory):
+            return loaded
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                if self.get_compiled(entry.path) is not None:
+                    loaded += 1
+                    continue
+                file_key = self._file_key(entry.path)
+                cached = self._entries.get(("rgba",) + file_key) if file_key else None
+                if cached is not None:
+                    loaded += 1
+                    last_nbytes = cached.nbytes
+                    continue
+                # Cache presque plein : s'arrêter plutôt qu'évincer les colliers déjà chargés
+                if self._size + last_nbytes > self.max_bytes:
+                    break
+                collar = self.get(entry.path)
+                if collar is not None:
+                    loaded += 1
+                    last_nbytes = collar.nbytes
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "compiled": sum(compiled is not None for compiled in self._compiled.values()),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._compiled.clear()
+            self._size = 0
+
+
+# Instance unique pour le processus
+necklace_cache = NecklaceCache()
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+import necklace2D
+from landmarks import face_mesh_pool
+
+# === Pipeline de rendu en graphe d'étapes ===
+# decode -> (landmarks || mask) -> placement -> composite -> encode
+# Les étapes indépendantes tournent en même temps (FaceMesh et YOLO relâchent le GIL) :
+# la latence d'une requête devient le maximum des deux inférences, pas leur somme.
+PIPELINE_THREADS = max(1, int(os.environ.get("PIPELINE_THREADS", "4")))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool partagé, créé à la première requête (après le fork des workers)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PIPELINE_THREADS, thread_name_prefix="pipeline")
+        return _executor
+
+
+def queue_depth():
+    """Étapes soumises au pool et pas encore démarrées."""
+    return _executor._work_queue.qsize() if _executor is not None else 0
+
+
+class UnreadableImage(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, name, fn, inputs):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+
+
+class Pipeline:
+    """
+    Graphe d'étapes : chaque étape reçoit les valeurs nommées dans `inputs`
+    (entrées du pipeline ou sorties d'étapes précédentes) et produit la valeur
+    portant son nom. Dès qu'une étape est prête elle est lancée ; quand
+    plusieurs le sont, toutes sauf une partent sur le pool et la dernière
+    s'exécute dans le thread appelant.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    @staticmethod
+    def _run_stage(stage, args):
+        start = time.perf_counter()
+        value = stage.fn(*args)
+        return value, (time.perf_counter() - start) * 1000
+
+    def run(self, executor=None, **inputs):
+        """Retourne (valeurs, durées en ms par étape) ; la première erreur d'étape est relevée."""
+        executor = executor or get_executor()
+        values, timings = dict(inputs), {}
+        pending = list(self.stages)
+        running = {}
+        start = time.perf_counter()
+        while pending or running:
+            ready = [stage for stage in pending if all(name in values for name in stage.inputs)]
+            for stage in ready:
+                pending.remove(stage)
+            for stage in ready[:-1]:
+                args = [values[name] for name in stage.inputs]
+                running[executor.submit(self._run_stage, stage, args)] = stage
+            if ready:
+                stage = ready[-1]
+                values[stage.name], timings[stage.name] = self._run_stage(
+                    stage, [values[name] for name in stage.inputs]
+                )
+                continue
+            if not running:
+                missing = sorted({name for stage in pending for name in stage.inputs} - set(values))
+                raise RuntimeError(f"Entrées de pipeline manquantes: {missing}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                values[stage.name], timings[stage.name] = future.result()
+        timings["total"] = (time.perf_counter() - start) * 1000
+        return values, timings
+
+
+# === Étapes de l'essayage ===
+def _decode(image_bytes):
+    image = necklace2D.decode_image(image_bytes)
+    if image is None:
+        raise UnreadableImage("Image illisible")
+    return image
+
+
+def _landmarks(image, client_landmarks):
+    if client_landmarks is not None:
+        return client_landmarks
+    landmarks = face_mesh_pool.detect(image)
+    if landmarks is None:
+        raise Exception("❌ Aucun visage détecté.")
+    return landmarks
+
+
+def _composite(image, necklace_paths, placement):
+    """Un rendu par collier ; l'exception remplace l'image si ce collier ne tient pas."""
+    results = []
+    for necklace_path in necklace_paths:
+        target = image.copy() if len(necklace_paths) > 1 else image
+        try:
+            results.append((necklace_path, necklace2D.render_necklace(target, necklace_path, placement)))
+        except Exception as e:
+            results.append((necklace_path, e))
+    return results
+
+
+def _encode(rendered):
+    return [
+        (path, result if isinstance(result, Exception) else necklace2D.encode_image(result))
+        for path, result in rendered
+    ]
+
+
+TRYON_PIPELINE = Pipeline([
+    Stage("decode", _decode, ["image_bytes"]),
+    Stage("landmarks", _landmarks, ["decode", "client_landmarks"]),
+    Stage("mask", necklace2D.get_neck_mask, ["decode", "image_hash"]),
+    Stage("placement", necklace2D.place_on_neck, ["mask", "landmarks", "refine_horizontal"]),
+    Stage("composite", _composite, ["decode", "necklace_paths", "placement"]),
+    Stage("encode", _encode, ["composite"]),
+])
+
+
+def run_tryon(image_bytes, necklace_paths, landmarks, refine_horizontal=False, image_hash=None):
+    """
+    Essayage complet depuis les octets de l'upload. Retourne
+    ([(chemin, JPEG ou exception)], durées par étape). Lève UnreadableImage si
+    la photo ne se décode pas ; sans landmarks, FaceMesh tourne pendant YOLO.
+    """
+    values, timings = TRYON_PIPELINE.run(
+        image_bytes=image_bytes,
+        client_landmarks=landmarks,
+        image_hash=image_hash,
+        necklace_paths=list(necklace_paths),
+        refine_horizontal=refine_horizontal,
+    )
+    record_metrics(values, timings)
+    return values["encode"], timings
+
+
+def record_metrics(values, timings):
+    """Durées des étapes, et durée totale par collier et tranche de résolution."""
+    if not metrics.METRICS_ENABLED:
+        return
+    for stage, duration in timings.items():
+        if stage != "total":
+            metrics.observe_stage(stage, duration / 1000)
+    resolution = metrics.resolution_bucket(values["decode"].shape)
+    for path, result in values["encode"]:
+        necklace = os.path.basename(path)
+        if isinstance(result, Exception):
+            metrics.RENDERS.inc(necklace=necklace, result="error")
+            continue
+        metrics.RENDERS.inc(necklace=necklace, result="ok")
+        metrics.RENDER_DURATION.observe(timings["total"] / 1000, necklace=necklace, resolution=resolution)
@@ -0,0 +1,259 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import landmarks as landmarks_detection
+from necklace_cache import NECKLACE_DIR
+from render_workers import available_cores
+
+# === Pré-rendu des essayages d'exemple (photos d'exemple x catalogue de colliers) ===
+# Lancé au build (build_frontend.sh) : chaque couple est rendu à l'avance dans
+# frontend/public/prerendered/<exemple>/<collier>.jpg, copié dans dist/ par Vite,
+# donc servi comme un fichier statique (ou par un CDN). Le manifeste garde le
+# hash des entrées de chaque couple : seuls les couples modifiés sont refaits.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(BASE_DIR))
+EXAMPLES_DIR = os.path.join(PROJECT_ROOT, "frontend", "public", "assets", "examples")
+OUTPUT_DIR = os.path.join(PROJECT_ROOT, "frontend", "public", "prerendered")
+# Servis en priorité depuis le build, sinon depuis public/ (développement)
+SERVE_DIRS = [
+    os.path.join(PROJECT_ROOT, "frontend", "dist", "prerendered"),
+    OUTPUT_DIR,
+]
+PRERENDER_ENABLED = os.environ.get("PRERENDERED_EXAMPLES", "1") == "1"
+MANIFEST_NAME = "manifest.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+# Le code du rendu fait partie des entrées : le modifier invalide tous les couples
+RENDERER_SOURCES = (
+    "necklace2D.py", "compositing.py", "mask_geometry.py", "necklace_cache.py", "asset_compiler.py", "pipeline.py",
+    "neck_model.py", "landmarks.py",
+)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def renderer_fingerprint():
+    """Sources du rendu et modèle du cou (nom, taille, date) : une version du moteur."""
+    import neck_model
+
+    digest = hashlib.sha256()
+    for name in RENDERER_SOURCES:
+        with open(os.path.join(BASE_DIR, name), "rb") as f:
+            digest.update(f.read())
+    backend = os.environ.get("NECK_MODEL_BACKEND", "ultralytics")
+    model_path = os.environ.get("NECK_MODEL_PATH") or neck_model.DEFAULT_PATHS.get(backend, "")
+    try:
+        stat = os.stat(model_path)
+        model = [backend, os.path.basename(model_path), stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        model = [backend, None]
+    digest.update(json.dumps([model, neck_model.MODEL_IMGSZ]).encode())
+    return digest.hexdigest()
+
+
+def list_images(folder, extensions=IMAGE_EXTENSIONS):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder) if name.lower().endswith(extensions))
+
+
+def output_name(example, necklace):
+    return f"{os.path.splitext(example)[0]}/{os.path.splitext(necklace)[0]}.jpg"
+
+
+def pair_key(example, necklace):
+    return f"{example}/{necklace}"
+
+
+def _render_example(example_path, necklace_paths, landmarks):
+    """Dans un processus du pool : tous les colliers d'un exemple (un seul masque, un seul placement)."""
+    import pipeline
+
+    # Sans fichier voisin, FaceMesh doit être là : le dire plutôt qu'un faux « Aucun visage détecté »
+    if landmarks is None and not landmarks_detection.available():
+        return [(path, None, landmarks_detection.SIDECAR_MISSING_ERROR) for path in necklace_paths], {}
+    with open(example_path, "rb") as f:
+        image_bytes = f.read()
+    try:
+        results, timings = pipeline.run_tryon(image_bytes, necklace_paths, landmarks)
+    except Exception as e:
+        return [(path, None, str(e)) for path in necklace_paths], {}
+    return [
+        (path, None, str(result)) if isinstance(result, Exception) else (path, result, None)
+        for path, result in results
+    ], timings
+
+
+def build(examples_dir=EXAMPLES_DIR, necklace_dir=NECKLACE_DIR, output_dir=OUTPUT_DIR, jobs=None, force=False):
+    """
+    Rend les couples absents ou dont une entrée a changé (photo, landmarks,
+    collier, moteur de rendu) et retire ceux qui n'existent plus. Retourne le manifeste.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as f:
+            previous = json.load(f).get("pairs", {})
+
+    renderer = renderer_fingerprint()
+    necklaces = {name: file_hash(os.path.join(necklace_dir, name)) for name in list_images(necklace_dir, (".png",))}
+    pairs, stale = {}, {}
+    for example in list_images(examples_dir):
+        example_path = os.path.join(examples_dir, example)
+        landmarks = landmarks_detection.read_sidecar(example_path)
+        example_hash = file_hash(example_path)
+        for necklace, necklace_hash in necklaces.items():
+            key = pair_key(example, necklace)
+            input_hash = hashlib.sha256(
+                json.dumps([example_hash, landmarks, necklace_hash, renderer]).encode()
+            ).hexdigest()
+            entry = previous.get(key)
+            output = output_name(example, necklace)
+            # Un couple en échec est retenté à chaque build (échec souvent lié à l'environnement)
+            fresh = entry is not None and entry["input_hash"] == input_hash and not entry.get("error") \
+                and os.path.exists(os.path.join(output_dir, output))
+            if fresh:
+                pairs[key] = entry
+            else:
+                pairs[key] = {"example": example, "necklace": necklace, "input_hash": input_hash,
+                              "necklace_hash": necklace_hash, "output": output}
+                stale.setdefault(example, (example_path, landmarks, []))[2].append(necklace)
+
+    # Couples disparus (exemple ou collier retiré) : fichiers supprimés
+    for key, entry in previous.items():
+        if key not in pairs and entry.get("output"):
+            path = os.path.join(output_dir, entry["output"])
+            if os.path.exists(path):
+                os.remove(path)
+    for example in os.listdir(output_dir):
+        folder = os.path.join(output_dir, example)
+        if os.path.isdir(folder) and not os.listdir(folder):
+            shutil.rmtree(folder)
+
+    rendered = failed = 0
+    start = time.perf_counter()
+    if stale:
+        total = sum(len(names) for _, _, names in stale.values())
+        print(f"🎨 {total} couples à rendre ({len(pairs) - total} à jour), {len(stale)} exemple(s)")
+        with ProcessPoolExecutor(max_workers=jobs or min(len(stale), available_cores())) as pool:
+            futures = {
+                pool.submit(_render_example, path, [os.path.join(necklace_dir, n) for n in names], landmarks): example
+                for example, (path, landmarks, names) in stale.items()
+            }
+            for future in as_completed(futures):
+                example = futures[future]
+                results, _ = future.result()
+                for path, jpeg, error in results:
+                    entry = pairs[pair_key(example, os.path.basename(path))]
+                    if error:
+                        entry.update(error=error, output_hash=None, bytes=0)
+                        failed += 1
+                        print(f"⚠️ {example} x {os.path.basename(path)}: {error}")
+                        continue
+                    target = os.path.join(output_dir, entry["output"])
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(target, "wb") as f:
+                        f.write(jpeg)
+                    entry.pop("error", None)
+                    entry.update(output_hash=hashlib.sha256(jpeg).hexdigest(), bytes=len(jpeg))
+                    rendered += 1
+    else:
+        print(f"✅ {len(pairs)} couples déjà à jour")
+
+    manifest = {
+        "version": 1,
+        "renderer": renderer,
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "pairs": dict(sorted(pairs.items())),
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    if stale:
+        print(f"✅ {rendered} rendus, {failed} en échec en {time.perf_counter() - start:.1f} s")
+    return manifest
+
+
+# === Service des rendus d'exemple ===
+class PrerenderedIndex:
+    """
+    Manifeste chargé à la demande (rechargé si le fichier change) ; un couple
+    n'est servi que si son collier est toujours celui qui a été rendu.
+    """
+
+    def __init__(self, directories=SERVE_DIRS, necklace_dir=NECKLACE_DIR):
+        self.directories = directories
+        self.necklace_dir = necklace_dir
+        self._lock = threading.Lock()
+        self._loaded = None          # (chemin du manifeste, mtime)
+        self._directory = None
+        self._pairs = {}
+        self._necklace_hashes = {}   # nom -> (mtime_ns, hash)
+
+    def _reload(self):
+        for directory in self.directories:
+            path = os.path.join(directory, MANIFEST_NAME)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if self._loaded != (path, mtime):
+                with open(path) as f:
+                    self._pairs = json.load(f).get("pairs", {})
+                self._loaded, self._directory = (path, mtime), directory
+            return
+        self._loaded, self._directory, self._pairs = None, None, {}
+
+    def _necklace_hash(self, necklace):
+        path = os.path.join(self.necklace_dir, necklace)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._necklace_hashes.get(necklace)
+        if cached is None or cached[0] != mtime:
+            cached = self._necklace_hashes[necklace] = (mtime, file_hash(path))
+        return cached[1]
+
+    def lookup(self, example, necklace):
+        """Chemin du rendu pré-calculé, ou None (absent, en échec ou périmé)."""
+        if not example or os.path.basename(example) != example:
+            return None
+        with self._lock:
+            try:
+                self._reload()
+                entry = self._pairs.get(pair_key(example, necklace))
+                if entry is None or entry.get("error") or entry["necklace_hash"] != self._necklace_hash(necklace):
+                    return None
+            except (OSError, ValueError, KeyError):
+                return None
+            path = os.path.join(self._directory, entry["output"])
+        return path if os.path.exists(path) else None
+
+
+prerendered = PrerenderedIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pré-rendu des essayages d'exemple (exemples x colliers)")
+    parser.add_argument("--examples", default=EXAMPLES_DIR)
+    parser.add_argument("--necklaces", default=NECKLACE_DIR)
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--jobs", type=int, default=None, help="Processus de rendu (défaut : un par cœur)")
+    parser.add_argument("--force", action="store_true", help="Tout refaire")
+    args = parser.parse_args()
+    build(args.examples, args.necklaces, args.output, args.jobs, args.force)
+
+
+if __name__ == "__main__":
+    main()
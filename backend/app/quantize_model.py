@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+import neck_model
+from mask_geometry import NeckMask
+
+# === Quantification INT8 du modèle du cou et harnais de non-régression ===
+PROJECT_ROOT = os.path.dirname(os.path.dirname(neck_model.BASE_DIR))
+DEFAULT_IMAGES_DIR = os.path.join(PROJECT_ROOT, "data", "raw", "GDrive", "Necks")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def iter_images(folder, limit=None):
+    """Chemins des images du dossier (récursif, ordre stable)."""
+    count = 0
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+
+def _read_images(folder, limit=None):
+    for path in iter_images(folder, limit):
+        image = cv2.imread(path)
+        if image is None:
+            print(f"⚠️ Image illisible ignorée: {path}")
+            continue
+        yield path, image
+
+
+# === Quantification statique (ONNX Runtime, format QDQ) ===
+def quantize(fp32_path, output_path, images_dir, limit=100):
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class NeckCalibrationReader(CalibrationDataReader):
+        """Photos de cous letterboxées (format carré, comme en production par lots)."""
+
+        def __init__(self, input_name):
+            self.input_name = input_name
+            self.images = _read_images(images_dir, limit)
+
+        def get_next(self):
+            for _, image in self.images:
+                model_input, _, _ = neck_model.letterbox(image, square=True)
+                return {self.input_name: neck_model.to_tensor([model_input])}
+            return None
+
+    fp32 = onnx.load(fp32_path)
+    input_name = fp32.graph.input[0].name
+    print(f"🔧 Calibration INT8 sur {images_dir} (max {limit} images)...")
+    quantize_static(
+        fp32_path,
+        output_path,
+        NeckCalibrationReader(input_name),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+
+    # Conserver les métadonnées Ultralytics (noms des classes, stride...)
+    quantized = onnx.load(output_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(fp32.metadata_props)
+    onnx.save(quantized, output_path)
+    print(f"✅ Modèle INT8 écrit: {output_path}")
+    return output_path
+
+
+# === Évaluation : IoU des masques, écart des points de placement, latence ===
+def _face_landmarks():
+    """Détecteur FaceMesh (mediapipe) si disponible, sinon None."""
+    try:
+        import mediapipe as mp
+    except ImportError:
+        return None
+    face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True)
+
+    def detect(image):
+        h, w = image.shape[:2]
+        result = face_mesh.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        if not result.multi_face_landmarks:
+            return None
+        landmarks = result.multi_face_landmarks[0].landmark
+        return [(int(landmarks[i].x * w), int(landmarks[i].y * h)) for i in (234, 454)]
+
+    return detect
+
+
+def _probe_points(neck):
+    """Sans visage détecté : deux sondes au-dessus du cou, à 25 % et 75 % de sa largeur."""
+    mask = neck.to_image_mask()
+    ys, xs = np.nonzero(mask)
+    if ys.size == 0:
+        return []
+    y_start = max(int(ys.min()) - 1, 0)
+    return [(int(np.percentile(xs, 25)), y_start), (int(np.percentile(xs, 75)), y_start)]
+
+
+def _timed_mask(model, model_input):
+    start = time.perf_counter()
+    mask = model.predict_masks([model_input])[0]
+    return mask, (time.perf_counter() - start) * 1000
+
+
+def _mask_iou(a, b):
+    if a is None or b is None:
+        return 1.0 if a is None and b is None else 0.0
+    a, b = a > 0, b > 0
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def evaluate(reference, candidate, images_dir, limit=None):
+    """Compare deux backends image par image ; retourne {"images": [...], "summary": {...}}."""
+    detect_landmarks = _face_landmarks()
+    rows = []
+    for path, image in _read_images(images_dir, limit):
+        model_input, scale, pad = neck_model.letterbox(image)
+        ref_mask, ref_ms = _timed_mask(reference, model_input)
+        cand_mask, cand_ms = _timed_mask(candidate, model_input)
+        row = {
+            "image": os.path.relpath(path, images_dir),
+            "iou": _mask_iou(ref_mask, cand_mask),
+            "reference_ms": ref_ms,
+            "candidate_ms": cand_ms,
+            "placement_px": [],
+        }
+        if ref_mask is not None and cand_mask is not None:
+            ref_neck = NeckMask(ref_mask, image.shape, scale, pad)
+            cand_neck = NeckMask(cand_mask, image.shape, scale, pad)
+            points = (detect_landmarks(image) if detect_landmarks else None) or _probe_points(ref_neck)
+            for point in points:
+                a = ref_neck.find_vertical_intersection(point)
+                b = cand_neck.find_vertical_intersection(point)
+                if a is None and b is None:
+                    continue
+                # Un point trouvé d'un côté seulement compte comme un écart d'une image entière
+                distance = float(np.hypot(a[0] - b[0], a[1] - b[1])) if a and b else float(image.shape[0])
+                row["placement_px"].append(distance)
+        rows.append(row)
+        print(f"  {row['image']}: IoU {row['iou']:.3f}, {ref_ms:.0f} ms -> {cand_ms:.0f} ms")
+
+    if not rows:
+        raise SystemExit(f"❌ Aucune image exploitable dans {images_dir}")
+    ious = np.array([r["iou"] for r in rows])
+    distances = np.array([d for r in rows for d in r["placement_px"]] or [0.0])
+    ref_ms = np.array([r["reference_ms"] for r in rows])
+    cand_ms = np.array([r["candidate_ms"] for r in rows])
+    summary = {
+        "images": len(rows),
+        "reference": getattr(reference, "path", reference.name),
+        "candidate": getattr(candidate, "path", candidate.name),
+        "mean_iou": float(ious.mean()),
+        "min_iou": float(ious.min()),
+        "mean_placement_px": float(distances.mean()),
+        "p95_placement_px": float(np.percentile(distances, 95)),
+        "reference_ms": float(ref_ms.mean()),
+        "candidate_ms": float(cand_ms.mean()),
+        "speedup": float(ref_ms.mean() / cand_ms.mean()) if cand_ms.mean() else None,
+    }
+    return {"images": rows, "summary": summary}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantification INT8 du modèle du cou et contrôle de précision")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    quantize_parser = subparsers.add_parser("quantize", help="Produire model_vf4.int8.onnx puis l'évaluer")
+    quantize_parser.add_argument("--images", default=DEFAULT_IMAGES_DIR, help="Photos de calibration")
+    quantize_parser.add_argument("--fp32", default=neck_model.ONNX_PATH, help="Modèle ONNX FP32 (exporté si absent)")
+    quantize_parser.add_argument("--output", default=neck_model.INT8_PATH)
+    quantize_parser.add_argument("--limit", type=int, default=100)
+    quantize_parser.add_argument("--skip-eval", action="store_true")
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="Comparer un modèle candidat à la référence")
+    evaluate_parser.add_argument("--images", default=DEFAULT_IMAGES_DIR)
+    evaluate_parser.add_argument("--reference-backend", choices=sorted(neck_model.BACKENDS), default="ultralytics")
+    evaluate_parser.add_argument("--reference-path", default=None)
+    evaluate_parser.add_argument("--candidate", default=neck_model.INT8_PATH, help="Modèle ONNX à évaluer")
+    evaluate_parser.add_argument("--limit", type=int, default=None)
+    evaluate_parser.add_argument("--report", default=None, help="Chemin du rapport JSON")
+
+    args = parser.parse_args()
+    if args.command == "quantize":
+        if not os.path.exists(args.fp32):
+            print("📦 Export ONNX FP32 préalable...")
+            args.fp32 = neck_model.export_model("onnx")
+        candidate_path = quantize(args.fp32, args.output, args.images, args.limit)
+        if args.skip_eval:
+            return
+        reference = neck_model.load_model("onnx", args.fp32)
+        images, report_path, limit = args.images, None, None
+    else:
+        candidate_path = args.candidate
+        reference = neck_model.load_model(args.reference_backend, args.reference_path)
+        images, report_path, limit = args.images, args.report, args.limit
+
+    if reference is None:
+        raise SystemExit("❌ Modèle de référence introuvable.")
+    candidate = neck_model.OnnxBackend(candidate_path)
+    report = evaluate(reference, candidate, images, limit)
+    report_path = report_path or neck_model.report_path_for(candidate_path)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    summary = report["summary"]
+    print(
+        f"📊 {summary['images']} images — IoU moyen {summary['mean_iou']:.3f} (min {summary['min_iou']:.3f}), "
+        f"placement p95 {summary['p95_placement_px']:.1f} px, "
+        f"{summary['reference_ms']:.0f} ms -> {summary['candidate_ms']:.0f} ms"
+    )
+    print(f"💾 Rapport écrit: {report_path}")
+    neck_model.quantized_model_accepted(candidate_path)
+
+
+if __name__ == "__main__":
+    main()
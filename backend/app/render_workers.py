@@ -0,0 +1,89 @@
+import gc
+import os
+import sys
+import threading
+
+# === Workers de rendu (processus gunicorn) ===
+# Avec plusieurs workers, le modèle est chargé une fois dans le processus maître
+# (preload_app), puis partagé en copie-sur-écriture par les workers forkés.
+# Voir backend/gunicorn.conf.py et warmup.py.
+
+
+def available_cores():
+    """Cœurs réellement utilisables par le processus (affinité / cgroup cpuset)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_count():
+    """RENDER_WORKERS, sinon WEB_CONCURRENCY, sinon un worker par cœur disponible."""
+    value = os.environ.get("RENDER_WORKERS") or os.environ.get("WEB_CONCURRENCY")
+    return max(1, int(value)) if value else available_cores()
+
+
+def threads_per_worker(workers):
+    """Threads de calcul (OpenCV, PyTorch, ONNX) par worker : les cœurs sont partagés, pas multipliés."""
+    return max(1, available_cores() // max(1, workers))
+
+
+def limit_threads(workers):
+    """
+    Dans le maître, avant le chargement de l'application (preload_app) : les
+    runtimes OpenMP / ONNX lisent ces variables à leur initialisation, qui a
+    lieu dans le maître ; les poser après le fork serait sans effet.
+    """
+    threads = threads_per_worker(workers)
+    os.environ.setdefault("NECK_MODEL_THREADS", str(threads))
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    return threads
+
+
+def before_fork(workers):
+    """
+    Dans le maître, juste avant chaque fork. Avec plusieurs workers, le modèle et
+    les colliers sont chargés ici une fois (sans inférence) ; avec un seul, c'est
+    le worker qui s'en charge en arrière-plan pour répondre plus vite au démarrage.
+    Les objets chargés passent ensuite dans la génération permanente du
+    ramasse-miettes, qui n'y écrira plus — leurs pages restent partagées.
+    """
+    import necklace2D
+
+    if workers > 1 and not necklace2D._model_loaded:
+        from warmup import warmup
+
+        warmup.load()
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork(workers):
+    """Dans chaque worker, juste après le fork : limites de threads et état propre au processus."""
+    # Les variables d'environnement (limit_threads) ne valent que pour les
+    # runtimes pas encore initialisés : OpenCV et PyTorch sont réglés ici
+    threads = threads_per_worker(workers)
+
+    import cv2
+
+    cv2.setNumThreads(threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+    import necklace2D
+
+    # Les verrous et le thread de micro-lots du maître ne sont pas valides ici
+    necklace2D._scheduler = None
+    necklace2D._scheduler_model = None
+    necklace2D._scheduler_lock = threading.Lock()
+    necklace2D._predict_lock = threading.Lock()
+    necklace2D._model_lock = threading.Lock()
+    model = necklace2D.model
+    if model is not None and not getattr(model, "fork_safe", True):
+        # Rechargé par le préchauffage du worker
+        necklace2D.model, necklace2D._model_loaded = None, False
+
+    from warmup import warmup
+
+    warmup.start()
+    print(f"🧵 Worker de rendu {os.getpid()} démarré ({threads} thread(s) de calcul)")
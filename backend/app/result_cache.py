@@ -0,0 +1,223 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from mask_geometry import NeckMask
+
+# === Cache des résultats d'essayage (adressé par contenu) ===
+# Deux niveaux, tous deux bornés : mémoire (LRU) puis disque (plus anciens fichiers évincés)
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE", "1") == "1"
+CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "br-online-cache"))
+RESULT_MEMORY_BYTES = int(os.environ.get("RESULT_CACHE_MB", "32")) * 1024 * 1024
+RESULT_DISK_BYTES = int(os.environ.get("RESULT_CACHE_DISK_MB", "256")) * 1024 * 1024
+MASK_MEMORY_BYTES = int(os.environ.get("MASK_CACHE_MB", "16")) * 1024 * 1024
+MASK_DISK_BYTES = int(os.environ.get("MASK_CACHE_DISK_MB", "64")) * 1024 * 1024
+# Les landmarks sont arrondis à ce pas (pixels) avant d'entrer dans la clé
+LANDMARK_ROUNDING = max(1, int(os.environ.get("RESULT_CACHE_LANDMARK_PX", "2")))
+
+logger = logging.getLogger(__name__)
+
+# Marqueur « aucun cou détecté » (mis en cache lui aussi)
+NO_NECK = object()
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def round_landmarks(landmarks, step=LANDMARK_ROUNDING):
+    return {
+        name: [int(round(float(v) / step)) * step for v in landmarks[name][:2]]
+        for name in sorted(landmarks)
+    }
+
+
+def result_key(image_hash, necklace_path, landmarks, **options):
+    """
+    Clé d'un rendu : image, collier (nom + mtime), landmarks arrondis, options.
+    Sans landmarks (détectés côté serveur), la photo suffit à les déterminer.
+    """
+    try:
+        necklace_mtime = os.stat(necklace_path).st_mtime_ns
+    except OSError:
+        necklace_mtime = 0
+    payload = json.dumps(
+        [image_hash, os.path.basename(necklace_path), necklace_mtime,
+         "server" if landmarks is None else round_landmarks(landmarks), options],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class TieredCache:
+    """
+    Cache clé -> octets à deux niveaux. La mémoire garde les entrées les plus
+    récentes dans la limite de `memory_bytes` ; le disque (un fichier par clé)
+    est borné à `disk_bytes`, les fichiers les moins récemment lus partant en premier.
+    """
+
+    def __init__(self, name, memory_bytes, disk_bytes, directory=CACHE_DIR):
+        self.name = name
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = os.path.join(directory, name) if directory and disk_bytes > 0 else None
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    # --- Niveau mémoire ---
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_size -= len(previous)
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    # --- Niveau disque ---
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _scan_disk(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _store_on_disk(self, key, data):
+        if self.directory is None or len(data) > self.disk_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Cache {self.name}: écriture disque impossible ({e})")
+            return
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._scan_disk())
+            else:
+                self._disk_size += len(data)
+            if self._disk_size > self.disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        files = sorted(self._scan_disk())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_size = total
+
+    def _load_from_disk(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # LRU : un fichier lu redevient récent
+            return data
+        except OSError:
+            return None
+
+    # --- API ---
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return data
+        data = self._load_from_disk(key)
+        if data is not None:
+            self.hits["disk"] += 1
+            self._remember(key, data)
+            return data
+        self.misses += 1
+        return None
+
+    def put(self, key, data):
+        self._remember(key, data)
+        self._store_on_disk(key, data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+            }
+
+
+# === Masques du cou par image ===
+def serialize_mask(neck):
+    buffer = io.BytesIO()
+    if neck is NO_NECK:
+        np.savez(buffer, mask=np.zeros((0, 0), dtype=np.uint8), meta=np.zeros(5))
+    else:
+        meta = np.array([*neck.image_shape, neck.scale, *neck.pad], dtype=np.float64)
+        np.savez(buffer, mask=neck.mask, meta=meta)
+    return buffer.getvalue()
+
+
+def deserialize_mask(data):
+    with np.load(io.BytesIO(data)) as archive:
+        mask, meta = archive["mask"], archive["meta"]
+    if mask.size == 0:
+        return NO_NECK
+    height, width, scale, pad_x, pad_y = meta
+    return NeckMask(mask, (int(height), int(width)), scale, (pad_x, pad_y))
+
+
+class MaskCache:
+    """Masques du cou indexés par le hash de l'image (et l'identité du modèle)."""
+
+    def __init__(self, memory_bytes=MASK_MEMORY_BYTES, disk_bytes=MASK_DISK_BYTES, directory=CACHE_DIR):
+        self.store = TieredCache("masks", memory_bytes, disk_bytes, directory)
+
+    def get(self, key):
+        data = self.store.get(key)
+        return None if data is None else deserialize_mask(data)
+
+    def put(self, key, neck):
+        self.store.put(key, serialize_mask(neck))
+
+    def stats(self):
+        return self.store.stats()
+
+
+result_cache = TieredCache("results", RESULT_MEMORY_BYTES, RESULT_DISK_BYTES)
+mask_cache = MaskCache()
@@ -4,6 +4,6 @@
 source /root/miniconda3/etc/profile.d/conda.sh
 conda activate py310
 
-# Lance gunicorn
-exec gunicorn -w 4 -b 127.0.0.1:8000 app:app
+# Lance gunicorn (nombre de workers : gunicorn.conf.py, un par cœur)
+exec gunicorn --config ../gunicorn.conf.py -b 127.0.0.1:8000 app:app
 
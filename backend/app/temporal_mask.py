@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+
+# === Masque du cou sur une séquence : inférence sur images clés + flot optique ===
+# YOLO ne tourne que sur les images clés ; entre deux, le masque de la dernière
+# image clé est déplacé par la transformation (similitude) estimée par flot
+# optique clairsemé (Lucas-Kanade) sur une version réduite de la frame.
+# Nouvelle image clé : intervalle atteint, mouvement ou dérive trop grands,
+# ou suivi peu fiable (trop peu de points retrouvés / cohérents).
+TEMPORAL_KEYFRAME_INTERVAL = max(1, int(os.environ.get("TEMPORAL_KEYFRAME_INTERVAL", "10")))
+# Déplacement d'une frame à l'autre (fraction de la largeur) au-delà duquel on relance YOLO
+TEMPORAL_MAX_MOTION = float(os.environ.get("TEMPORAL_MAX_MOTION", "0.05"))
+# Dérive cumulée depuis l'image clé (translation, en fraction de la largeur, ou variation d'échelle)
+TEMPORAL_MAX_DRIFT = float(os.environ.get("TEMPORAL_MAX_DRIFT", "0.15"))
+# Part minimale de points suivis et cohérents avec la transformation estimée
+TEMPORAL_MIN_CONFIDENCE = float(os.environ.get("TEMPORAL_MIN_CONFIDENCE", "0.5"))
+# Largeur de travail du flot optique (pixels)
+TEMPORAL_TRACK_WIDTH = int(os.environ.get("TEMPORAL_TRACK_WIDTH", "320"))
+
+TRACK_MAX_CORNERS = 200
+TRACK_MIN_POINTS = 12
+# Erreur aller-retour maximale (pixels de l'image réduite) d'un point suivi
+TRACK_MAX_FB_ERROR = 1.0
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+
+class Track:
+    """Résultat du suivi d'une frame : image clé ou transformation depuis la précédente."""
+
+    def __init__(self, keyframe, reason, step=None, cumulative=None, confidence=1.0):
+        self.keyframe = keyframe
+        self.reason = reason            # first, interval, motion, drift, lost (images clés) ou tracked
+        self.step = step                # 2x3, frame précédente -> frame courante
+        self.cumulative = cumulative    # 2x3, image clé -> frame courante
+        self.confidence = confidence
+
+    def transform_points(self, points):
+        """Déplace des points {nom: [x, y]} de la frame précédente vers la frame courante."""
+        if self.step is None or points is None:
+            return points
+        return {
+            name: [float(v) for v in self.step @ np.array([p[0], p[1], 1.0])]
+            for name, p in points.items()
+        }
+
+
+def _compose(outer, inner):
+    """outer ∘ inner pour des affinités 2x3."""
+    return (np.vstack([outer, [0, 0, 1]]) @ np.vstack([inner, [0, 0, 1]]))[:2]
+
+
+IDENTITY = np.float64([[1, 0, 0], [0, 1, 0]])
+
+
+class TemporalNeckTracker:
+    """
+    Suivi du cou d'une séquence. `track(image)` décide si la frame est une image
+    clé ; `neck_mask(track, infer)` appelle `infer()` (inférence YOLO) sur les
+    images clés et déplace le dernier masque sinon. Une instance par flux.
+    """
+
+    def __init__(self, interval=TEMPORAL_KEYFRAME_INTERVAL, max_motion=TEMPORAL_MAX_MOTION,
+                 max_drift=TEMPORAL_MAX_DRIFT, min_confidence=TEMPORAL_MIN_CONFIDENCE,
+                 track_width=TEMPORAL_TRACK_WIDTH):
+        self.interval = interval
+        self.max_motion = max_motion
+        self.max_drift = max_drift
+        self.min_confidence = min_confidence
+        self.track_width = track_width
+        self.reset()
+
+    def reset(self):
+        self._gray = None
+        self._points = None
+        self._shape = None
+        self._cumulative = IDENTITY
+        self._since_key = 0
+        self._next_points = None
+        self._key_neck = None
+        self._key_inferred = False
+        self.keyframes = 0
+        self.frames = 0
+
+    def _prepare(self, image):
+        h, w = image.shape[:2]
+        factor = min(1.0, self.track_width / w)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        if factor < 1.0:
+            gray = cv2.resize(gray, (int(round(w * factor)), int(round(h * factor))), interpolation=cv2.INTER_AREA)
+        return gray, factor
+
+    def _features(self, gray):
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=TRACK_MAX_CORNERS, qualityLevel=0.01, minDistance=7)
+        return points if points is not None else np.empty((0, 1, 2), np.float32)
+
+    def _estimate(self, gray):
+        """Similitude frame précédente -> courante (image réduite) et confiance, ou (None, 0)."""
+        if self._points is None or len(self._points) < TRACK_MIN_POINTS:
+            return None, 0.0
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, self._points, None, **LK_PARAMS)
+        backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._gray, forward, None, **LK_PARAMS)
+        fb_error = np.linalg.norm((self._points - backward).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < TRACK_MAX_FB_ERROR)
+        if good.sum() < TRACK_MIN_POINTS:
+            return None, good.mean()
+        src, dst = self._points[good], forward[good]
+        step, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=2.0)
+        if step is None:
+            return None, 0.0
+        confidence = float(inliers.sum()) / len(self._points)
+        # Les inliers servent de points pour la frame suivante
+        self._next_points = dst[inliers.ravel() == 1].reshape(-1, 1, 2)
+        return step, confidence
+
+    def track(self, image):
+        with metrics.timer("optical_flow"):
+            gray, factor = self._prepare(image)
+            width = image.shape[1]
+            self.frames += 1
+
+            reason, step, confidence = None, None, 1.0
+            if self._gray is None or self._shape != image.shape[:2]:
+                reason = "first"
+            else:
+                small_step, confidence = self._estimate(gray)
+                if small_step is None or confidence < self.min_confidence:
+                    reason = "lost"
+                else:
+                    # Image réduite -> pleine résolution : seule la translation change d'échelle
+                    step = small_step.astype(np.float64)
+                    step[:, 2] /= factor
+                    cumulative = _compose(step, self._cumulative)
+                    scale_change = abs(np.hypot(cumulative[0, 0], cumulative[1, 0]) - 1)
+                    if np.hypot(*step[:, 2]) > self.max_motion * width:
+                        reason = "motion"
+                    elif np.hypot(*cumulative[:, 2]) > self.max_drift * width or scale_change > self.max_drift:
+                        reason = "drift"
+                    elif self._since_key + 1 >= self.interval:
+                        reason = "interval"
+
+            self._gray, self._shape = gray, image.shape[:2]
+            if reason is not None:
+                self._points = self._features(gray)
+                self._cumulative = IDENTITY
+                self._since_key = 0
+                self.keyframes += 1
+                return Track(True, reason, step=step, cumulative=IDENTITY, confidence=confidence)
+
+            self._cumulative = cumulative
+            self._since_key += 1
+            # Trop de points perdus : on en recherche sur la frame courante
+            self._points = self._next_points if len(self._next_points) >= 2 * TRACK_MIN_POINTS else self._features(gray)
+            return Track(False, "tracked", step=step, cumulative=cumulative, confidence=confidence)
+
+    def neck_mask(self, track, infer):
+        """Masque de la frame : inférence sur image clé, masque de l'image clé déplacé sinon."""
+        if track.keyframe or not self._key_inferred:
+            self._key_neck = infer()
+            self._key_inferred = True
+            return self._key_neck
+        # Pas de cou sur l'image clé : pas de cou jusqu'à la suivante
+        return None if self._key_neck is None else self._key_neck.transformed(track.cumulative)
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "keyframe_ratio": self.keyframes / self.frames if self.frames else 0.0,
+        }
+
+
+# === Comparaison sur une vidéo : inférence à chaque frame contre images clés ===
+def _read_video(path, limit=None, width=None):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while limit is None or len(frames) < limit:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        if width and frame.shape[1] > width:
+            frame = cv2.resize(frame, (width, int(frame.shape[0] * width / frame.shape[1])), interpolation=cv2.INTER_AREA)
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def _render_sequence(frames, necklace_path, landmarks, tracker=None, writer=None):
+    import necklace2D
+    from landmarks import face_mesh_pool
+
+    start = time.perf_counter()
+    current = landmarks
+    placed = 0
+    for frame in frames:
+        track = tracker.track(frame) if tracker is not None else None
+        if landmarks is None:
+            # Landmarks serveur : FaceMesh sur les images clés, déplacés entre deux
+            if track is None or track.keyframe or current is None:
+                current = face_mesh_pool.detect(frame)
+            else:
+                current = track.transform_points(current)
+        if tracker is not None:
+            neck = tracker.neck_mask(track, lambda: necklace2D.get_neck_mask(frame))
+        else:
+            neck = necklace2D.get_neck_mask(frame)
+        output = frame
+        if current is not None:
+            try:
+                placement = necklace2D.place_on_neck(neck, current)
+                output = necklace2D.render_necklace(frame.copy(), necklace_path, placement)
+                placed += 1
+            except Exception:
+                pass
+        if writer is not None:
+            writer.write(output)
+    elapsed = time.perf_counter() - start
+    return {"frames": len(frames), "placed": placed, "seconds": elapsed, "fps": len(frames) / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Masque du cou sur une vidéo : chaque frame contre images clés + flot optique")
+    parser.add_argument("video")
+    parser.add_argument("--necklace", required=True, help="Chemin du collier PNG")
+    parser.add_argument("--landmarks", default=None, help="JSON {left_ear, right_ear, chin} fixe (sinon FaceMesh)")
+    parser.add_argument("--limit", type=int, default=300, help="Frames lues au maximum")
+    parser.add_argument("--width", type=int, default=1280, help="Largeur de travail")
+    parser.add_argument("--output", default=None, help="Vidéo composée (mode images clés)")
+    parser.add_argument("--report", default=None, help="Rapport JSON")
+    args = parser.parse_args()
+
+    frames = _read_video(args.video, args.limit, args.width)
+    if not frames:
+        raise SystemExit(f"❌ Vidéo illisible: {args.video}")
+    landmarks = json.loads(args.landmarks) if args.landmarks else None
+
+    baseline = _render_sequence(frames, args.necklace, landmarks)
+    print(f"🐢 Inférence à chaque frame: {baseline['fps']:.1f} fps")
+
+    writer = None
+    if args.output:
+        h, w = frames[0].shape[:2]
+        writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), 25, (w, h))
+    tracker = TemporalNeckTracker()
+    tracked = _render_sequence(frames, args.necklace, landmarks, tracker, writer)
+    if writer is not None:
+        writer.release()
+    tracked.update(tracker.stats())
+    print(
+        f"🐇 Images clés + flot optique: {tracked['fps']:.1f} fps "
+        f"(x{tracked['fps'] / baseline['fps']:.1f}), {tracked['keyframes']}/{tracked['frames']} images clés"
+    )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"every_frame": baseline, "keyframes": tracked}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import landmarks
+import necklace2D
+from necklace_cache import necklace_cache
+
+# === Préchauffage en arrière-plan ===
+# Le serveur répond (/health) dès son démarrage ; un thread charge le modèle,
+# précharge les colliers et lance une première inférence sur une image neutre
+# (allocations, JIT, fusion des couches) avant l'arrivée du premier client.
+WARMUP_ENABLED = os.environ.get("NECK_WARMUP", "1") == "1"
+NECKLACE_PRELOAD = os.environ.get("NECKLACE_PRELOAD", "1") == "1"
+
+PENDING, RUNNING, READY, FAILED, DISABLED = "pending", "running", "ready", "failed", "disabled"
+
+
+class Warmup:
+    def __init__(self):
+        self.necklace_dir = None
+        self.state = PENDING if WARMUP_ENABLED else DISABLED
+        self.timings = {}
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, necklace_dir):
+        self.necklace_dir = necklace_dir
+
+    def _timed(self, name, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.timings[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    def load(self):
+        """Colliers, mediapipe et modèle, sans inférence (sûr avant un fork)."""
+        if NECKLACE_PRELOAD and self.necklace_dir:
+            count = self._timed("necklace_preload", necklace_cache.preload, self.necklace_dir)
+            print(f"💍 {count} colliers préchargés en mémoire")
+        if landmarks.SERVER_LANDMARKS:
+            self._timed("landmarks_import", landmarks.available)
+        if necklace2D._model_loaded:
+            return necklace2D.get_model()
+        return self._timed("model_load", necklace2D.get_model)
+
+    def run(self):
+        """Préchauffage complet, dans le thread appelant."""
+        self.state, self.started_at, self.error = RUNNING, time.time(), None
+        try:
+            model = self.load()
+            if model is not None:
+                size = necklace2D.MODEL_IMGSZ
+                dummy = np.full((size, size, 3), 114, dtype=np.uint8)
+                with necklace2D._predict_lock:
+                    self._timed("first_inference", necklace2D.predict_neck_masks, model, [dummy])
+            self.state = READY
+            print(f"🔥 Préchauffage terminé: {self.timings}")
+        except Exception as e:
+            self.state, self.error = FAILED, str(e)
+            print(f"⚠️ Préchauffage en échec: {e}")
+        finally:
+            self.finished_at = time.time()
+
+    def start(self):
+        """Lance le préchauffage une fois par processus (idempotent, après un fork aussi)."""
+        if not WARMUP_ENABLED:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.state = PENDING
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def is_ready(self):
+        return self.state in (READY, DISABLED)
+
+    def status(self):
+        return {
+            "ready": self.is_ready(),
+            "state": self.state,
+            "timings_ms": dict(self.timings),
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "model": getattr(necklace2D.model, "name", None) if necklace2D._model_loaded else None,
+        }
+
+
+warmup = Warmup()
@@ -0,0 +1,249 @@
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import time
+
+# Mesures sans cache (sinon /apply-necklace ne rend qu'une fois par image) et
+# sans préchauffage en arrière-plan : le modèle est chargé avant les mesures.
+os.environ.setdefault("RESULT_CACHE", "0")
+os.environ.setdefault("NECK_WARMUP", "0")
+os.environ.setdefault("METRICS", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "app"))
+
+import cv2
+import numpy as np
+
+import necklace2D
+from mask_geometry import find_vertical_intersection
+from workload import (
+    DEFAULT_IMAGE, NECKLACE_DIR, SIZES, default_output, environment, list_necklaces, make_image, make_landmarks,
+)
+
+# === Banc de mesure du pipeline d'essayage ===
+# Matrice tailles d'image x colliers ; par cas : débit, latences p50/p95/p99 et
+# pic de RSS. Les résultats JSON se comparent d'un commit à l'autre (`compare`).
+BENCHMARKS = ("overlay_collar", "find_vertical_intersection", "detect_neck_mask", "apply_necklace_http")
+
+
+# --- Mémoire ---
+def reset_peak_rss():
+    """Remet le pic de RSS (VmHWM) au niveau courant ; Linux uniquement, sans effet ailleurs."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss : Ko sous Linux, octets sous macOS ; pic depuis le démarrage du processus
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+# --- Entrées synthétiques ---
+def make_neck_mask(size):
+    """Masque binaire d'un cou : colonne centrale évasée vers les épaules."""
+    width, height = size
+    mask = np.zeros((height, width), np.uint8)
+    top = int(height * 0.35)
+    pts = np.array([
+        [width * 0.40, top], [width * 0.60, top],
+        [width * 0.90, height - 1], [width * 0.10, height - 1],
+    ], np.int32)
+    cv2.fillConvexPoly(mask, pts, 255)
+    return mask
+
+
+def placement_for(size):
+    landmarks = make_landmarks(size)
+    return necklace2D.place_on_neck(None, landmarks)
+
+
+# --- Mesure ---
+def summarize(durations, peak_mb):
+    ms = np.array(durations) * 1000
+    total = float(np.sum(durations))
+    return {
+        "iterations": len(durations),
+        "throughput_per_s": len(durations) / total if total > 0 else None,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "peak_rss_mb": round(peak_mb, 1),
+    }
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    reset_peak_rss()
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, peak_rss_mb())
+
+
+def bench_overlay_collar(image, size, necklace_path):
+    left, right, chin = placement_for(size)
+    return lambda: necklace2D.overlay_collar(image.copy(), necklace_path, left, right, chin)
+
+
+def bench_find_vertical_intersection(size):
+    mask = make_neck_mask(size)
+    landmarks = make_landmarks(size)
+    points = [tuple(int(v) for v in landmarks[name]) for name in ("left_ear", "right_ear")]
+    height = size[1]
+    return lambda: [find_vertical_intersection(mask, point, height) for point in points]
+
+
+def bench_detect_neck_mask(image, size, model):
+    width, height = size
+    return lambda: necklace2D.detect_neck_mask(image, model, width, height)
+
+
+def bench_apply_necklace_http(client, image_bytes, size, necklace_name):
+    landmarks = json.dumps(make_landmarks(size))
+
+    def request():
+        response = client.post("/apply-necklace", data={
+            "image": (io.BytesIO(image_bytes), "bench.jpg"),
+            "necklace": necklace_name,
+            "landmarks": landmarks,
+        }, content_type="multipart/form-data")
+        if response.status_code != 200:
+            raise RuntimeError(f"/apply-necklace: {response.status_code} {response.get_data(as_text=True)[:200]}")
+
+    return request
+
+
+def run(args):
+    sizes = {name: SIZES[name] for name in args.sizes}
+    necklaces = list_necklaces(args.necklaces)
+    if not necklaces:
+        raise SystemExit(f"❌ Aucun collier trouvé dans {NECKLACE_DIR}")
+
+    model = necklace2D.get_model() if {"detect_neck_mask", "apply_necklace_http"} & set(args.only) else None
+    if model is None and "detect_neck_mask" in args.only:
+        print("⚠️ Modèle du cou indisponible : detect_neck_mask ignoré, /apply-necklace sans masque")
+    client = None
+    if "apply_necklace_http" in args.only:
+        from app import app
+
+        client = app.test_client()
+
+    cases = []
+
+    def record(benchmark, size_name, fn, necklace=None):
+        label = f"{benchmark}[{size_name}{'/' + necklace if necklace else ''}]"
+        try:
+            result = measure(fn, args.iterations, args.warmup)
+        except Exception as e:
+            print(f"❌ {label}: {e}")
+            result = {"error": str(e)}
+        else:
+            print(f"⏱️ {label}: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, "
+                  f"{result['throughput_per_s']:.1f}/s, pic RSS {result['peak_rss_mb']:.0f} Mo")
+        cases.append({"benchmark": benchmark, "size": size_name, "necklace": necklace, **result})
+
+    for size_name, size in sizes.items():
+        image = make_image(args.image, size)
+        image_bytes = necklace2D.encode_image(image)
+        if "find_vertical_intersection" in args.only:
+            record("find_vertical_intersection", size_name, bench_find_vertical_intersection(size))
+        if "detect_neck_mask" in args.only and model is not None:
+            record("detect_neck_mask", size_name, bench_detect_neck_mask(image, size, model))
+        for necklace in necklaces:
+            necklace_path = os.path.join(NECKLACE_DIR, necklace)
+            if "overlay_collar" in args.only:
+                record("overlay_collar", size_name, bench_overlay_collar(image, size, necklace_path), necklace)
+            if client is not None:
+                record("apply_necklace_http", size_name,
+                       bench_apply_necklace_http(client, image_bytes, size, necklace), necklace)
+
+    return {
+        "environment": environment(),
+        "config": {"iterations": args.iterations, "warmup": args.warmup, "sizes": sizes, "image": args.image},
+        "cases": cases,
+    }
+
+
+# --- Comparaison de deux rapports ---
+def _case_key(case):
+    return case["benchmark"], case["size"], case.get("necklace")
+
+
+def compare(baseline_path, candidate_path, metric="p50_ms", threshold=0.10):
+    """Affiche l'écart par cas ; retourne les cas plus lents de plus de `threshold`."""
+    with open(baseline_path) as f:
+        baseline = {_case_key(c): c for c in json.load(f)["cases"]}
+    with open(candidate_path) as f:
+        candidate = {_case_key(c): c for c in json.load(f)["cases"]}
+
+    regressions = []
+    for key in sorted(set(baseline) & set(candidate), key=str):
+        before, after = baseline[key].get(metric), candidate[key].get(metric)
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        flag = "🔴" if change > threshold else ("🟢" if change < -threshold else "  ")
+        label = "/".join(part for part in key if part)
+        print(f"{flag} {label}: {before:.2f} -> {after:.2f} ({change:+.1%})")
+        if change > threshold:
+            regressions.append({"case": label, "before": before, "after": after, "change": change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de mesure du pipeline d'essayage de colliers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Mesurer et écrire un rapport JSON")
+    run_parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    run_parser.add_argument("--necklaces", nargs="+", default=None, help="Noms de fichiers (défaut : tous)")
+    run_parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    run_parser.add_argument("--iterations", type=int, default=20)
+    run_parser.add_argument("--warmup", type=int, default=2)
+    run_parser.add_argument("--image", default=DEFAULT_IMAGE, help="Photo de référence (redimensionnée)")
+    run_parser.add_argument("--output", default=None, help="Chemin du rapport JSON")
+
+    compare_parser = subparsers.add_parser("compare", help="Comparer deux rapports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--metric", default="p50_ms")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Régression tolérée (0.10 = 10 %%)")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        regressions = compare(args.baseline, args.candidate, args.metric, args.threshold)
+        if regressions:
+            raise SystemExit(f"❌ {len(regressions)} cas en régression (> {args.threshold:.0%})")
+        return
+
+    report = run(args)
+    output = args.output
+    if output is None:
+        output = default_output("pipeline", report["environment"]["commit"])
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Rapport écrit: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from workload import BACKEND_DIR, DEFAULT_IMAGE, SIZES, environment, make_image, make_landmarks
+
+# === Client de test du flux en direct (/live) ===
+# Remplace la caméra du navigateur : envoie des frames JPEG à cadence fixe (une
+# vidéo, ou une photo qui se balance avec des landmarks bruités comme ceux de
+# FaceMesh), reçoit les frames composées et mesure la cadence obtenue, les
+# frames perdues et la latence aller-retour. --serve lance l'application ici.
+SWAY_PIXELS = 0.03   # amplitude du balancement (fraction de la largeur)
+SWAY_PERIOD = 2.0    # secondes
+LANDMARK_NOISE_PX = 1.5
+
+
+def synthetic_frames(source, size, fps, count):
+    """Photo décalée sinusoïdalement : (JPEG, landmarks) pour `count` frames."""
+    base = make_image(source, size)
+    landmarks = make_landmarks(size)
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        dx = SWAY_PIXELS * size[0] * np.sin(2 * np.pi * i / (fps * SWAY_PERIOD))
+        shifted = cv2.warpAffine(base, np.float32([[1, 0, dx], [0, 1, 0]]), size, borderMode=cv2.BORDER_REPLICATE)
+        noisy = {
+            name: [x + dx + rng.normal(0, LANDMARK_NOISE_PX), y + rng.normal(0, LANDMARK_NOISE_PX)]
+            for name, (x, y) in landmarks.items()
+        }
+        frames.append((cv2.imencode(".jpg", shifted, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes(), noisy))
+    return frames
+
+
+def video_frames(path, size, count):
+    """Frames d'une vidéo (redimensionnées), landmarks à des positions proportionnelles."""
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        frames.append((cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes(), make_landmarks(size)))
+    capture.release()
+    if not frames:
+        raise SystemExit(f"❌ Vidéo illisible: {path}")
+    return frames
+
+
+def serve_in_background():
+    """Application Flask sur un port libre (serveur threadé de werkzeug) ; retourne l'URL ws://."""
+    sys.path.insert(0, os.path.join(BACKEND_DIR, "app"))
+    from werkzeug.serving import make_server
+
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"ws://127.0.0.1:{server.server_port}/live"
+
+
+def run(url, frames, fps, duration, server_landmarks=False):
+    try:
+        from simple_websocket import Client, ConnectionClosed
+    except ImportError:
+        raise SystemExit("❌ simple-websocket non installé (pip install flask-sock)")
+
+    ws = Client.connect(url)
+    sent_at = {}
+    latencies, server_latencies, timings = [], [], {}
+    counters = {"rendered": 0, "skipped": 0}
+    last_stats = {}
+    done = threading.Event()
+
+    def receive():
+        try:
+            while not done.is_set():
+                message = ws.receive(timeout=0.5)
+                if message is None or not isinstance(message, str):
+                    continue
+                data = json.loads(message)
+                if data["type"] == "frame":
+                    counters["rendered"] += 1
+                    if data["id"] in sent_at:
+                        latencies.append((time.perf_counter() - sent_at[data["id"]]) * 1000)
+                    server_latencies.append(data["latency_ms"])
+                    for name, value in data["timings"].items():
+                        timings.setdefault(name, []).append(value)
+                elif data["type"] == "skipped":
+                    counters["skipped"] += 1
+                elif data["type"] == "stats":
+                    last_stats.update(data)
+        except ConnectionClosed:
+            pass
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+
+    interval = 1.0 / fps
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < duration:
+        jpeg, landmarks = frames[sent % len(frames)]
+        meta = {"type": "frame", "id": sent}
+        if not server_landmarks:
+            meta["landmarks"] = landmarks
+        sent_at[sent] = time.perf_counter()
+        ws.send(json.dumps(meta))
+        ws.send(jpeg)
+        sent += 1
+        time.sleep(max(0.0, start + sent * interval - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    time.sleep(1.0)  # dernières réponses
+    done.set()
+    receiver.join()
+    ws.close()
+
+    def pct(values, q):
+        return float(np.percentile(values, q)) if values else None
+
+    return {
+        "sent": sent,
+        "rendered": counters["rendered"],
+        "skipped": counters["skipped"],
+        "dropped": sent - counters["rendered"] - counters["skipped"],
+        "input_fps": sent / elapsed,
+        "achieved_fps": counters["rendered"] / elapsed,
+        "server_fps": last_stats.get("fps"),
+        "rtt_p50_ms": pct(latencies, 50),
+        "rtt_p95_ms": pct(latencies, 95),
+        "server_latency_p50_ms": pct(server_latencies, 50),
+        "stages_mean_ms": {name: float(np.mean(values)) for name, values in sorted(timings.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client de test du flux en direct /live")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="ex. ws://127.0.0.1:8000/live")
+    target.add_argument("--serve", action="store_true", help="Lancer l'application dans ce processus")
+    parser.add_argument("--necklace", default="necklace2k.png")
+    parser.add_argument("--video", default=None, help="Vidéo source (sinon photo balancée)")
+    parser.add_argument("--image", default=DEFAULT_IMAGE)
+    parser.add_argument("--size", choices=list(SIZES), default="720p")
+    parser.add_argument("--fps", type=float, default=30.0, help="Cadence d'envoi")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--server-landmarks", action="store_true", help="Ne pas envoyer de landmarks")
+    parser.add_argument("--output", default=None, help="Rapport JSON")
+    args = parser.parse_args()
+
+    size = SIZES[args.size]
+    count = int(args.fps * SWAY_PERIOD)
+    frames = video_frames(args.video, size, count) if args.video else synthetic_frames(args.image, size, args.fps, count)
+    url = serve_in_background() if args.serve else args.url
+    url = f"{url}{'&' if '?' in url else '?'}necklace={args.necklace}"
+
+    result = run(url, frames, args.fps, args.duration, args.server_landmarks)
+    print(
+        f"🎥 {result['sent']} frames envoyées ({result['input_fps']:.1f} fps), {result['rendered']} rendues "
+        f"({result['achieved_fps']:.1f} fps), {result['dropped']} remplacées, {result['skipped']} sans rendu"
+    )
+    if result["rtt_p50_ms"] is not None:
+        print(f"⏱️ Aller-retour p50 {result['rtt_p50_ms']:.0f} ms, p95 {result['rtt_p95_ms']:.0f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "config": vars(args), "result": result}, f, indent=2)
+        print(f"💾 Rapport écrit: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
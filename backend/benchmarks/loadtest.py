@@ -0,0 +1,409 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from workload import (
+    BACKEND_DIR, DEFAULT_IMAGE, EXAMPLE_IMAGES, RESULTS_DIR, SIZES, default_output, environment, list_necklaces,
+    make_image, make_landmarks,
+)
+
+# === Test de charge de /apply-necklace et courbes de saturation ===
+# Rejoue un mélange réaliste de requêtes (tailles, colliers, photos d'exemple ou
+# personnelles) à concurrence croissante, contre un serveur déjà lancé (--url)
+# ou contre des gunicorn démarrés ici pour chaque configuration workers x threads.
+# Avec NECK_MODEL_BACKEND=stub (défaut ici), l'inférence a une latence fixe :
+# file d'attente, parsing et compositing se lisent dans Server-Timing.
+DEFAULT_MIX = "720p=0.25,1080p=0.45,4mp=0.15,12mp=0.15"
+DEFAULT_CONCURRENCY = (1, 2, 4, 8, 16, 32)
+OVERLOAD_STATUSES = (None, 502, 503, 504)
+
+
+# --- Mélange de requêtes ---
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name not in SIZES:
+            raise SystemExit(f"❌ Taille inconnue dans le mélange: {name} (choix : {', '.join(SIZES)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def with_nonce(jpeg_bytes):
+    """Ajoute un segment commentaire JPEG unique : même image, autre hash (pas de cache)."""
+    nonce = uuid.uuid4().hex.encode()
+    return jpeg_bytes[:2] + b"\xff\xfe" + (len(nonce) + 2).to_bytes(2, "big") + nonce + jpeg_bytes[2:]
+
+
+class Workload:
+    """
+    Requêtes pré-encodées : les photos d'exemple sont envoyées telles quelles
+    (is_example=true, donc en cache après le premier rendu), les photos
+    personnelles sont redimensionnées selon le mélange et rendues uniques à
+    chaque envoi. `server_landmarks` : part des requêtes sans landmarks.
+    """
+
+    def __init__(self, mix, necklaces, example_ratio=0.3, server_landmarks=0.0, source=DEFAULT_IMAGE):
+        self.mix = mix
+        self.necklaces = necklaces
+        self.example_ratio = example_ratio
+        self.server_landmarks = server_landmarks
+        self.custom = {}
+        for name in mix:
+            image = make_image(source, SIZES[name])
+            self.custom[name] = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        self.examples = []
+        for path in EXAMPLE_IMAGES:
+            image = cv2.imread(path)
+            if image is not None:
+                with open(path, "rb") as f:
+                    self.examples.append((os.path.basename(path), f.read(), (image.shape[1], image.shape[0])))
+
+    def next(self, rng):
+        """(type, taille, collier, octets, landmarks ou None, is_example)."""
+        necklace = rng.choice(self.necklaces)
+        if self.examples and rng.random() < self.example_ratio:
+            name, data, size = rng.choice(self.examples)
+            return "example", name, necklace, data, make_landmarks(size), True
+        size_name = rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        landmarks = None if rng.random() < self.server_landmarks else make_landmarks(SIZES[size_name])
+        return "custom", size_name, necklace, with_nonce(self.custom[size_name]), landmarks, False
+
+
+def encode_multipart(fields, filename, data):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+        f"Content-Type: image/jpeg\r\n\r\n".encode()
+    )
+    parts.extend([data, f"\r\n--{boundary}--\r\n".encode()])
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def parse_server_timing(header):
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            try:
+                timings[name] = float(params[4:])
+            except ValueError:
+                pass
+    return timings
+
+
+# --- Générateur de charge (boucle fermée : chaque client renvoie dès la réponse reçue) ---
+def run_level(url, workload, concurrency, duration, seed, timeout=120):
+    target = urlsplit(url)
+    path = (target.path.rstrip("/") or "") + "/apply-necklace"
+    samples = []
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        conn = None
+        while time.perf_counter() < deadline:
+            kind, size, necklace, data, landmarks, is_example = workload.next(rng)
+            fields = {"necklace": necklace, "is_example": "true" if is_example else "false"}
+            if landmarks is not None:
+                fields["landmarks"] = json.dumps(landmarks)
+            body, content_type = encode_multipart(fields, "photo.jpg", data)
+            sent = time.perf_counter()
+            sample = {"kind": kind, "size": size, "bytes": len(data)}
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=timeout)
+                conn.request("POST", path, body=body, headers={"Content-Type": content_type})
+                response = conn.getresponse()
+                response.read()
+                sample.update(
+                    status=response.status,
+                    cache=response.getheader("X-Cache"),
+                    timings=parse_server_timing(response.getheader("Server-Timing")),
+                )
+                if response.getheader("Connection", "").lower() == "close":
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException) as e:
+                sample.update(status=None, error=type(e).__name__)
+                if conn is not None:
+                    conn.close()
+                conn = None
+            sample["latency_ms"] = (time.perf_counter() - sent) * 1000
+            samples.append(sample)
+        if conn is not None:
+            conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - start, concurrency)
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    return {f"p{q}_ms": float(np.percentile(values, q)) for q in (50, 95, 99)}
+
+
+def summarize(samples, elapsed, concurrency):
+    ok = [s for s in samples if s.get("status") == 200]
+    latencies = [s["latency_ms"] for s in ok]
+    stages = {}
+    queueing = []
+    for s in ok:
+        for name, duration in s["timings"].items():
+            stages.setdefault(name, []).append(duration)
+        if "total" in s["timings"]:
+            # Temps hors application : attente d'un worker gunicorn, réseau, envoi de l'upload
+            server = s["timings"]["total"] + s["timings"].get("upload_parse", 0.0)
+            queueing.append(max(s["latency_ms"] - server, 0.0))
+    statuses = {}
+    for s in samples:
+        key = str(s.get("status") or s.get("error"))
+        statuses[key] = statuses.get(key, 0) + 1
+    # Erreurs de capacité (connexion, timeout, 502-504) ; les refus applicatifs
+    # (collier trop grand pour la photo...) sont comptés à part
+    failed = sum(1 for s in samples if s.get("status") in OVERLOAD_STATUSES)
+    rejected = len(samples) - len(ok) - failed
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "ok": len(ok),
+        "error_rate": failed / len(samples) if samples else 0.0,
+        "rejected_rate": rejected / len(samples) if samples else 0.0,
+        "throughput_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+        **_percentiles(latencies),
+        "mean_ms": float(np.mean(latencies)) if latencies else None,
+        "queue_ms": _percentiles(queueing),
+        "stages_mean_ms": {name: float(np.mean(values)) for name, values in sorted(stages.items())},
+        "cache_hit_ratio": sum(1 for s in ok if s.get("cache") == "HIT") / len(ok) if ok else 0.0,
+        "by_kind_p50_ms": {
+            kind: _percentiles([s["latency_ms"] for s in ok if s["kind"] == kind])["p50_ms"]
+            for kind in sorted({s["kind"] for s in ok})
+        },
+        "statuses": statuses,
+    }
+
+
+# --- Serveurs gunicorn lancés pour chaque configuration ---
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class GunicornServer:
+    """gunicorn sur backend/gunicorn.conf.py, avec RENDER_WORKERS / GUNICORN_THREADS imposés."""
+
+    def __init__(self, workers, threads, env=None, log_path=None, ready_timeout=180):
+        self.workers = workers
+        self.threads = threads
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, **(env or {}), "RENDER_WORKERS": str(workers), "GUNICORN_THREADS": str(threads)}
+        self.log_path = log_path or os.devnull
+        self.ready_timeout = ready_timeout
+        self.process = None
+
+    def __enter__(self):
+        self._log = open(self.log_path, "ab")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py",
+             "--bind", f"127.0.0.1:{self.port}", "wsgi:app"],
+            cwd=BACKEND_DIR, env=self.env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        try:
+            self.wait_ready()
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def wait_ready(self):
+        """Attend /ready = 200 (modèle chargé et préchauffé dans les workers)."""
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn arrêté (code {self.process.returncode}), voir {self.log_path}")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=2)
+                conn.request("GET", "/ready")
+                status = conn.getresponse().status
+                conn.close()
+                if status == 200:
+                    return
+            except (OSError, http.client.HTTPException):
+                pass
+            time.sleep(0.5)
+        raise TimeoutError(f"{self.url} pas prêt après {self.ready_timeout} s")
+
+    def __exit__(self, *exc):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._log.close()
+
+
+def parse_config(value):
+    workers, _, threads = value.partition("x")
+    return int(workers), int(threads or 1)
+
+
+# --- Balayage ---
+def sweep(url, workload, args, label):
+    points = []
+    for concurrency in args.concurrency:
+        if args.warmup > 0:
+            run_level(url, workload, concurrency, args.warmup, args.seed)
+        point = run_level(url, workload, concurrency, args.duration, args.seed)
+        points.append(point)
+        p95 = point["p95_ms"]
+        print(
+            f"📈 {label} c={concurrency}: {point['throughput_rps']:.2f} req/s, "
+            f"p50 {point['p50_ms'] or 0:.0f} ms, p95 {p95 or 0:.0f} ms, "
+            f"attente p50 {point['queue_ms']['p50_ms'] or 0:.0f} ms, erreurs {point['error_rate']:.0%}, "
+            f"refus {point['rejected_rate']:.0%}"
+        )
+        if point["error_rate"] > args.max_error_rate or (p95 is not None and p95 > args.stop_p95_ms):
+            print(f"🛑 {label}: saturé à c={concurrency}, arrêt du balayage")
+            break
+    return points
+
+
+def capacity(points, slo_ms):
+    """Meilleur débit dont le p95 respecte l'objectif de latence."""
+    within = [p for p in points if p["p95_ms"] is not None and p["p95_ms"] <= slo_ms and p["error_rate"] == 0]
+    if not within:
+        return None
+    best = max(within, key=lambda p: p["throughput_rps"])
+    return {"throughput_rps": best["throughput_rps"], "concurrency": best["concurrency"], "p95_ms": best["p95_ms"]}
+
+
+def plot(report, path):
+    """Courbes débit / latence p95 par configuration (matplotlib optionnel)."""
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("⚠️ matplotlib non installé : pas de graphique")
+        return
+    fig, ax = plt.subplots(figsize=(8, 5))
+    for run in report["runs"]:
+        points = [p for p in run["points"] if p["p95_ms"] is not None]
+        ax.plot([p["throughput_rps"] for p in points], [p["p95_ms"] for p in points], marker="o", label=run["label"])
+        for p in points:
+            ax.annotate(str(p["concurrency"]), (p["throughput_rps"], p["p95_ms"]), fontsize=7)
+    ax.axhline(report["config"]["slo_ms"], color="grey", linestyle="--", linewidth=0.8)
+    ax.set_xlabel("Débit (requêtes/s)")
+    ax.set_ylabel("Latence p95 (ms)")
+    ax.set_yscale("log")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"🖼️ Graphique écrit: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de /apply-necklace (courbes de saturation)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Serveur déjà lancé (sinon gunicorn est démarré pour chaque --configs)")
+    target.add_argument("--configs", nargs="+", default=["1x4"], help="Configurations workers x threads, ex. 1x4 2x2")
+    parser.add_argument("--real-model", action="store_true", help="Modèle réel au lieu du modèle factice")
+    parser.add_argument("--stub-latency-ms", type=float, default=150.0)
+    parser.add_argument("--env", nargs="*", default=[], help="Variables KEY=VALUE pour les serveurs lancés")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=list(DEFAULT_CONCURRENCY))
+    parser.add_argument("--duration", type=float, default=20.0, help="Secondes mesurées par palier")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Secondes de chauffe par palier (non mesurées)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Tailles des photos personnelles et poids")
+    parser.add_argument("--example-ratio", type=float, default=0.3, help="Part des photos d'exemple")
+    parser.add_argument("--server-landmarks", type=float, default=0.0, help="Part des requêtes sans landmarks")
+    parser.add_argument("--necklaces", nargs="+", default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="Objectif de latence p95 pour la capacité")
+    parser.add_argument("--stop-p95-ms", type=float, default=15000.0, help="Arrêt du balayage au-delà")
+    parser.add_argument("--max-error-rate", type=float, default=0.2)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--plot", default=None, help="Chemin d'un PNG des courbes (matplotlib)")
+    args = parser.parse_args()
+
+    necklaces = list_necklaces(args.necklaces)
+    if not necklaces:
+        raise SystemExit("❌ Aucun collier sélectionné")
+    workload = Workload(parse_mix(args.mix), necklaces, args.example_ratio, args.server_landmarks)
+
+    runs = []
+    if args.url:
+        runs.append({"label": args.url, "points": sweep(args.url, workload, args, args.url)})
+    else:
+        server_env = dict(item.split("=", 1) for item in args.env)
+        server_env.setdefault("LOG_LEVEL", "WARNING")
+        if not args.real_model:
+            server_env.update(NECK_MODEL_BACKEND="stub", NECK_STUB_LATENCY_MS=str(args.stub_latency_ms))
+        for config in args.configs:
+            workers, threads = parse_config(config)
+            label = f"{workers}x{threads}"
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            log_path = os.path.join(RESULTS_DIR, f"gunicorn-{label}.log")
+            print(f"🚀 gunicorn {workers} worker(s) x {threads} thread(s)...")
+            with GunicornServer(workers, threads, server_env, log_path) as server:
+                points = sweep(server.url, workload, args, label)
+            runs.append({"label": label, "workers": workers, "threads": threads, "points": points})
+
+    for run in runs:
+        run["capacity"] = capacity(run["points"], args.slo_ms)
+        if run["capacity"]:
+            print(f"🎯 {run['label']}: {run['capacity']['throughput_rps']:.2f} req/s "
+                  f"à c={run['capacity']['concurrency']} (p95 {run['capacity']['p95_ms']:.0f} ms <= {args.slo_ms:.0f} ms)")
+        else:
+            print(f"🎯 {run['label']}: aucun palier sous l'objectif de {args.slo_ms:.0f} ms")
+
+    report = {
+        "environment": environment(),
+        "config": {
+            "model": "real" if args.real_model else f"stub ({args.stub_latency_ms:.0f} ms)",
+            "mix": workload.mix,
+            "example_ratio": args.example_ratio,
+            "server_landmarks": args.server_landmarks,
+            "necklaces": necklaces,
+            "duration_s": args.duration,
+            "seed": args.seed,
+            "slo_ms": args.slo_ms,
+        },
+        "runs": runs,
+    }
+    output = args.output or default_output("loadtest", report["environment"]["commit"])
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Rapport écrit: {output}")
+    if args.plot:
+        plot(report, args.plot)
+
+
+if __name__ == "__main__":
+    main()
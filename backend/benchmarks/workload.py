@@ -0,0 +1,81 @@
+import os
+import platform
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+# === Entrées communes aux bancs de mesure (images, landmarks, environnement) ===
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PROJECT_ROOT = os.path.dirname(BACKEND_DIR)
+NECKLACE_DIR = os.path.join(PROJECT_ROOT, "data", "usefull_necklace")
+EXAMPLE_IMAGES = [os.path.join(PROJECT_ROOT, "frontend", "public", name) for name in ("1.jpg", "2.jpg")]
+DEFAULT_IMAGE = EXAMPLE_IMAGES[0]
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+SIZES = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4mp": (2560, 1600),
+    "8mp": (3840, 2160),
+    "12mp": (4032, 3024),
+}
+
+
+def list_necklaces(names=None):
+    """Colliers PNG du catalogue (filtrés par `names` si fourni), triés."""
+    return sorted(
+        name for name in os.listdir(NECKLACE_DIR)
+        if name.lower().endswith(".png") and (not names or name in names)
+    )
+
+
+def make_image(source, size):
+    """Photo de référence redimensionnée (ou dégradé si absente), au format (largeur, hauteur)."""
+    width, height = size
+    base = cv2.imread(source) if source else None
+    if base is None:
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        base = np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                          np.full((height, width), 128, np.float32)]).astype(np.uint8)
+    return cv2.resize(base, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def make_landmarks(size):
+    """Oreilles et menton à des positions proportionnelles (visage centré, cou dégagé)."""
+    width, height = size
+    return {
+        "left_ear": [width * 0.38, height * 0.27],
+        "right_ear": [width * 0.62, height * 0.27],
+        "chin": [width * 0.50, height * 0.34],
+    }
+
+
+def environment(env_prefixes=("NECK_", "NECKLACE_", "OMP_")):
+    """Commit, versions et variables de configuration : de quoi comparer deux rapports."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "env": {k: v for k, v in os.environ.items() if k.startswith(tuple(env_prefixes))},
+    }
+
+
+def default_output(prefix, commit):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    return os.path.join(RESULTS_DIR, f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'nocommit'}.json")
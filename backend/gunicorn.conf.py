@@ -0,0 +1,28 @@
+import os
+import sys
+
+# Configuration gunicorn : un worker de rendu par cœur disponible. Avec plusieurs
+# workers, le modèle est chargé une seule fois dans le maître (preload_app) puis
+# partagé ; avec un seul, il est préchauffé en arrière-plan dans le worker.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+
+import render_workers  # noqa: E402
+
+preload_app = True
+workers = render_workers.worker_count()
+# Avant le préchargement de l'application, qui initialise OpenMP / ONNX dans le maître
+render_workers.limit_threads(workers)
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = 120
+
+# Plusieurs workers : les travaux asynchrones doivent être visibles de tous
+if workers > 1:
+    os.environ.setdefault("JOB_STORE", "sqlite")
+
+
+def pre_fork(server, worker):
+    render_workers.before_fork(server.cfg.workers)
+
+
+def post_fork(server, worker):
+    render_workers.after_fork(server.cfg.workers)
@@ -0,0 +1,173 @@
+import io
+import json
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import app as app_module
+import jobs
+import metrics
+import necklace2D
+import neck_model
+import result_cache
+import warmup
+
+LANDMARKS = json.dumps({"left_ear": [120, 150], "right_ear": [240, 150], "chin": [180, 215]})
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    """Client Flask sur le modèle factice, avec un cache de résultats vide et la file asynchrone active."""
+    monkeypatch.setattr(necklace2D, "model", neck_model.StubBackend(latency_ms=0))
+    monkeypatch.setattr(necklace2D, "_model_loaded", True)
+    monkeypatch.setattr(result_cache, "result_cache", result_cache.TieredCache("results", 1 << 22, 1 << 22, str(tmp_path)))
+    monkeypatch.setattr(jobs, "JOBS_ENABLED", True)
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    # Pas de préchauffage en arrière-plan pendant les tests
+    monkeypatch.setattr(app_module.warmup, "start", lambda: None)
+    return app_module.app.test_client()
+
+
+def photo(seed=0):
+    """Photo JPEG synthétique (un « visage » clair sur fond uni), différente pour chaque graine."""
+    image = np.full((480, 360, 3), 180, dtype=np.uint8)
+    cv2.circle(image, (180, 150), 60, (120, 140, 200 - seed), -1)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def form(image_bytes, **fields):
+    return {"image": (io.BytesIO(image_bytes), "photo.jpg"), "landmarks": LANDMARKS, **fields}
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def multipart_parts(response):
+    """(en-têtes, contenu) de chaque partie d'une réponse multipart/mixed."""
+    boundary = response.content_type.split("boundary=")[1].encode()
+    parts = []
+    for chunk in response.data.split(b"--" + boundary)[1:-1]:
+        head, _, payload = chunk.partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().strip().split("\r\n"))
+        parts.append((headers, payload[:-2]))
+    return parts
+
+
+# === /apply-necklace ===
+def test_apply_necklace_decodes_once_then_hits_cache(client, monkeypatch):
+    decoded = []
+    decode_image = necklace2D.decode_image
+    monkeypatch.setattr(necklace2D, "decode_image", lambda data: decoded.append(1) or decode_image(data))
+    image_bytes = photo()
+
+    response = client.post("/apply-necklace", data=form(image_bytes, necklace="collier1.png"))
+    assert response.status_code == 200 and response.content_type == "image/jpeg"
+    assert response.headers["X-Cache"] == "MISS"
+    assert len(decoded) == 1
+    assert not np.array_equal(decode(response.data), decode(image_bytes))
+
+    again = client.post("/apply-necklace", data=form(image_bytes, necklace="collier1.png"))
+    assert again.headers["X-Cache"] == "HIT" and again.data == response.data
+    assert len(decoded) == 1
+
+
+def test_apply_necklace_rejects_unreadable_image(client):
+    response = client.post("/apply-necklace", data=form(b"pas une image", necklace="collier1.png"))
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Image illisible"
+
+
+@pytest.mark.parametrize("name", ["../usefull_necklace/collier1.png", "/etc/passwd", "inconnu.png"])
+def test_apply_necklace_rejects_necklace_outside_catalogue(client, name):
+    response = client.post("/apply-necklace", data=form(photo(), necklace=name))
+    assert response.status_code == 400
+    assert "Collier introuvable" in response.get_json()["error"]
+
+
+# === /apply-necklaces ===
+def test_apply_necklaces_multipart(client):
+    names = ["collier1.png", "collier2.png"]
+    response = client.post("/apply-necklaces", data=form(photo(1), necklaces=",".join(names)))
+    assert response.status_code == 200 and response.content_type.startswith("multipart/mixed")
+    parts = multipart_parts(response)
+    assert [headers["Content-Disposition"].split('name="')[1].split('"')[0] for headers, _ in parts] == names
+    for headers, payload in parts:
+        assert headers["Content-Type"] == "image/jpeg" and headers["X-Cache"] == "MISS"
+        assert int(headers["Content-Length"]) == len(payload)
+        assert decode(payload).shape == (480, 360, 3)
+
+    again = multipart_parts(client.post("/apply-necklaces", data=form(photo(1), necklaces=",".join(names))))
+    assert [headers["X-Cache"] for headers, _ in again] == ["HIT", "HIT"]
+    assert [payload for _, payload in again] == [payload for _, payload in parts]
+
+
+def test_apply_necklaces_sprite(client):
+    names = ["collier1.png", "collier2.png", "collier3.png"]
+    response = client.post(
+        "/apply-necklaces", data=form(photo(2), necklaces=json.dumps(names), format="sprite", tile_width="120")
+    )
+    assert response.status_code == 200 and response.content_type == "image/jpeg"
+    layout = json.loads(response.headers["X-Sprite-Layout"])
+    assert [tile["necklace"] for tile in layout] == names
+    sprite = decode(response.data)
+    assert sprite.shape[:2] == (160, 360)
+    assert [(tile["x"], tile["width"], tile["height"]) for tile in layout] == [(0, 120, 160), (120, 120, 160), (240, 120, 160)]
+
+
+def test_apply_necklaces_rejects_bad_requests(client):
+    assert client.post("/apply-necklaces", data=form(photo(), necklaces="../collier1.png")).status_code == 400
+    assert client.post("/apply-necklaces", data=form(photo(), necklaces="")).status_code == 400
+    assert client.post("/apply-necklaces", data=form(photo(), necklaces="collier1.png", format="gif")).status_code == 400
+    response = client.post("/apply-necklaces", data=form(b"pas une image", necklaces="collier1.png"))
+    assert response.status_code == 400 and response.get_json()["error"] == "Image illisible"
+
+
+# === Mode asynchrone ===
+def test_job_lifecycle(client):
+    response = client.post("/jobs/apply-necklace", data=form(photo(3), necklace="collier1.png"))
+    assert response.status_code == 202
+    status_url = response.headers["Location"]
+    result_url = response.get_json()["result_url"]
+
+    deadline = time.monotonic() + 10
+    while client.get(status_url).get_json()["status"] not in (jobs.DONE, jobs.FAILED):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert client.get(status_url).get_json()["status"] == jobs.DONE
+
+    result = client.get(result_url)
+    assert result.status_code == 200 and result.content_type == "image/jpeg"
+    assert result.headers["X-Cache"] == "MISS"
+    assert decode(result.data).shape == (480, 360, 3)
+    assert client.get("/jobs/inconnu/result").status_code == 404
+
+
+def test_jobs_disabled(client, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_ENABLED", False)
+    response = client.post("/jobs/apply-necklace", data=form(photo(), necklace="collier1.png"))
+    assert response.status_code == 404
+
+
+# === Sondes ===
+def test_ready_after_warmup(client, monkeypatch):
+    state = warmup.Warmup()
+    monkeypatch.setattr(app_module, "warmup", state)
+    if warmup.WARMUP_ENABLED:
+        assert client.get("/ready").status_code == 503
+    state.run()
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json()["ready"] and response.get_json()["model"] == "stub"
+
+
+def test_metrics_exposes_renders_and_caches(client):
+    client.post("/apply-necklace", data=form(photo(4), necklace="collier1.png"))
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert 'tryon_renders_total{necklace="collier1.png",result="ok"}' in body
+    assert 'tryon_cache_misses_total{cache="results"}' in body
+    assert 'tryon_queue_depth{queue="jobs"}' in body
@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+
+from asset_compiler import feather_premultiplied
+from compositing import BLUR_KSIZE, BLUR_SIGMA, blend_into, blend_premultiplied_into, feather_alpha
+
+# Écart toléré (niveaux de gris) avec la boucle float64 d'origine de overlay_collar
+TOLERANCE = 2
+
+
+def reference_blend(image, warped):
+    """Boucle d'origine : alpha flouté en float64, canal par canal, troncature uint8."""
+    image = image.copy()
+    alpha = warped[:, :, 3] / 255.0
+    blurred_alpha = cv2.GaussianBlur(alpha, (BLUR_KSIZE, BLUR_KSIZE), sigmaX=BLUR_SIGMA)
+    for c in range(3):
+        image[:, :, c] = (
+            warped[:, :, c] * blurred_alpha + image[:, :, c] * (1 - blurred_alpha)
+        ).astype(np.uint8)
+    return image
+
+
+def random_case(seed, shape=(97, 131)):
+    """Fond et collier BGRA aléatoires ; alpha par blocs (0, 255 ou intermédiaire) pour avoir des bords nets."""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, shape + (3,), dtype=np.uint8)
+    warped = rng.integers(0, 256, shape + (4,), dtype=np.uint8)
+    blocks = rng.choice(np.array([0, 255, 128], dtype=np.uint8), size=(shape[0] // 8 + 1, shape[1] // 8 + 1))
+    alpha = np.kron(blocks, np.ones((8, 8), dtype=np.uint8))[:shape[0], :shape[1]]
+    noise = rng.integers(0, 256, shape, dtype=np.uint8)
+    warped[:, :, 3] = np.where(alpha == 128, noise, alpha)
+    return image, warped
+
+
+def max_diff(a, b):
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+def test_feather_alpha_matches_float64_blur():
+    for seed in range(5):
+        _, warped = random_case(seed)
+        expected = cv2.GaussianBlur(warped[:, :, 3] / 255.0, (BLUR_KSIZE, BLUR_KSIZE), sigmaX=BLUR_SIGMA)
+        feathered = feather_alpha(warped[:, :, 3], BLUR_KSIZE, BLUR_SIGMA)
+        assert feathered.dtype == np.float32
+        assert np.abs(feathered - expected).max() * 255 <= TOLERANCE
+
+
+def test_blend_into_matches_reference_loop():
+    for seed in range(5):
+        image, warped = random_case(seed)
+        expected = reference_blend(image, warped)
+        result = image.copy()
+        blend_into(result, warped, feather_alpha(warped[:, :, 3], BLUR_KSIZE, BLUR_SIGMA))
+        assert max_diff(result, expected) <= TOLERANCE
+
+
+def test_blend_into_on_roi_view_matches_reference_loop():
+    # overlay_collar fusionne dans une vue (ROI) de l'image : la vue non contiguë doit être modifiée en place
+    image, warped = random_case(7, shape=(200, 240))
+    expected = reference_blend(image[50:150, 60:200], warped[50:150, 60:200])
+    result = image.copy()
+    region = result[50:150, 60:200]
+    blend_into(region, warped[50:150, 60:200], feather_alpha(warped[50:150, 60:200, 3], BLUR_KSIZE, BLUR_SIGMA))
+    assert max_diff(result[50:150, 60:200], expected) <= TOLERANCE
+    assert np.array_equal(result[:50], image[:50])
+
+
+def test_blend_premultiplied_matches_reference_loop():
+    # Chemin des colliers compilés : alpha adouci et prémultiplié avant le warp
+    for seed in range(5):
+        image, warped = random_case(seed)
+        expected = reference_blend(image, warped)
+        result = image.copy()
+        blend_premultiplied_into(result, feather_premultiplied(warped))
+        assert max_diff(result, expected) <= TOLERANCE
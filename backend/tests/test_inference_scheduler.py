@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from inference_scheduler import InferenceScheduler, SchedulerClosed
+
+
+def test_batches_return_results_in_order():
+    scheduler = InferenceScheduler(lambda items: [item * 2 for item in items], max_batch_size=4, max_wait_ms=20)
+    futures = [scheduler.submit(i) for i in range(10)]
+    assert [future.result(timeout=5) for future in futures] == [i * 2 for i in range(10)]
+    assert scheduler.items == 10
+    scheduler.close()
+
+
+def test_batch_error_fails_every_future_of_the_batch():
+    def predict_batch(items):
+        raise ValueError("modèle en échec")
+
+    scheduler = InferenceScheduler(predict_batch, max_wait_ms=20)
+    futures = [scheduler.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    scheduler.close()
+
+
+def test_submit_after_close_raises():
+    scheduler = InferenceScheduler(lambda items: items)
+    scheduler.close()
+    scheduler.close()
+    with pytest.raises(SchedulerClosed):
+        scheduler.submit(1)
+
+
+def test_close_during_submits_leaves_no_pending_future():
+    # Chaque submit accepté doit être résolu, même quand close() arrive au milieu
+    for _ in range(20):
+        scheduler = InferenceScheduler(lambda items: items, max_batch_size=8, max_wait_ms=1)
+        accepted, start = [], threading.Event()
+
+        def producer():
+            start.wait()
+            for i in range(200):
+                try:
+                    accepted.append(scheduler.submit(i))
+                except SchedulerClosed:
+                    return
+
+        threads = [threading.Thread(target=producer) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        scheduler.close()
+        for thread in threads:
+            thread.join()
+        for future in accepted:
+            future.result(timeout=5)
+
+
+def test_neck_detection_resubmits_to_replacement_scheduler(monkeypatch):
+    import numpy as np
+
+    import necklace2D
+
+    closed = InferenceScheduler(lambda items: items)
+    closed.close()
+    replacement = InferenceScheduler(lambda items: [np.full(item.shape[:2], 255, np.uint8) for item in items])
+    model = object()
+    # Le modèle a changé entre la récupération du planificateur et la soumission
+    schedulers = iter([closed, replacement])
+    monkeypatch.setattr(necklace2D, "get_inference_scheduler", lambda m: next(schedulers))
+    monkeypatch.setattr(necklace2D, "get_model", lambda: model)
+    monkeypatch.setattr(necklace2D, "predict_neck_masks", lambda *args: pytest.fail("appel direct au modèle"))
+
+    neck = necklace2D._run_neck_detection(np.zeros((120, 160, 3), np.uint8), model)
+    assert neck is not None and replacement.items == 1
+    replacement.close()
@@ -0,0 +1,129 @@
+import numpy as np
+
+from mask_geometry import (
+    NeckMask, find_vertical_intersection, first_hit_below, row_extents, snap_to_neck_edges,
+)
+
+
+def neck_mask(shape=(120, 160)):
+    """Masque 0/255 : un cou (rectangle) et un bout d'épaule isolé à droite."""
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[60:, 50:110] = 255
+    mask[100:, 140:150] = 255
+    return mask
+
+
+def reference_first_hit_below(mask, x, y_start):
+    """Boucle du prototype (newdir/test.py)."""
+    for y in range(max(y_start, 0), mask.shape[0]):
+        if mask[y, x] == 255:
+            return y
+    return None
+
+
+# === Requêtes sur le masque image ===
+def test_first_hit_below_matches_loop():
+    mask = neck_mask()
+    rng = np.random.default_rng(0)
+    mask[rng.random(mask.shape) < 0.02] = 255
+    for x in range(mask.shape[1]):
+        for y_start in (-5, 0, 30, 59, 60, 61, 119):
+            assert first_hit_below(mask, x, y_start) == reference_first_hit_below(mask, x, y_start)
+
+
+def test_first_hit_below_outside_or_empty():
+    mask = neck_mask()
+    assert first_hit_below(mask, -1, 0) is None
+    assert first_hit_below(mask, mask.shape[1], 0) is None
+    assert first_hit_below(mask, 10, 0) is None          # colonne vide
+    assert first_hit_below(mask, 60, mask.shape[0]) is None
+    assert first_hit_below(mask > 0, 60, 0) == 60        # masque booléen accepté
+
+
+def test_row_extents():
+    mask = neck_mask()
+    assert row_extents(mask, 70) == (50, 109)
+    assert row_extents(mask, 110) == (50, 149)           # épaule incluse : bords extrêmes de la ligne
+    assert row_extents(mask, 10) is None
+    assert row_extents(mask, -1) is None
+    assert row_extents(mask, mask.shape[0]) is None
+
+
+def test_find_vertical_intersection():
+    mask = neck_mask()
+    assert find_vertical_intersection(mask, (60, 0)) == (60, 60)
+    assert find_vertical_intersection(mask, (60.7, 75.2)) == (60, 75)
+    assert find_vertical_intersection(mask, (145, 0)) == (145, 100)
+    assert find_vertical_intersection(mask, (145, 0), height=100) is None
+    assert find_vertical_intersection(mask, (10, 0)) is None
+
+
+def test_snap_to_neck_edges():
+    mask = neck_mask()
+    # Deux points : chacun sur le bord de son côté, à sa ligne
+    assert snap_to_neck_edges(mask, (60, 70), (100, 80)) == ((50, 70), (109, 80))
+    # Un seul point : l'autre est déduit de la même ligne
+    assert snap_to_neck_edges(mask, (60, 70), None) == ((50, 70), (109, 70))
+    assert snap_to_neck_edges(mask, None, (100, 80)) == ((50, 80), (109, 80))
+    # Ligne vide : point laissé tel quel, pas de déduction possible
+    assert snap_to_neck_edges(mask, (60, 10), None) == ((60, 10), None)
+    assert snap_to_neck_edges(mask, None, None) == (None, None)
+
+
+# === Masque à la résolution du modèle ===
+def model_mask(pad=(0, 10)):
+    """Le masque image de neck_mask() tel que le verrait le modèle (réduit de moitié puis letterboxé)."""
+    image_mask = neck_mask()
+    small = image_mask[::2, ::2]
+    mask = np.zeros((small.shape[0] + 2 * pad[1], small.shape[1] + 2 * pad[0]), dtype=np.uint8)
+    mask[pad[1]:pad[1] + small.shape[0], pad[0]:pad[0] + small.shape[1]] = small
+    return NeckMask(mask, image_mask.shape, 0.5, pad), image_mask
+
+
+def test_neck_mask_coordinates_round_trip():
+    neck, _ = model_mask()
+    for x, y in [(0, 0), (37, 81), (159, 119)]:
+        mx, my = neck.to_model(x, y)
+        assert np.allclose(neck.to_image(mx, my), (x, y))
+
+
+def test_neck_mask_matches_image_mask():
+    neck, image_mask = model_mask()
+    # Un pixel modèle couvre deux pixels image : les réponses restent à un pixel près
+    for x in range(0, 160, 7):
+        expected = find_vertical_intersection(image_mask, (x, 0))
+        found = neck.find_vertical_intersection((x, 0))
+        assert (expected is None) == (found is None)
+        if expected is not None:
+            assert found[0] == x and abs(found[1] - expected[1]) <= 1
+    for y in range(0, 120, 5):
+        expected, found = row_extents(image_mask, y), neck.row_extents(y)
+        assert (expected is None) == (found is None), y
+        if expected is not None:
+            assert abs(found[0] - expected[0]) <= 1 and abs(found[1] - expected[1]) <= 1
+
+
+def test_neck_mask_band_and_bounds():
+    neck, image_mask = model_mask()
+    full = neck.to_image_mask()
+    assert full.shape == image_mask.shape
+    assert np.mean(full != image_mask) < 0.02
+    assert np.array_equal(neck.band(40, 90), full[40:90])
+    assert neck.band(130, 140).shape == (0, 160)
+    assert neck.find_vertical_intersection((-1, 0)) is None
+    assert neck.find_vertical_intersection((60, 120)) is None
+    assert neck.row_extents(-1) is None
+
+
+def test_snap_to_neck_edges_accepts_neck_mask():
+    neck, image_mask = model_mask()
+    snapped = snap_to_neck_edges(neck, (60, 70), None)
+    expected = snap_to_neck_edges(image_mask, (60, 70), None)
+    assert all(abs(a - b) <= 1 for p, q in zip(snapped, expected) for a, b in zip(p, q))
+
+
+def test_neck_mask_transformed_translation():
+    neck, _ = model_mask()
+    # Décalage de 10 px image vers la droite = 5 px modèle
+    moved = neck.transformed([[1, 0, 10], [0, 1, 0]])
+    assert moved.row_extents(70) == tuple(v + 10 for v in neck.row_extents(70))
@@ -0,0 +1,86 @@
+import os
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+import asset_compiler
+import necklace2D
+import necklace_cache as necklace_cache_module
+
+NECKLACE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "usefull_necklace"
+)
+NECKLACE = os.path.join(NECKLACE_DIR, "collier1.png")
+# Largeurs qui ne sont pas des multiples de 8 (l'ancien pas des tranches de largeur)
+WIDTHS = (121, 203, 317, 501)
+
+
+def reference_overlay(image, collar_path, p1, p2):
+    """overlay_collar d'origine : PNG relu, redimensionné à la largeur exacte, warp plein cadre, boucle float64."""
+    collar = cv2.imread(collar_path, cv2.IMREAD_UNCHANGED)
+    width = necklace2D.compute_collar_width(p1, p2)
+    collar = cv2.resize(collar, (width, int(collar.shape[0] * width / collar.shape[1])), interpolation=cv2.INTER_AREA)
+    h, w = collar.shape[:2]
+    src_pts = np.float32([[0, 0], [w, 0], [0, h], [w, h]])
+    dy = abs(p2[1] - p1[1])
+    dst_pts = np.float32([p1, p2, (p1[0], p1[1] + h + dy), (p2[0], p2[1] + h + dy)])
+    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+    # Destination mise à zéro : BORDER_TRANSPARENT laisse intacts les pixels hors collier
+    warped = np.zeros(image.shape[:2] + (4,), dtype=np.uint8)
+    cv2.warpPerspective(collar, M, (image.shape[1], image.shape[0]), dst=warped, borderMode=cv2.BORDER_TRANSPARENT)
+    alpha = warped[:, :, 3] / 255.0
+    blurred_alpha = cv2.GaussianBlur(alpha, (15, 15), sigmaX=5)
+    for c in range(3):
+        image[:, :, c] = (warped[:, :, c] * blurred_alpha + image[:, :, c] * (1 - blurred_alpha)).astype(np.uint8)
+    return image
+
+
+def frame():
+    rng = np.random.default_rng(0)
+    image = cv2.resize(rng.integers(0, 256, (45, 60, 3), dtype=np.uint8), (1200, 900), interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def placements():
+    for width in WIDTHS:
+        p1 = (600 - width // 2, 200)
+        yield p1, (p1[0] + width, 207)
+
+
+def diff(a, b):
+    return np.abs(a.astype(np.int16) - b.astype(np.int16))
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    necklace2D.necklace_cache.clear()
+    yield necklace2D.necklace_cache
+    necklace2D.necklace_cache.clear()
+
+
+def test_png_path_matches_original_render(cache, monkeypatch):
+    monkeypatch.setattr(necklace_cache_module, "COMPILED_ENABLED", False)
+    image = frame()
+    for p1, p2 in placements():
+        expected = reference_overlay(image.copy(), NECKLACE, p1, p2)
+        result = necklace2D.overlay_collar(image.copy(), NECKLACE, p1, p2, (600, 150))
+        assert necklace2D.compute_collar_width(p1, p2) % 8
+        assert diff(result, expected).max() <= 2
+
+
+def test_compiled_path_matches_original_render(cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(necklace_cache_module, "COMPILED_ENABLED", True)
+    png = str(tmp_path / "collier1.png")
+    shutil.copy(NECKLACE, png)
+    asset_compiler.compile_necklace(png)
+    assert cache.get_compiled(png) is not None
+    image = frame()
+    for p1, p2 in placements():
+        expected = reference_overlay(image.copy(), png, p1, p2)
+        result = necklace2D.overlay_collar(image.copy(), png, p1, p2, (600, 150))
+        d = diff(result, expected)
+        # Flou appliqué avant le warp (et non après) : quelques niveaux d'écart sur les bords seulement
+        assert d.max() <= 12
+        assert d.mean() < 0.05
@@ -2,6 +2,14 @@
 
 echo "🏗️ Construction du frontend React..."
 
+# Compiler les colliers (rognés, projetables en mémoire) avant le pré-rendu qui les utilise
+echo "💍 Compilation des colliers..."
+python3 backend/app/asset_compiler.py || echo "⚠️ Compilation échouée : les PNG seront utilisés"
+
+# Pré-rendre les essayages des photos d'exemple (copiés dans dist/ par Vite)
+echo "🎨 Pré-rendu des photos d'exemple..."
+python3 backend/app/prerender.py || echo "⚠️ Pré-rendu échoué : les exemples seront rendus à la demande"
+
 # Aller dans le dossier frontend
 cd frontend
 
@@ -120,6 +120,18 @@ const PhotoTestView: React.FC = () => {
       try {
         let blob: Blob;
 
+        // Photo d'exemple : rendu pré-calculé au build, servi en fichier statique
+        const example = EXAMPLES.find((ex) => ex.src === image);
+        if (example) {
+          const exampleStem = example.src.split("/").pop()!.replace(/\.[^.]+$/, "");
+          const necklaceStem = selectedNecklace.replace(/\.[^.]+$/, "");
+          const prerendered = await fetch(`/prerendered/${exampleStem}/${necklaceStem}.jpg`);
+          if (prerendered.ok && prerendered.headers.get("content-type")?.startsWith("image/")) {
+            setProcessedImage(URL.createObjectURL(await prerendered.blob()));
+            return;
+          }
+        }
+
         const img = new Image();
         img.src = image;
         await img.decode();
@@ -145,6 +157,10 @@ const PhotoTestView: React.FC = () => {
         formData.append("image", new File([blob], "photo.jpg"));
         formData.append("necklace", selectedNecklace);
         formData.append("landmarks", JSON.stringify(detectedLandmarks));
+        if (example) {
+          formData.append("is_example", "true");
+          formData.append("example", example.src.split("/").pop()!);
+        }
 
         const res = await fetch("https://br-online.onrender.com/apply-necklace", {
           method: "POST",
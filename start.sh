@@ -3,4 +3,4 @@ echo "🚀 Démarrage avec Gunicorn..."
 echo "📁 Répertoire courant: $(pwd)"
 echo "🌐 Port: $PORT"
 cd backend
-gunicorn --bind 0.0.0.0:$PORT --workers 1 --timeout 120 --access-logfile - --error-logfile - wsgi:app
+gunicorn --config gunicorn.conf.py --bind 0.0.0.0:$PORT --access-logfile - --error-logfile - wsgi:app